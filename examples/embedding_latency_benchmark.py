@@ -0,0 +1,38 @@
+"""
+Microbenchmark of the query latency of the local hashing embeddings against the query length.
+
+The local embeddings (see HashingEmbeddings, embedding_backend="local") embed every ProductSearch query
+in-process, so their latency adds directly to the response time of a turn. No network is used.
+
+Usage:
+    python examples/embedding_latency_benchmark.py
+"""
+import time
+
+from salesgpt.embeddings import HashingEmbeddings
+
+QUERY = "Do you have the hybrid mattress in king size?"
+QUERY_WORDS = [9, 50, 200, 1000]
+QUERIES_PER_LENGTH = 1000
+
+
+def time_queries(embeddings, query):
+    """Returns the average seconds per embedded query."""
+    embeddings.embed_query(query)
+    started = time.perf_counter()
+    for _ in range(QUERIES_PER_LENGTH):
+        embeddings.embed_query(query)
+    return (time.perf_counter() - started) / QUERIES_PER_LENGTH
+
+
+def main():
+    embeddings = HashingEmbeddings()
+    words = QUERY.split()
+    print(f"{'words':>6} {'latency (us)':>13}")
+    for length in QUERY_WORDS:
+        query = " ".join(words[i % len(words)] for i in range(length))
+        print(f"{length:>6} {time_queries(embeddings, query) * 1e6:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Microbenchmark of the per-turn prompt assembly cost against the length of the conversation history.
+
+Compares rendering the sales conversation prompt with its langchain template on every turn against the
+precompiled prompt of the agent (see SalesGPT.compile_prompts), which renders the static parts once and
+only joins the turns added since the previous turn. No LLM is called.
+
+Usage:
+    python examples/prompt_assembly_benchmark.py
+"""
+import logging
+import time
+
+from langchain_community.chat_models import ChatLiteLLM
+
+from salesgpt.agents import SalesGPT
+from salesgpt.logger import logger
+
+HISTORY_LENGTHS = [10, 50, 100, 500, 1000, 5000]
+TURNS_PER_LENGTH = 100
+
+
+def template_messages(agent, state, static_inputs):
+    # what every turn did before the prompts were precompiled
+    prompt = agent.sales_conversation_utterance_chain.prompt.source
+    inputs = {
+        **static_inputs,
+        "conversation_history": "\n".join(state.conversation_history),
+    }
+    return prompt.format_messages(**{key: inputs[key] for key in prompt.input_variables})
+
+
+def precompiled_messages(agent, state, static_inputs):
+    return agent._prep_messages(state=state)
+
+
+def time_turns(assemble, agent, history_length, static_inputs):
+    """Returns the average seconds per turn of appending a turn and assembling the prompt."""
+    session = agent.new_session()
+    session.conversation_history.extend(
+        f"User: I have been sleeping badly for {i} weeks. <END_OF_TURN>"
+        for i in range(history_length)
+    )
+    assemble(agent, session.state, static_inputs)
+    started = time.perf_counter()
+    for i in range(TURNS_PER_LENGTH):
+        session.conversation_history.append(f"Ted Lasso: Question {i}? <END_OF_TURN>")
+        assemble(agent, session.state, static_inputs)
+    return (time.perf_counter() - started) / TURNS_PER_LENGTH
+
+
+def main():
+    # the timing log line of every call would dominate the measurement
+    logger.setLevel(logging.WARNING)
+    agent = SalesGPT.from_llm(ChatLiteLLM(model="gpt-3.5-turbo"), use_tools=False)
+    static_inputs = agent.static_prompt_inputs()
+
+    print(f"{'turns':>6} {'template (us)':>14} {'precompiled (us)':>17} {'speedup':>8}")
+    for history_length in HISTORY_LENGTHS:
+        template = time_turns(template_messages, agent, history_length, static_inputs)
+        precompiled = time_turns(
+            precompiled_messages, agent, history_length, static_inputs
+        )
+        print(
+            f"{history_length:>6} {template * 1e6:>14.1f} {precompiled * 1e6:>17.1f} "
+            f"{template / precompiled:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
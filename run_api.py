@@ -9,7 +9,17 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from salesgpt.salesgptapi import SalesGPTAPI
+from salesgpt.salesgptapi import SalesGPTAPI, prompt_cache_stats
+from salesgpt.sessions import (
+    MemorySessionStore,
+    MessageCoalescer,
+    ResponseReplayCache,
+    SessionBusyError,
+    SessionTurnQueue,
+    SpillingSessionStore,
+    SQLiteSessionStore,
+    StageAnalysisTracker,
+)
 
 # Load environment variables
 load_dotenv()
@@ -53,9 +63,53 @@ async def say_hello():
 class MessageList(BaseModel):
     session_id: str
     human_say: str
+    # idempotency key, a retried request with the same id gets the original response
+    request_id: Optional[str] = None
+
+
+def _optional_number(name: str, default: Optional[str], cast=int):
+    value = os.getenv(name, default)
+    return cast(value) if value not in (None, "", "0") else None
+
 
+# abandoned chats are evicted, so memory stays flat under sustained traffic
+# with SESSION_STORE=sqlite all uvicorn workers share the conversations
+# with SESSION_STORE=spill idle conversations are moved from memory to compressed snapshots on disk
+SESSION_STORE = os.getenv("SESSION_STORE", "memory").lower()
+if SESSION_STORE == "sqlite":
+    sessions = SQLiteSessionStore(
+        os.getenv("SESSION_DB_PATH", "sessions/sessions.sqlite"),
+        session_factory=SalesGPTAPI.from_dict,
+        ttl=_optional_number("SESSION_TTL_SECONDS", "3600", float),
+    )
+elif SESSION_STORE == "spill":
+    sessions = SpillingSessionStore(
+        os.getenv("SESSION_SPILL_DIRECTORY", "sessions/snapshots"),
+        session_factory=SalesGPTAPI.from_dict,
+        spill_after=_optional_number("SESSION_SPILL_AFTER_SECONDS", "300", float),
+        ttl=_optional_number("SESSION_TTL_SECONDS", "3600", float),
+        max_sessions=_optional_number("SESSION_MAX_COUNT", "10000"),
+        max_bytes=_optional_number("SESSION_MAX_BYTES", None),
+    )
+else:
+    sessions = MemorySessionStore(
+        max_sessions=_optional_number("SESSION_MAX_COUNT", "10000"),
+        ttl=_optional_number("SESSION_TTL_SECONDS", "3600", float),
+        max_bytes=_optional_number("SESSION_MAX_BYTES", None),
+    )
 
-sessions = {}
+# background stage analyses by session, so a restored session still waits for the previous turn's stage
+stage_analyses = StageAnalysisTracker()
+# concurrent messages of one session are answered one after another
+turns = SessionTurnQueue(max_pending=int(os.getenv("SESSION_MAX_PENDING", "4")))
+# messages of one session arriving within CHAT_DEBOUNCE_MS of each other are answered in one turn
+CHAT_DEBOUNCE_MS = int(os.getenv("CHAT_DEBOUNCE_MS", "0"))
+coalescer = MessageCoalescer(window=CHAT_DEBOUNCE_MS / 1000) if CHAT_DEBOUNCE_MS else None
+# responses of requests with a request_id, replayed to retries
+replays = ResponseReplayCache(
+    max_size=int(os.getenv("CHAT_REPLAY_CACHE_SIZE", "10000")),
+    ttl=_optional_number("CHAT_REPLAY_TTL_SECONDS", "600", float),
+)
 
 
 @app.get("/botname", response_model=None)
@@ -76,6 +130,50 @@ async def get_bot_name(authorization: Optional[str] = Header(None)):
     return {"name": name, "model": sales_api.sales_agent.model_name}
 
 
+@app.get("/sessions/stats")
+async def get_session_stats(authorization: Optional[str] = Header(None)):
+    if os.getenv("ENVIRONMENT") == "production":
+        get_auth_key(authorization)
+    stats = {
+        **sessions.stats(),
+        **turns.stats(),
+        **stage_analyses.stats(),
+        **replays.stats(),
+        **prompt_cache_stats(),
+    }
+    if coalescer is not None:
+        stats.update(coalescer.stats())
+    return stats
+
+
+def get_or_create_session(session_id: str) -> SalesGPTAPI:
+    sales_api = sessions.get(session_id)
+    if sales_api is not None:
+        print("Session is found!")
+        print(f"Are tools activated: {sales_api.sales_agent.use_tools}")
+        print(f"Session id: {session_id}")
+        return sales_api
+    print("Creating new session")
+    sales_api = SalesGPTAPI(
+        config_path=os.getenv("CONFIG_PATH", "examples/example_agent_setup.json"),
+        verbose=True,
+        product_catalog=os.getenv(
+            "PRODUCT_CATALOG", "examples/sample_product_catalog.txt"
+        ),
+        model_name=os.getenv("GPT_MODEL", "gpt-3.5-turbo-0613"),
+        use_tools=os.getenv("USE_TOOLS_IN_API", "True").lower()
+        in ["true", "1", "t"],
+        background_stage_analysis=os.getenv("STAGE_ANALYSIS", "inline").lower()
+        == "background",
+        stage_analysis_timeout=_optional_number(
+            "STAGE_ANALYSIS_TIMEOUT_SECONDS", None, float
+        ),
+    )
+    print(f"TOOLS?: {sales_api.sales_agent.use_tools}")
+    sessions.save(session_id, sales_api)
+    return sales_api
+
+
 @app.post("/chat")
 async def chat_with_sales_agent(req: MessageList, stream: bool = Query(False), authorization: Optional[str] = Header(None)):
     """
@@ -84,41 +182,26 @@ async def chat_with_sales_agent(req: MessageList, stream: bool = Query(False), a
     This endpoint receives a message from the user and returns the sales agent's response. It supports session management to maintain context across multiple interactions with the same user.
 
     Args:
-        req (MessageList): A request object containing the session ID and the message from the human user.
+        req (MessageList): A request object containing the session ID and the message from the human user, and optionally a request ID. A retried request with the same session ID and request ID receives the original response without running another turn.
         stream (bool, optional): A flag to indicate if the response should be streamed. Currently, streaming is not implemented.
 
     Returns:
         If streaming is requested, it returns a StreamingResponse object (not yet implemented). Otherwise, it returns the sales agent's response to the user's message.
 
+    Raises:
+        HTTPException: 429 if the session already has SESSION_MAX_PENDING messages waiting. Messages of one session are answered one at a time, and a message repeated while it is pending gets the pending response.
+        With CHAT_DEBOUNCE_MS set, messages sent in quick succession are answered together in one turn and every request of the burst receives that response.
+
     Note:
         Streaming functionality is planned but not yet available. The current implementation only supports synchronous responses.
     """
-    sales_api = None
     if os.getenv("ENVIRONMENT") == "production":
         get_auth_key(authorization)
     # print(f"Received request: {req}")
-    if req.session_id in sessions:
-        print("Session is found!")
-        sales_api = sessions[req.session_id]
-        print(f"Are tools activated: {sales_api.sales_agent.use_tools}")
-        print(f"Session id: {req.session_id}")
-    else:
-        print("Creating new session")
-        sales_api = SalesGPTAPI(
-            config_path=os.getenv("CONFIG_PATH", "examples/example_agent_setup.json"),
-            verbose=True,
-            product_catalog=os.getenv(
-                "PRODUCT_CATALOG", "examples/sample_product_catalog.txt"
-            ),
-            model_name=os.getenv("GPT_MODEL", "gpt-3.5-turbo-0613"),
-            use_tools=os.getenv("USE_TOOLS_IN_API", "True").lower()
-            in ["true", "1", "t"],
-        )
-        print(f"TOOLS?: {sales_api.sales_agent.use_tools}")
-        sessions[req.session_id] = sales_api
 
     # TODO stream not working
     if stream:
+        sales_api = get_or_create_session(req.session_id)
 
         async def stream_response():
             stream_gen = sales_api.do_stream(req.conversation_history, req.human_say)
@@ -127,9 +210,41 @@ async def chat_with_sales_agent(req: MessageList, stream: bool = Query(False), a
                 yield json.dumps(data).encode("utf-8") + b"\n"
 
         return StreamingResponse(stream_response())
-    else:
-        response = await sales_api.do(req.human_say)
-        return response
+
+    def queue_turn(human_say: str):
+        async def run_turn():
+            # loaded inside the session's turn so it sees the previous turn's state
+            sales_api = get_or_create_session(req.session_id)
+            await stage_analyses.wait(req.session_id, sales_api)
+            response = await sales_api.do(human_say)
+            stage_analyses.track(req.session_id, sales_api)
+            # the history grew, update the session's size. Stores that restore sessions may already
+            # hold a late stage decision of an earlier turn, which is merged instead of overwritten
+            sessions.update(req.session_id, sales_api.merge_into)
+            # persist the stage and summary once the background tasks have determined them, into
+            # whatever turn the store holds by then
+            for task in (sales_api.stage_task, sales_api.sales_agent.summary_task):
+                if task is not None and not task.done():
+                    task.add_done_callback(
+                        lambda task: task.cancelled()
+                        or task.exception()
+                        or sessions.update(req.session_id, sales_api.merge_into)
+                    )
+            return response
+
+        return turns.run(req.session_id, human_say, run_turn)
+
+    async def answer():
+        if coalescer is not None:
+            return await coalescer.submit(req.session_id, req.human_say, queue_turn)
+        return await queue_turn(req.human_say)
+
+    try:
+        if req.request_id is not None:
+            return await replays.run((req.session_id, req.request_id), answer)
+        return await answer()
+    except SessionBusyError as e:
+        raise HTTPException(status_code=429, detail=str(e))
 
 
 # Main entry point
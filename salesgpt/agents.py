@@ -1,13 +1,14 @@
 from copy import deepcopy
-from typing import Any, Callable, Dict, List, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 from langchain.agents import (
     AgentExecutor,
     LLMSingleActionAgent,
     create_openai_tools_agent,
 )
-from langchain.chains import LLMChain, RetrievalQA
+from langchain.chains import LLMChain
 from langchain.chains.base import Chain
+from langchain.prompts import ChatPromptTemplate
 from langchain_community.chat_models import ChatLiteLLM
 from langchain_core.agents import (
     _convert_agent_action_to_messages,
@@ -17,14 +18,34 @@ from langchain_core.language_models.llms import create_base_retry_decorator
 from litellm import acompletion
 from pydantic import Field
 
-from salesgpt.chains import SalesConversationChain, StageAnalyzerChain
+from salesgpt.chains import (
+    MESSAGE_ROLES,
+    ConversationSummaryChain,
+    SalesConversationChain,
+    StageAnalyzerChain,
+)
 from salesgpt.custom_invoke import CustomAgentExecutor
+from salesgpt.history import render_history, window_history
 from salesgpt.logger import time_logger
-from salesgpt.parsers import SalesConvoOutputParser
+from salesgpt.parsers import JointStageOutputParser, SalesConvoOutputParser
+from salesgpt.prefetch import PrefetchingRetriever
+from salesgpt.prompt_builder import PrecompiledChatPrompt
 from salesgpt.prompts import SALES_AGENT_TOOLS_PROMPT
+from salesgpt.stage_classifiers import (
+    ChainStageClassifier,
+    StageClassifier,
+    StageDecision,
+    build_stage_classifier,
+    format_conversation_stages,
+    record_stage_turns,
+    summarize_stage_path,
+)
 from salesgpt.stages import CONVERSATION_STAGES
+from salesgpt.state import ConversationState, SalesGPTSession
 from salesgpt.templates import CustomPromptTemplateForTools
+from salesgpt.tokens import encoding_name_for_model
 from salesgpt.tools import get_tools, setup_knowledge_base
+from salesgpt.usage import PromptCacheUsage, with_callback
 
 
 def _create_retry_decorator(llm: Any) -> Callable[[Any], Any]:
@@ -54,16 +75,39 @@ def _create_retry_decorator(llm: Any) -> Callable[[Any], Any]:
 
 
 class SalesGPT(Chain):
-    """Controller model for the Sales Agent."""
+    """
+    Controller model for the Sales Agent.
+
+    The conversation methods take an optional ConversationState. Without it they use and update the
+    conversation fields of the agent itself. With it the agent is only read, so one SalesGPT built per
+    configuration can serve any number of concurrent sessions, see new_session.
+    """
 
     conversation_history: List[str] = []
     conversation_stage_id: str = "1"
     current_conversation_stage: str = CONVERSATION_STAGES.get("1")
+    stage_analyzed_turns: int = 0
+    stage_path: List = []
+    conversation_summary: str = ""
+    summarized_turns: int = 0
+    rendered_history: Optional[Tuple] = None
     stage_analyzer_chain: StageAnalyzerChain = Field(...)
+    stage_classifier: Union[Any, None] = None
+    incremental_stage_analysis: bool = False
+    stage_analysis_max_new_turns: int = 4
+    stage_analysis_max_turn_chars: int = 2000
+    joint_stage_generation: bool = False
+    history_max_tokens: Optional[int] = None
+    history_pinned_turns: int = 2
+    conversation_summary_chain: Union[ConversationSummaryChain, None] = None
+    summarize_after_turns: Optional[int] = None
+    summary_keep_recent_turns: int = 6
+    summary_max_words: int = 150
     sales_agent_executor: Union[CustomAgentExecutor, None] = Field(...)
-    knowledge_base: Union[RetrievalQA, None] = Field(...)
+    knowledge_base: Union[Any, None] = Field(...)
     sales_conversation_utterance_chain: SalesConversationChain = Field(...)
     conversation_stage_dict: Dict = CONVERSATION_STAGES
+    prompt_cache_usage: Union[PromptCacheUsage, None] = None
 
     model_name: str = "gpt-3.5-turbo-0613"  # TODO - make this an env variable
 
@@ -118,109 +162,412 @@ class SalesGPT(Chain):
         return []
 
     @time_logger
-    def seed_agent(self):
+    def seed_agent(self, state: ConversationState = None):
         """
         This method seeds the conversation by setting the initial conversation stage and clearing the conversation history.
 
         The initial conversation stage is retrieved using the key "1". The conversation history is reset to an empty list.
 
+        Args:
+            state (ConversationState, optional): The conversation to seed. Defaults to the agent itself.
+
         Returns:
             None
         """
-        self.current_conversation_stage = self.retrieve_conversation_stage("1")
-        self.conversation_history = []
+        state = self if state is None else state
+        state.current_conversation_stage = self.retrieve_conversation_stage("1")
+        state.conversation_history = []
+        state.rendered_history = None
+        state.stage_analyzed_turns = 0
+        state.stage_path = []
+        state.conversation_summary = ""
+        state.summarized_turns = 0
+
+    def new_session(self) -> SalesGPTSession:
+        """
+        Starts a new conversation that shares this agent as its engine.
+
+        Returns:
+            SalesGPTSession: The seeded session.
+        """
+        session = SalesGPTSession(self, ConversationState())
+        session.seed_agent()
+        return session
+
+    def static_prompt_inputs(self) -> Dict[str, str]:
+        """
+        Returns the prompt inputs that are fixed for this agent configuration.
+
+        Returns:
+            Dict[str, str]: The persona, company and conversation stages inputs of the prompts.
+        """
+        return {
+            "salesperson_name": self.salesperson_name,
+            "salesperson_role": self.salesperson_role,
+            "company_name": self.company_name,
+            "company_business": self.company_business,
+            "company_values": self.company_values,
+            "conversation_purpose": self.conversation_purpose,
+            "conversation_type": self.conversation_type,
+            "conversation_stages": format_conversation_stages(
+                self.conversation_stage_dict
+            ),
+        }
+
+    def compile_prompts(self):
+        """
+        Precompiles the prompts of the stage analyzer and sales conversation chains.
+
+        The static inputs (see static_prompt_inputs) are rendered into the prompts once, so every turn only
+        renders the conversation history and the current stage, see PromptBuilder. Custom prompts are left
+        as they are. Call this again after changing the persona or the conversation stages of the agent.
+        """
+        static_inputs = self.static_prompt_inputs()
+        for chain in (self.stage_analyzer_chain, self.sales_conversation_utterance_chain):
+            if isinstance(chain.prompt, PrecompiledChatPrompt):
+                chain.prompt = chain.prompt.source
+            # custom prompts are a single message, see SalesConversationChain.from_llm
+            if (
+                isinstance(chain.prompt, ChatPromptTemplate)
+                and len(chain.prompt.messages) == 2
+            ):
+                chain.prompt = PrecompiledChatPrompt.from_chat_prompt(
+                    chain.prompt, static_inputs
+                )
+
+    def get_stage_classifier(self) -> StageClassifier:
+        """
+        Returns the classifier that determines the conversation stage.
+
+        Returns:
+            StageClassifier: The configured stage classifier, or one using the stage_analyzer_chain.
+        """
+        if self.stage_classifier is None:
+            return ChainStageClassifier(
+                self.stage_analyzer_chain, self.conversation_stage_dict
+            )
+        return self.stage_classifier
+
+    def _stage_analysis_inputs(
+        self, state: ConversationState
+    ) -> Tuple[List[str], Optional[str], int]:
+        history = state.conversation_history
+        if not self.incremental_stage_analysis:
+            return self._summarized_history(state), None, len(history)
+        analyzed = state.stage_analyzed_turns
+        if analyzed > len(history):
+            # the history was replaced since the last decision
+            analyzed = 0
+        new_turns = [
+            turn[: self.stage_analysis_max_turn_chars]
+            for turn in history[analyzed:][-self.stage_analysis_max_new_turns :]
+        ]
+        summary = summarize_stage_path(
+            state.stage_path, analyzed, self.conversation_stage_dict
+        )
+        if state.conversation_summary:
+            summary += f"\n{state.conversation_summary}"
+        return new_turns, summary, len(history)
+
+    def _apply_stage_decision(
+        self, decision: StageDecision, state: ConversationState, analyzed_turns: int
+    ):
+        if analyzed_turns < state.stage_analyzed_turns:
+            state.stage_analyzed_turns = 0
+            state.stage_path = []
+        record_stage_turns(
+            state.stage_path,
+            state.conversation_stage_id,
+            analyzed_turns - state.stage_analyzed_turns,
+        )
+        state.stage_analyzed_turns = analyzed_turns
+        print(
+            f"Stage classifier {decision.classifier} chose stage {decision.stage_id} "
+            f"(confidence {decision.confidence:.2f})"
+        )
+        state.conversation_stage_id = decision.stage_id
+        state.current_conversation_stage = self.retrieve_conversation_stage(
+            state.conversation_stage_id
+        )
+        print(f"Conversation Stage: {state.current_conversation_stage}")
 
     @time_logger
-    def determine_conversation_stage(self):
+    def determine_conversation_stage(self, state: ConversationState = None):
         """
         Determines the current conversation stage based on the conversation history.
 
-        This method uses the stage_analyzer_chain to analyze the conversation history and determine the current stage.
-        The conversation history is joined into a single string, with each entry separated by a newline character.
-        The current conversation stage ID is also passed to the stage_analyzer_chain.
+        The conversation history and the current conversation stage ID are passed to the stage classifier,
+        by default the stage_analyzer_chain (see get_stage_classifier). The chosen stage ID and the
+        corresponding conversation stage from the conversation_stage_dict dictionary are then stored.
+        With incremental_stage_analysis, only the turns since the last decision (at most
+        stage_analysis_max_new_turns) and a compact summary of the stages so far are sent, so the prompt
+        size stays constant however long the conversation runs.
+
+        Args:
+            state (ConversationState, optional): The conversation to analyze. Defaults to the agent itself.
 
-        The method then prints the determined conversation stage ID and retrieves the corresponding conversation stage
-        from the conversation_stage_dict dictionary using the retrieve_conversation_stage method.
+        Returns:
+            None
+        """
+        state = self if state is None else state
+        print(f"Conversation Stage ID before analysis: {state.conversation_stage_id}")
+        print("Conversation history:")
+        print(state.conversation_history)
+        turns, summary, analyzed_turns = self._stage_analysis_inputs(state)
+        decision = self.get_stage_classifier().classify(
+            turns, state.conversation_stage_id, summary
+        )
+        self._apply_stage_decision(decision, state, analyzed_turns)
 
-        Finally, the method prints the determined conversation stage.
+    @time_logger
+    async def adetermine_conversation_stage(self, state: ConversationState = None):
+        """
+        Asynchronously determines the current conversation stage based on the conversation history.
+
+        The conversation history and the current conversation stage ID are passed to the stage classifier,
+        by default the stage_analyzer_chain (see get_stage_classifier). The chosen stage ID and the
+        corresponding conversation stage from the conversation_stage_dict dictionary are then stored.
+        With incremental_stage_analysis, only the turns since the last decision (at most
+        stage_analysis_max_new_turns) and a compact summary of the stages so far are sent, so the prompt
+        size stays constant however long the conversation runs.
+
+        Args:
+            state (ConversationState, optional): The conversation to analyze. Defaults to the agent itself.
 
         Returns:
             None
         """
-        print(f"Conversation Stage ID before analysis: {self.conversation_stage_id}")
+        state = self if state is None else state
+        print(f"Conversation Stage ID before analysis: {state.conversation_stage_id}")
         print("Conversation history:")
-        print(self.conversation_history)
-        stage_analyzer_output = self.stage_analyzer_chain.invoke(
-            input={
-                "conversation_history": "\n".join(self.conversation_history).rstrip(
-                    "\n"
-                ),
-                "conversation_stage_id": self.conversation_stage_id,
-                "conversation_stages": "\n".join(
-                    [
-                        str(key) + ": " + str(value)
-                        for key, value in CONVERSATION_STAGES.items()
-                    ]
-                ),
-            },
-            return_only_outputs=False,
+        print(state.conversation_history)
+        turns, summary, analyzed_turns = self._stage_analysis_inputs(state)
+        decision = await self.get_stage_classifier().aclassify(
+            turns, state.conversation_stage_id, summary
         )
-        print("Stage analyzer output")
-        print(stage_analyzer_output)
-        self.conversation_stage_id = stage_analyzer_output.get("text")
+        self._apply_stage_decision(decision, state, analyzed_turns)
+
+    def format_conversation_history(self, state: ConversationState = None) -> str:
+        """
+        Formats the conversation history for the sales conversation prompts.
+
+        Turns already folded into the running conversation summary are replaced by the summary. Without
+        history_max_tokens all other turns are used. Otherwise the history is fit into that many tokens:
+        the first history_pinned_turns turns (or the summary) and the most recent turns are kept, see
+        window_history.
+
+        Args:
+            state (ConversationState, optional): The conversation. Defaults to the agent itself.
 
-        self.current_conversation_stage = self.retrieve_conversation_stage(
-            self.conversation_stage_id
+        Returns:
+            str: The turns to put into the prompt, one per line.
+        """
+        state = self if state is None else state
+        if self.history_max_tokens is None:
+            # the history only grows, so only the new turns are joined, see render_history
+            text = render_history(state, state.summarized_turns)
+            if not state.summarized_turns:
+                return text
+            return "\n".join([self._summary_line(state)] + ([text] if text else []))
+        history = window_history(
+            self._summarized_history(state),
+            self.history_max_tokens,
+            pinned_turns=1 if state.summarized_turns else self.history_pinned_turns,
+            encoding_name=encoding_name_for_model(self.model_name),
         )
+        return "\n".join(history)
+
+    def _summary_line(self, state: ConversationState) -> str:
+        return f"Summary of the earlier conversation: {state.conversation_summary}"
+
+    def _summarized_history(self, state: ConversationState) -> List[str]:
+        if not state.summarized_turns:
+            return state.conversation_history
+        return [self._summary_line(state)] + state.conversation_history[
+            state.summarized_turns :
+        ]
 
-        print(f"Conversation Stage: {self.current_conversation_stage}")
+    def needs_summary(self, state: ConversationState = None) -> bool:
+        """
+        Whether enough turns have accumulated since the last summary to summarize them.
+
+        Args:
+            state (ConversationState, optional): The conversation. Defaults to the agent itself.
+
+        Returns:
+            bool: True if summarize_after_turns is set and the history has more than that many turns that
+            are not in the summary yet.
+        """
+        state = self if state is None else state
+        if self.summarize_after_turns is None:
+            return False
+        unsummarized = len(state.conversation_history) - state.summarized_turns
+        return unsummarized > max(self.summarize_after_turns, self.summary_keep_recent_turns)
+
+    def _summary_inputs(self, state: ConversationState) -> Optional[Dict[str, Any]]:
+        start = state.summarized_turns
+        end = len(state.conversation_history) - self.summary_keep_recent_turns
+        if end <= start:
+            return None
+        return {
+            "salesperson_name": self.salesperson_name,
+            "conversation_summary": state.conversation_summary or "Nothing yet.",
+            "new_turns": "\n".join(state.conversation_history[start:end]),
+            "max_words": self.summary_max_words,
+            "span": (start, end),
+        }
+
+    def _apply_summary(
+        self, output: Dict[str, Any], span: Tuple[int, int], state: ConversationState
+    ) -> bool:
+        start, end = span
+        if state.summarized_turns != start or len(state.conversation_history) < end:
+            # the conversation was reset or summarized by someone else meanwhile
+            return False
+        state.conversation_summary = output["text"].strip()
+        state.summarized_turns = end
+        if self.verbose:
+            print(f"Conversation summary of {end} turns: {state.conversation_summary}")
+        return True
 
     @time_logger
-    async def adetermine_conversation_stage(self):
+    def summarize_conversation(self, state: ConversationState = None) -> bool:
         """
-        Determines the current conversation stage based on the conversation history.
+        Folds all but the summary_keep_recent_turns most recent turns into the running conversation summary.
 
-        This method uses the stage_analyzer_chain to analyze the conversation history and determine the current stage.
-        The conversation history is joined into a single string, with each entry separated by a newline character.
-        The current conversation stage ID is also passed to the stage_analyzer_chain.
+        The prompts then use the summary instead of the summarized turns, so their size stays bounded however
+        long the conversation runs. The history itself is kept.
 
-        The method then prints the determined conversation stage ID and retrieves the corresponding conversation stage
-        from the conversation_stage_dict dictionary using the retrieve_conversation_stage method.
+        Args:
+            state (ConversationState, optional): The conversation. Defaults to the agent itself.
+
+        Returns:
+            bool: Whether the summary was updated.
+        """
+        state = self if state is None else state
+        inputs = self._summary_inputs(state)
+        if inputs is None:
+            return False
+        span = inputs.pop("span")
+        output = self.conversation_summary_chain.invoke(inputs)
+        return self._apply_summary(output, span, state)
 
-        Finally, the method prints the determined conversation stage.
+    @time_logger
+    async def asummarize_conversation(self, state: ConversationState = None) -> bool:
+        """
+        Asynchronously folds all but the most recent turns into the running conversation summary.
+
+        Failures are logged and leave the summary unchanged, so it is safe to run in the background.
+
+        Args:
+            state (ConversationState, optional): The conversation. Defaults to the agent itself.
 
         Returns:
-            None
+            bool: Whether the summary was updated.
         """
-        print(f"Conversation Stage ID before analysis: {self.conversation_stage_id}")
-        print("Conversation history:")
-        print(self.conversation_history)
-        stage_analyzer_output = await self.stage_analyzer_chain.ainvoke(
-            input={
-                "conversation_history": "\n".join(self.conversation_history).rstrip(
-                    "\n"
-                ),
-                "conversation_stage_id": self.conversation_stage_id,
-                "conversation_stages": "\n".join(
-                    [
-                        str(key) + ": " + str(value)
-                        for key, value in CONVERSATION_STAGES.items()
-                    ]
-                ),
-            },
-            return_only_outputs=False,
+        state = self if state is None else state
+        inputs = self._summary_inputs(state)
+        if inputs is None:
+            return False
+        span = inputs.pop("span")
+        try:
+            output = await self.conversation_summary_chain.ainvoke(inputs)
+        except Exception as e:
+            print(f"Conversation summary failed, keeping the previous summary: {e}")
+            return False
+        return self._apply_summary(output, span, state)
+
+    def _joint_stage_inputs(self, state: ConversationState) -> Dict[str, str]:
+        if not self.joint_stage_generation:
+            return {}
+        inputs = {"conversation_stage_id": state.conversation_stage_id}
+        # precompiled prompts already contain the stages
+        if "conversation_stages" in (
+            self.sales_conversation_utterance_chain.prompt.input_variables
+        ):
+            inputs["conversation_stages"] = format_conversation_stages(
+                self.conversation_stage_dict
+            )
+        return inputs
+
+    def _joint_output_parser(self) -> JointStageOutputParser:
+        return JointStageOutputParser(
+            ai_prefix=self.salesperson_name,
+            conversation_stages=self.conversation_stage_dict,
+        )
+
+    def _apply_generated_stage(self, stage_id: Optional[str], state: ConversationState):
+        if stage_id is None:
+            print("No valid stage in the joint generation, keeping the current stage")
+            return
+        self._apply_stage_decision(
+            StageDecision(stage_id, 1.0, "joint"), state, len(state.conversation_history)
         )
-        print("Stage analyzer output")
-        print(stage_analyzer_output)
-        self.conversation_stage_id = stage_analyzer_output.get("text")
 
-        self.current_conversation_stage = self.retrieve_conversation_stage(
-            self.conversation_stage_id
+    def _apply_joint_output(self, text: str, state: ConversationState) -> str:
+        stage_id, utterance = self._joint_output_parser().parse(text)
+        self._apply_generated_stage(stage_id, state)
+        return utterance
+
+    def _finish_joint_stream(self, parser: JointStageOutputParser, state: ConversationState):
+        self._apply_generated_stage(parser.stage_id, state)
+        state.conversation_history.append(
+            f"{self.salesperson_name}: {parser.utterance.strip()} <END_OF_TURN>"
         )
 
-        print(f"Conversation Stage: {self.current_conversation_stage}")
+    def _joint_stream(self, stream: Any, state: ConversationState = None):
+        """
+        Forwards the utterance of a streamed joint stage-and-utterance generation.
+
+        Chunks are yielded with the stage header and the salesperson prefix removed from their content, so
+        downstream consumers only see utterance tokens. When the stream ends, the generated stage is applied
+        and the utterance is added to the conversation history.
+
+        Args:
+            stream (Any): The streamed LLM completion.
+            state (ConversationState, optional): The conversation to continue. Defaults to the agent itself.
+
+        Returns:
+            Generator: The utterance chunks.
+        """
+        state = self if state is None else state
+        parser = self._joint_output_parser()
+        last_chunk = None
+        for chunk in stream:
+            last_chunk = chunk
+            if _forward_joint_chunk(parser, chunk):
+                yield chunk
+        tail = parser.finish()
+        if tail and last_chunk is not None:
+            yield _joint_tail_chunk(last_chunk, tail)
+        self._finish_joint_stream(parser, state)
+
+    async def _ajoint_stream(self, stream: Any, state: ConversationState = None):
+        """
+        Asynchronously forwards the utterance of a streamed joint stage-and-utterance generation.
+
+        See _joint_stream.
+
+        Args:
+            stream (Any): The streamed LLM completion.
+            state (ConversationState, optional): The conversation to continue. Defaults to the agent itself.
 
-    def human_step(self, human_input):
+        Returns:
+            AsyncGenerator: The utterance chunks.
+        """
+        state = self if state is None else state
+        parser = self._joint_output_parser()
+        last_chunk = None
+        async for chunk in stream:
+            last_chunk = chunk
+            if _forward_joint_chunk(parser, chunk):
+                yield chunk
+        tail = parser.finish()
+        if tail and last_chunk is not None:
+            yield _joint_tail_chunk(last_chunk, tail)
+        self._finish_joint_stream(parser, state)
+
+    def human_step(self, human_input, state: ConversationState = None):
         """
         Processes the human input and appends it to the conversation history.
 
@@ -228,15 +575,37 @@ class SalesGPT(Chain):
 
         Args:
             human_input (str): The input string from the human user.
+            state (ConversationState, optional): The conversation to update. Defaults to the agent itself.
 
         Returns:
             None
         """
+        state = self if state is None else state
+        self.prefetch_product_search(human_input)
         human_input = "User: " + human_input + " <END_OF_TURN>"
-        self.conversation_history.append(human_input)
+        state.conversation_history.append(human_input)
+
+    def prefetch_product_search(self, human_input):
+        """
+        Starts product retrieval in the background if the human input mentions catalog products.
+
+        This only has an effect if tools are used and the knowledge base was set up with prefetch enabled.
+        Retrieval then runs concurrently with the agent's LLM call, so the ProductSearch observation is often
+        ready by the time the agent invokes the tool.
+
+        Args:
+            human_input (str): The input string from the human user.
+
+        Returns:
+            bool: Whether a prefetch was started.
+        """
+        retriever = getattr(self.knowledge_base, "retriever", None)
+        if not self.use_tools or not isinstance(retriever, PrefetchingRetriever):
+            return False
+        return retriever.prefetch(human_input)
 
     @time_logger
-    def step(self, stream: bool = False):
+    def step(self, stream: bool = False, state: ConversationState = None):
         """
         Executes a step in the conversation. If the stream argument is set to True,
         it returns a streaming generator object for manipulating streaming chunks in downstream applications.
@@ -245,17 +614,18 @@ class SalesGPT(Chain):
         Args:
             stream (bool, optional): A flag indicating whether to return a streaming generator object.
             Defaults to False.
+            state (ConversationState, optional): The conversation to continue. Defaults to the agent itself.
 
         Returns:
             Generator: A streaming generator object if stream is set to True. Otherwise, it returns None.
         """
         if not stream:
-            return self._call(inputs={})
+            return self._call(inputs={}, state=state)
         else:
-            return self._streaming_generator()
+            return self._streaming_generator(state=state)
 
     @time_logger
-    async def astep(self, stream: bool = False):
+    async def astep(self, stream: bool = False, state: ConversationState = None):
         """
         Executes an asynchronous step in the conversation.
 
@@ -265,18 +635,20 @@ class SalesGPT(Chain):
         Args:
             stream (bool, optional): A flag indicating whether to return a streaming generator object.
             Defaults to False.
+            state (ConversationState, optional): The conversation to continue. Defaults to the agent itself.
 
         Returns:
             Generator: A streaming generator object if stream is set to True. Otherwise, it returns None.
         """
         if not stream:
-            return await self.acall(inputs={})
+            return await self.acall(inputs={}, state=state)
         else:
-            return await self._astreaming_generator()
+            return await self._astreaming_generator(state=state)
 
     @time_logger
-    async def acall(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
-    
+    async def acall(
+        self, inputs: Dict[str, Any], state: ConversationState = None
+    ) -> Dict[str, Any]:
         """
         Executes one step of the sales agent.
 
@@ -288,6 +660,8 @@ class SalesGPT(Chain):
         ----------
         inputs : Dict[str, Any]
             The initial inputs for the sales agent.
+        state : ConversationState, optional
+            The conversation to continue. Defaults to the agent itself.
 
         Returns
         -------
@@ -295,11 +669,12 @@ class SalesGPT(Chain):
             The AI message generated by the sales agent.
 
         """
+        state = self if state is None else state
         # override inputs temporarily
         inputs = {
             "input": "",
-            "conversation_stage": self.current_conversation_stage,
-            "conversation_history": "\n".join(self.conversation_history),
+            "conversation_stage": state.current_conversation_stage,
+            "conversation_history": self.format_conversation_history(state),
             "salesperson_name": self.salesperson_name,
             "salesperson_role": self.salesperson_role,
             "company_name": self.company_name,
@@ -307,6 +682,7 @@ class SalesGPT(Chain):
             "company_values": self.company_values,
             "conversation_purpose": self.conversation_purpose,
             "conversation_type": self.conversation_type,
+            **self._joint_stage_inputs(state),
         }
 
         # Generate agent's utterance
@@ -318,13 +694,15 @@ class SalesGPT(Chain):
                 inputs, return_intermediate_steps=True
             )
             output = ai_message["text"]
+            if self.joint_stage_generation:
+                output = self._apply_joint_output(output, state)
 
         # Add agent's response to conversation history
         agent_name = self.salesperson_name
         output = agent_name + ": " + output
         if "<END_OF_TURN>" not in output:
             output += " <END_OF_TURN>"
-        self.conversation_history.append(output)
+        state.conversation_history.append(output)
 
         if self.verbose:
             tool_status = "USE TOOLS INVOKE:" if self.use_tools else "WITHOUT TOOLS:"
@@ -336,7 +714,7 @@ class SalesGPT(Chain):
         return ai_message
 
     @time_logger
-    def _prep_messages(self):
+    def _prep_messages(self, state: ConversationState = None):
         """
         Prepares a list of messages for the streaming generator.
 
@@ -345,15 +723,29 @@ class SalesGPT(Chain):
         The prepared messages include details about the current conversation stage, conversation history, salesperson's name and role,
         company's name, business, values, conversation purpose, and conversation type.
 
+        Args:
+            state (ConversationState, optional): The conversation to prepare messages for.
+                Defaults to the agent itself.
+
         Returns:
-            list: A list of prepared messages to be passed to a streaming generator.
+            list: A list of prepared messages to be passed to a streaming generator: the static system
+                message followed by the conversation history message.
         """
+        state = self if state is None else state
+        chain = self.sales_conversation_utterance_chain
+
+        if isinstance(chain.prompt, PrecompiledChatPrompt):
+            # only the per-turn inputs are rendered, see compile_prompts
+            return chain.prompt.builder.messages(
+                conversation_history=self.format_conversation_history(state),
+                **self._joint_stage_inputs(state),
+            )
 
-        prompt = self.sales_conversation_utterance_chain.prep_prompts(
+        prompt = chain.prep_prompts(
             [
                 dict(
-                    conversation_stage=self.current_conversation_stage,
-                    conversation_history="\n".join(self.conversation_history),
+                    conversation_stage=state.current_conversation_stage,
+                    conversation_history=self.format_conversation_history(state),
                     salesperson_name=self.salesperson_name,
                     salesperson_role=self.salesperson_role,
                     company_name=self.company_name,
@@ -361,21 +753,26 @@ class SalesGPT(Chain):
                     company_values=self.company_values,
                     conversation_purpose=self.conversation_purpose,
                     conversation_type=self.conversation_type,
+                    **self._joint_stage_inputs(state),
                 )
             ]
         )
 
         inception_messages = prompt[0][0].to_messages()
 
-        message_dict = {"role": "system", "content": inception_messages[0].content}
+        # the system message comes first, so providers can serve it from their prompt cache
+        message_dicts = [
+            {"role": MESSAGE_ROLES[message.type], "content": message.content}
+            for message in inception_messages
+        ]
 
-        if self.sales_conversation_utterance_chain.verbose:
+        if chain.verbose:
             pass
             # print("\033[92m" + inception_messages[0].content + "\033[0m")
-        return [message_dict]
+        return message_dicts
 
     @time_logger
-    def _streaming_generator(self):
+    def _streaming_generator(self, state: ConversationState = None):
         """
         Generates a streaming generator for partial LLM output manipulation.
 
@@ -400,14 +797,17 @@ class SalesGPT(Chain):
         https://github.com/openai/openai-cookbook/blob/main/examples/How_to_stream_completions.ipynb
         """
 
-        messages = self._prep_messages()
+        messages = self._prep_messages(state=state)
 
-        return self.sales_conversation_utterance_chain.llm.completion_with_retry(
+        stream = self.sales_conversation_utterance_chain.llm.completion_with_retry(
             messages=messages,
             stop="<END_OF_TURN>",
             stream=True,
             model=self.model_name,
         )
+        if self.joint_stage_generation:
+            return self._joint_stream(stream, state=state)
+        return stream
 
     async def acompletion_with_retry(self, llm: Any, **kwargs: Any) -> Any:
         """
@@ -443,7 +843,7 @@ class SalesGPT(Chain):
 
         return await _completion_with_retry(**kwargs)
 
-    async def _astreaming_generator(self):
+    async def _astreaming_generator(self, state: ConversationState = None):
         """
         Asynchronous generator to reduce I/O blocking when dealing with multiple
         clients simultaneously.
@@ -469,17 +869,22 @@ class SalesGPT(Chain):
         https://github.com/openai/openai-cookbook/blob/main/examples/How_to_stream_completions.ipynb
         """
 
-        messages = self._prep_messages()
+        messages = self._prep_messages(state=state)
 
-        return await self.acompletion_with_retry(
+        stream = await self.acompletion_with_retry(
             llm=self.sales_conversation_utterance_chain.llm,
             messages=messages,
             stop="<END_OF_TURN>",
             stream=True,
             model=self.model_name,
         )
+        if self.joint_stage_generation:
+            return self._ajoint_stream(stream, state=state)
+        return stream
 
-    def _call(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+    def _call(
+        self, inputs: Dict[str, Any], state: ConversationState = None
+    ) -> Dict[str, Any]:
         """
         Executes one step of the sales agent.
 
@@ -491,6 +896,8 @@ class SalesGPT(Chain):
         ----------
         inputs : Dict[str, Any]
             The initial inputs for the sales agent.
+        state : ConversationState, optional
+            The conversation to continue. Defaults to the agent itself.
 
         Returns
         -------
@@ -498,11 +905,12 @@ class SalesGPT(Chain):
             The AI message generated by the sales agent.
 
         """
+        state = self if state is None else state
         # override inputs temporarily
         inputs = {
             "input": "",
-            "conversation_stage": self.current_conversation_stage,
-            "conversation_history": "\n".join(self.conversation_history),
+            "conversation_stage": state.current_conversation_stage,
+            "conversation_history": self.format_conversation_history(state),
             "salesperson_name": self.salesperson_name,
             "salesperson_role": self.salesperson_role,
             "company_name": self.company_name,
@@ -510,6 +918,7 @@ class SalesGPT(Chain):
             "company_values": self.company_values,
             "conversation_purpose": self.conversation_purpose,
             "conversation_type": self.conversation_type,
+            **self._joint_stage_inputs(state),
         }
 
         # Generate agent's utterance
@@ -521,13 +930,15 @@ class SalesGPT(Chain):
                 inputs, return_intermediate_steps=True
             )
             output = ai_message["text"]
+            if self.joint_stage_generation:
+                output = self._apply_joint_output(output, state)
 
         # Add agent's response to conversation history
         agent_name = self.salesperson_name
         output = agent_name + ": " + output
         if "<END_OF_TURN>" not in output:
             output += " <END_OF_TURN>"
-        self.conversation_history.append(output)
+        state.conversation_history.append(output)
 
         if self.verbose:
             tool_status = "USE TOOLS INVOKE:" if self.use_tools else "WITHOUT TOOLS:"
@@ -556,14 +967,32 @@ class SalesGPT(Chain):
         verbose : bool, optional
             If True, verbose output is enabled. Default is False.
         \*\*kwargs : dict
-            Additional keyword arguments.
+            Additional keyword arguments. stage_classifier selects how the conversation stage is determined:
+            "chain" (default), "single_token" or "local", with its options in stage_classifier_config.
+            joint_stage_generation makes one LLM call return both the next stage id and the utterance,
+            instead of a separate stage analyzer call (only without tools). history_max_tokens limits the
+            conversation history in the prompts to a token budget, see format_conversation_history.
+            summarize_after_turns enables the running conversation summary, see summarize_conversation.
 
         Returns
         -------
         SalesGPT
             The initialized SalesGPT Controller.
         """
+        # the chains of this agent share their own copy of the LLM, which reports the usage of every call
+        prompt_cache_usage = PromptCacheUsage()
+        llm = with_callback(llm, prompt_cache_usage)
         stage_analyzer_chain = StageAnalyzerChain.from_llm(llm, verbose=verbose)
+        conversation_summary_chain = ConversationSummaryChain.from_llm(
+            llm, verbose=verbose
+        )
+        stage_classifier = build_stage_classifier(
+            kwargs.pop("stage_classifier", "chain"),
+            llm,
+            stage_analyzer_chain,
+            kwargs.get("conversation_stage_dict"),
+            **kwargs.pop("stage_classifier_config", {}),
+        )
         sales_conversation_utterance_chain = SalesConversationChain.from_llm(
             llm, verbose=verbose
         )
@@ -572,11 +1001,17 @@ class SalesGPT(Chain):
         use_custom_prompt = kwargs.pop("use_custom_prompt", False)
         custom_prompt = kwargs.pop("custom_prompt", None)
 
+        joint_stage_generation = (
+            str(kwargs.get("joint_stage_generation", False)).lower() == "true"
+        )
+        kwargs["joint_stage_generation"] = joint_stage_generation
+
         sales_conversation_utterance_chain = SalesConversationChain.from_llm(
             llm,
             verbose=verbose,
             use_custom_prompt=use_custom_prompt,
             custom_prompt=custom_prompt,
+            joint_stage_generation=joint_stage_generation,
         )
 
         # Handle tools
@@ -591,12 +1026,20 @@ class SalesGPT(Chain):
             raise ValueError(
                 "use_tools must be a boolean or a string ('True' or 'False')"
             )
+        if use_tools and joint_stage_generation:
+            raise ValueError(
+                "joint_stage_generation cannot be used with tools, the tools agent has its own prompt"
+            )
         sales_agent_executor = None
         knowledge_base = None
+        knowledge_base_config = kwargs.pop("knowledge_base_config", {})
 
         if use_tools:
             product_catalog = kwargs.pop("product_catalog", None)
-            tools = get_tools(product_catalog)
+            knowledge_base = setup_knowledge_base(
+                product_catalog, **knowledge_base_config
+            )
+            tools = get_tools(product_catalog, knowledge_base=knowledge_base)
 
             prompt = CustomPromptTemplateForTools(
                 template=SALES_AGENT_TOOLS_PROMPT,
@@ -633,8 +1076,11 @@ class SalesGPT(Chain):
                 return_intermediate_steps=True,
             )
 
-        return cls(
+        agent = cls(
+            prompt_cache_usage=prompt_cache_usage,
             stage_analyzer_chain=stage_analyzer_chain,
+            stage_classifier=stage_classifier,
+            conversation_summary_chain=conversation_summary_chain,
             sales_conversation_utterance_chain=sales_conversation_utterance_chain,
             sales_agent_executor=sales_agent_executor,
             knowledge_base=knowledge_base,
@@ -643,3 +1089,22 @@ class SalesGPT(Chain):
             use_tools=use_tools,
             **kwargs,
         )
+        agent.compile_prompts()
+        return agent
+
+
+def _forward_joint_chunk(parser: JointStageOutputParser, chunk: Any) -> bool:
+    # rewrites the chunk content to its utterance part, returns whether there is anything to forward
+    delta = chunk["choices"][0]["delta"]
+    content = delta["content"]
+    if content is None:
+        return True
+    forwarded = parser.feed(content)
+    delta["content"] = forwarded
+    return bool(forwarded)
+
+
+def _joint_tail_chunk(last_chunk: Any, tail: str) -> Any:
+    chunk = deepcopy(last_chunk)
+    chunk["choices"][0]["delta"]["content"] = tail
+    return chunk
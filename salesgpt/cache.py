@@ -0,0 +1,374 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+_MISSING = object()
+
+
+class LRUTTLCache:
+    """
+    Dictionary-like cache with a maximum size and an idle time-to-live.
+
+    Entries are kept in least-recently-used order. Because every access moves an entry to the end, expired
+    entries are always at the front, so both LRU eviction and TTL expiry are O(1) per entry.
+    An optional on_evict callback is called with (key, value) whenever an entry is evicted or expires.
+    """
+
+    def __init__(
+        self,
+        max_size: Optional[int] = None,
+        ttl: Optional[float] = None,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.clock = clock
+        self._data: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING, touch=False) is not _MISSING
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(list(self._data))
+
+    def _is_expired(self, last_access: float, now: float) -> bool:
+        return self.ttl is not None and now - last_access > self.ttl
+
+    def get(self, key: Hashable, default: Any = None, touch: bool = True) -> Any:
+        """
+        Returns the value for key, or default if it is missing or expired.
+
+        Args:
+            key (Hashable): The key to look up.
+            default (Any): Returned if the key is missing or expired.
+            touch (bool): Whether the lookup counts as an access for LRU order and TTL.
+
+        Returns:
+            Any: The cached value or default.
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        value, last_access = entry
+        now = self.clock()
+        if self._is_expired(last_access, now):
+            del self._data[key]
+            self.expirations += 1
+            if self.on_evict is not None:
+                self.on_evict(key, value)
+            return default
+        if touch:
+            self._data[key] = (value, now)
+            self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        """
+        Stores a value, evicting the least recently used entries if the cache is full.
+
+        Args:
+            key (Hashable): The key to store.
+            value (Any): The value to store.
+
+        Returns:
+            None
+        """
+        self._data[key] = (value, self.clock())
+        self._data.move_to_end(key)
+        self.expire()
+        while self.max_size is not None and len(self._data) > self.max_size:
+            self.evict_oldest()
+
+    __setitem__ = set
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Removes key without calling on_evict and returns its value.
+
+        Returns:
+            Any: The removed value, or default if the key is missing.
+        """
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def evict_oldest(self) -> Optional[Tuple[Hashable, Any]]:
+        """
+        Evicts the least recently used entry.
+
+        Returns:
+            Optional[Tuple[Hashable, Any]]: The evicted entry, or None if the cache is empty.
+        """
+        if not self._data:
+            return None
+        key, (value, _) = self._data.popitem(last=False)
+        self.evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+        return key, value
+
+    def expire(self) -> List[Tuple[Hashable, Any]]:
+        """
+        Removes all expired entries.
+
+        Returns:
+            List[Tuple[Hashable, Any]]: The expired entries.
+        """
+        expired = []
+        if self.ttl is None:
+            return expired
+        now = self.clock()
+        while self._data:
+            key, (value, last_access) = next(iter(self._data.items()))
+            if not self._is_expired(last_access, now):
+                break
+            del self._data[key]
+            expired.append((key, value))
+            self.expirations += 1
+            if self.on_evict is not None:
+                self.on_evict(key, value)
+        return expired
+
+    def idle_since(self, key: Hashable) -> Optional[float]:
+        """
+        Returns the time of the last access to key, or None if it is missing.
+        """
+        entry = self._data.get(key)
+        return None if entry is None else entry[1]
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        return [(key, value) for key, (value, _) in self._data.items()]
+
+    def clear(self):
+        self._data.clear()
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a query for exact cache matching: lowercase, no punctuation, single spaces.
+
+    Args:
+        query (str): The query.
+
+    Returns:
+        str: The normalized query.
+    """
+    return " ".join(re.sub(r"[^\w$ ]+", " ", query.lower()).split())
+
+
+class SemanticAnswerCache:
+    """
+    Cache of knowledge base answers matched by normalized query text or by query embedding similarity.
+
+    Lookups first try an exact match on the normalized query. If embeddings are configured, the query is then
+    compared with the embeddings of all cached queries using one matrix-vector product, and the answer of the
+    most similar one is returned if the cosine similarity reaches similarity_threshold.
+    The cache belongs to one catalog version: invalidate drops all entries when the catalog hash changes.
+    """
+
+    def __init__(
+        self,
+        embeddings: Optional[Embeddings] = None,
+        max_size: int = 1024,
+        ttl: Optional[float] = 3600,
+        similarity_threshold: float = 0.95,
+    ):
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.catalog_hash: Optional[str] = None
+        self._lock = threading.Lock()
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: List[str] = []
+        self._entries = LRUTTLCache(
+            max_size=max_size, ttl=ttl, on_evict=self._on_evict
+        )
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _on_evict(self, key: str, value: Any):
+        if self._vectors.pop(key, None) is not None:
+            self._matrix = None
+
+    def invalidate(self, catalog_hash: str):
+        """
+        Drops all cached answers if the catalog hash changed.
+
+        Args:
+            catalog_hash (str): Content hash of the current catalog.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if catalog_hash == self.catalog_hash:
+                return
+            self.catalog_hash = catalog_hash
+            self._entries.clear()
+            self._vectors.clear()
+            self._matrix = None
+
+    @staticmethod
+    def _normalize_vector(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _lookup_exact(self, key: str) -> Optional[str]:
+        with self._lock:
+            answer = self._entries.get(key)
+            if answer is not None:
+                self.exact_hits += 1
+            return answer
+
+    def _lookup_similar(self, key: str, vector: np.ndarray) -> Optional[str]:
+        with self._lock:
+            self._entries.expire()
+            if not self._vectors:
+                self.misses += 1
+                return None
+            if self._matrix is None:
+                self._matrix_keys = list(self._vectors)
+                self._matrix = np.stack([self._vectors[k] for k in self._matrix_keys])
+            scores = self._matrix @ vector
+            best = int(np.argmax(scores))
+            if scores[best] >= self.similarity_threshold:
+                answer = self._entries.get(self._matrix_keys[best])
+                if answer is not None:
+                    self.semantic_hits += 1
+                    return answer
+            self.misses += 1
+            return None
+
+    def lookup(self, query: str) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """
+        Looks up a cached answer for the query.
+
+        Args:
+            query (str): The query.
+
+        Returns:
+            Tuple[Optional[str], Optional[np.ndarray]]: The cached answer or None, and the query embedding
+            if one was computed, so it can be reused by store.
+        """
+        key = normalize_query(query)
+        answer = self._lookup_exact(key)
+        if answer is not None:
+            return answer, None
+        if self.embeddings is None:
+            with self._lock:
+                self.misses += 1
+            return None, None
+        vector = self._normalize_vector(self.embeddings.embed_query(query))
+        return self._lookup_similar(key, vector), vector
+
+    async def alookup(self, query: str) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """
+        Asynchronously looks up a cached answer for the query.
+
+        Returns:
+            Tuple[Optional[str], Optional[np.ndarray]]: See lookup.
+        """
+        key = normalize_query(query)
+        answer = self._lookup_exact(key)
+        if answer is not None:
+            return answer, None
+        if self.embeddings is None:
+            with self._lock:
+                self.misses += 1
+            return None, None
+        vector = self._normalize_vector(await self.embeddings.aembed_query(query))
+        return self._lookup_similar(key, vector), vector
+
+    def store(self, query: str, answer: str, vector: Optional[np.ndarray] = None):
+        """
+        Caches the answer to a query.
+
+        Args:
+            query (str): The query.
+            answer (str): The answer to cache.
+            vector (Optional[np.ndarray]): The normalized query embedding returned by lookup, if any.
+
+        Returns:
+            None
+        """
+        key = normalize_query(query)
+        with self._lock:
+            self._entries[key] = answer
+            if vector is not None:
+                self._vectors[key] = vector
+                self._matrix = None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns cache counters and the hit rate.
+
+        Returns:
+            Dict[str, Any]: Entries, exact and semantic hits, misses, evictions and hit rate.
+        """
+        hits = self.exact_hits + self.semantic_hits
+        lookups = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "evictions": self._entries.evictions + self._entries.expirations,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+class CachedKnowledgeBase:
+    """
+    Knowledge base wrapper that serves repeated questions from a SemanticAnswerCache.
+
+    The cache is bypassed if it was invalidated for a newer catalog version than the one this knowledge base
+    was built from, so sessions still using an old catalog never mix their answers into the cache.
+    """
+
+    def __init__(
+        self,
+        knowledge_base: Any,
+        cache: SemanticAnswerCache,
+        catalog_hash: Optional[str] = None,
+    ):
+        self.knowledge_base = knowledge_base
+        self.cache = cache
+        self.catalog_hash = catalog_hash
+
+    @property
+    def retriever(self):
+        return getattr(self.knowledge_base, "retriever", None)
+
+    def _uses_cache(self) -> bool:
+        return self.catalog_hash is None or self.catalog_hash == self.cache.catalog_hash
+
+    def run(self, query: str) -> str:
+        if not self._uses_cache():
+            return self.knowledge_base.run(query)
+        answer, vector = self.cache.lookup(query)
+        if answer is None:
+            answer = self.knowledge_base.run(query)
+            self.cache.store(query, answer, vector)
+        return answer
+
+    async def arun(self, query: str) -> str:
+        if not self._uses_cache():
+            return await self.knowledge_base.arun(query)
+        answer, vector = await self.cache.alookup(query)
+        if answer is None:
+            answer = await self.knowledge_base.arun(query)
+            self.cache.store(query, answer, vector)
+        return answer
@@ -0,0 +1,316 @@
+import difflib
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, List, Optional, Set
+
+from salesgpt.retrievers import query_terms
+
+PRODUCT_PREFIX_REGEX = re.compile(r"^.*?\bproduct\s*\d+\s*:\s*", re.IGNORECASE)
+PRICE_REGEX = re.compile(r"^price[^:]*:\s*(.+)$", re.IGNORECASE)
+SIZES_REGEX = re.compile(r"^sizes?[^:]*:\s*(.+)$", re.IGNORECASE)
+AMOUNT_REGEX = re.compile(r"[\d,]+(?:\.\d+)?")
+
+PRICE_TERMS = {"price", "prices", "pricing", "cost", "costs", "$", "expensive", "cheap"}
+SIZE_TERMS = {"size", "sizes", "sized", "dimension", "dimensions"}
+AVAILABILITY_TERMS = {"available", "availability", "stock", "offer", "sell", "carry"}
+# words that do not change what a price, size or availability question asks for
+FILLER_TERMS = set(
+    "about all also any both buy could currently detail details get info information know like looking "
+    "model my now one ones our please right still tell there they them want we would".split()
+)
+ANSWERABLE_TERMS = PRICE_TERMS | SIZE_TERMS | AVAILABILITY_TERMS | FILLER_TERMS
+
+
+def normalize_term(term: str) -> str:
+    """
+    Normalizes a word for matching by stripping simple plural endings.
+
+    Args:
+        term (str): A lowercase word.
+
+    Returns:
+        str: The normalized word.
+    """
+    if len(term) > 4 and term.endswith("es") and term[-3] in "sxz":
+        return term[:-2]
+    if len(term) > 3 and term.endswith("s") and not term.endswith("ss"):
+        return term[:-1]
+    return term
+
+
+@dataclass
+class ProductRecord:
+    """Structured fields of one product parsed from the catalog."""
+
+    name: str
+    price: Optional[float] = None
+    price_text: str = ""
+    sizes: List[str] = field(default_factory=list)
+    description: str = ""
+
+    def summary(self) -> str:
+        parts = [self.name]
+        if self.price_text:
+            parts.append(f"Price: {self.price_text}")
+        if self.sizes:
+            parts.append(f"Sizes available: {', '.join(self.sizes)}")
+        return ". ".join(parts) + "."
+
+
+def parse_product_catalog(catalog: str) -> List[ProductRecord]:
+    """
+    Parses a plain-text product catalog into structured product records.
+
+    Every paragraph with a "Price:" line is a product. Its first line is the product name
+    (an optional "<company> product N:" prefix is removed), "Price:" and "Sizes ...:" lines are parsed
+    into fields, and all other lines form the description. Paragraphs without a price are skipped.
+
+    Args:
+        catalog (str): The catalog text.
+
+    Returns:
+        List[ProductRecord]: The parsed products in catalog order.
+    """
+    products = []
+    for paragraph in re.split(r"\n\s*\n", catalog):
+        lines = [line.strip() for line in paragraph.strip().splitlines() if line.strip()]
+        if len(lines) < 2:
+            continue
+        record = ProductRecord(name=PRODUCT_PREFIX_REGEX.sub("", lines[0]).strip())
+        description = []
+        for line in lines[1:]:
+            price_match = PRICE_REGEX.match(line)
+            sizes_match = SIZES_REGEX.match(line)
+            if price_match:
+                record.price_text = price_match.group(1).strip()
+                amount = AMOUNT_REGEX.search(record.price_text)
+                if amount:
+                    record.price = float(amount.group(0).replace(",", ""))
+            elif sizes_match:
+                record.sizes = [
+                    size.strip() for size in sizes_match.group(1).split(",") if size.strip()
+                ]
+            else:
+                description.append(line)
+        record.description = " ".join(description)
+        if record.price_text:
+            products.append(record)
+    return products
+
+
+class ProductIndex:
+    """
+    In-memory index over structured product records.
+
+    Products are found by exact name or by the distinctive words of their names through an inverted index,
+    with typo-tolerant matching for words that are not in the vocabulary. Price, size and availability
+    questions about the matched products are answered without any embedding or LLM call.
+    """
+
+    def __init__(self, products: List[ProductRecord]):
+        self.products = products
+        self._names = [self._normalize_text(product.name) for product in products]
+        self._term_index: Dict[str, Set[int]] = defaultdict(set)
+        for i, product in enumerate(products):
+            for term in self._terms(product.name):
+                self._term_index[term].add(i)
+        self._vocabulary = list(self._term_index)
+        # terms shared by every product name, e.g. "mattress", refer to the whole catalog
+        self._generic_terms = {
+            term
+            for term, ids in self._term_index.items()
+            if len(ids) == len(products) and len(products) > 1
+        }
+        self._sizes = {
+            size.lower(): size for product in products for size in product.sizes
+        }
+
+    @staticmethod
+    def _terms(text: str) -> List[str]:
+        return [normalize_term(term) for term in query_terms(text)]
+
+    @classmethod
+    def _normalize_text(cls, text: str) -> str:
+        return " ".join(cls._terms(text))
+
+    def _resolve_term(self, term: str) -> Optional[str]:
+        if term in self._term_index:
+            return term
+        if len(term) < 4:
+            return None
+        matches = difflib.get_close_matches(term, self._vocabulary, n=1, cutoff=0.85)
+        return matches[0] if matches else None
+
+    def find(self, query: str) -> List[ProductRecord]:
+        """
+        Finds the products a query refers to.
+
+        Args:
+            query (str): The search query.
+
+        Returns:
+            List[ProductRecord]: The best matching products, all products if the query only uses words
+            common to every product name (e.g. "mattresses"), or an empty list.
+        """
+        normalized_query = self._normalize_text(query)
+        exact = [
+            product
+            for product, name in zip(self.products, self._names)
+            if name and name in normalized_query
+        ]
+        if exact:
+            return exact
+
+        scores: Dict[int, int] = defaultdict(int)
+        generic = False
+        for term in self._terms(query):
+            resolved = self._resolve_term(term)
+            if resolved is None:
+                continue
+            if resolved in self._generic_terms:
+                generic = True
+                continue
+            for i in self._term_index[resolved]:
+                scores[i] += 1
+        if scores:
+            best = max(scores.values())
+            return [self.products[i] for i in sorted(scores) if scores[i] == best]
+        if generic:
+            return list(self.products)
+        return []
+
+    def topic_terms(self, query: str) -> FrozenSet[str]:
+        """
+        Returns what a query asks about besides the products, their sizes, prices and availability.
+
+        Args:
+            query (str): The product question.
+
+        Returns:
+            FrozenSet[str]: The normalized content words that are no product name words, sizes or price,
+            size or availability words.
+        """
+        return frozenset(
+            normalize_term(term)
+            for term in query_terms(query)
+            if term not in ANSWERABLE_TERMS
+            and term not in self._sizes
+            and self._resolve_term(normalize_term(term)) is None
+        )
+
+    def answer(self, query: str) -> Optional[str]:
+        """
+        Answers price, size and availability questions from the structured records.
+
+        A question is only answered if it has no topic_terms, i.e. every content word is a product name
+        word, a size or a price, size or availability word. Anything else, e.g. "What does the warranty
+        cost?", needs a semantic search. A question naming a size is only answered for the matched
+        products offered in that size, unless none of them is.
+
+        Args:
+            query (str): The product question.
+
+        Returns:
+            Optional[str]: The answer, or None if the question needs a semantic search.
+        """
+        terms = set(query_terms(query))
+        raw_query = query.lower()
+        asks_price = bool(terms & PRICE_TERMS) or "how much" in raw_query or "$" in query
+        asks_sizes = bool(terms & SIZE_TERMS)
+        asks_availability = bool(terms & AVAILABILITY_TERMS)
+        mentioned_sizes = [
+            size for key, size in self._sizes.items() if key in terms
+        ]
+        if not (asks_price or asks_sizes or asks_availability or mentioned_sizes):
+            return None
+        if self.topic_terms(query):
+            return None
+
+        products = self.find(query)
+        if not products:
+            return None
+        if mentioned_sizes:
+            # "the queen mattress" only refers to the products sold in Queen
+            offered = [
+                product
+                for product in products
+                if any(size in product.sizes for size in mentioned_sizes)
+            ]
+            products = offered or products
+
+        answers = []
+        for product in products:
+            if mentioned_sizes:
+                available = [size for size in mentioned_sizes if size in product.sizes]
+                if available:
+                    answer = f"{product.name} is available in {', '.join(available)}."
+                else:
+                    answer = (
+                        f"{product.name} is not available in {', '.join(mentioned_sizes)}. "
+                        f"Sizes available: {', '.join(product.sizes) or 'unknown'}."
+                    )
+                if asks_price:
+                    answer += f" Price: {product.price_text}."
+                answers.append(answer)
+            else:
+                answers.append(product.summary())
+        return "\n".join(answers)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"products": len(self.products), "vocabulary": len(self._vocabulary)}
+
+
+class StructuredProductSearch:
+    """
+    Knowledge base that answers structured product questions from a ProductIndex.
+
+    Questions the index cannot answer fall back to the wrapped semantic knowledge base.
+    """
+
+    def __init__(self, index: ProductIndex, fallback: Any):
+        self.index = index
+        self.fallback = fallback
+        self.structured_hits = 0
+        self.fallbacks = 0
+
+    @property
+    def retriever(self):
+        return getattr(self.fallback, "retriever", None)
+
+    def run(self, query: str) -> str:
+        """
+        Answers a product question, using semantic search only if needed.
+
+        Args:
+            query (str): The product question.
+
+        Returns:
+            str: The answer.
+        """
+        answer = self.index.answer(query)
+        if answer is not None:
+            self.structured_hits += 1
+            return answer
+        self.fallbacks += 1
+        return self.fallback.run(query)
+
+    async def arun(self, query: str) -> str:
+        """
+        Asynchronously answers a product question, using semantic search only if needed.
+
+        Args:
+            query (str): The product question.
+
+        Returns:
+            str: The answer.
+        """
+        answer = self.index.answer(query)
+        if answer is not None:
+            self.structured_hits += 1
+            return answer
+        self.fallbacks += 1
+        return await self.fallback.arun(query)
+
+    def stats(self) -> Dict[str, int]:
+        return {"structured_hits": self.structured_hits, "fallbacks": self.fallbacks}
@@ -1,31 +1,80 @@
 from langchain.chains import LLMChain
-from langchain.prompts import PromptTemplate
+from langchain.prompts import ChatPromptTemplate, PromptTemplate
 from langchain_community.chat_models import ChatLiteLLM
 
 from salesgpt.logger import time_logger
 from salesgpt.prompts import (
-    SALES_AGENT_INCEPTION_PROMPT,
-    STAGE_ANALYZER_INCEPTION_PROMPT,
+    CONVERSATION_SUMMARY_PROMPT,
+    SALES_AGENT_HISTORY_PROMPT,
+    SALES_AGENT_JOINT_STAGE_HISTORY_PROMPT,
+    SALES_AGENT_JOINT_STAGE_SYSTEM_PROMPT,
+    SALES_AGENT_SYSTEM_PROMPT,
+    STAGE_ANALYZER_HISTORY_PROMPT,
+    STAGE_ANALYZER_INCREMENTAL_HISTORY_PROMPT,
+    STAGE_ANALYZER_SYSTEM_PROMPT,
 )
 
+# OpenAI chat roles of the langchain message types
+MESSAGE_ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+
+def cacheable_prompt(system_template: str, history_template: str) -> ChatPromptTemplate:
+    """
+    Builds a chat prompt with a static system message followed by a message with the conversation.
+
+    The system template may only use variables that are fixed for an agent configuration (persona,
+    company, conversation stages). It then renders to the same bytes on every turn and in every session,
+    which lets providers with automatic prompt prefix caching reuse it.
+
+    Args:
+        system_template (str): Template of the static system message.
+        history_template (str): Template of the message with the conversation history and current stage.
+
+    Returns:
+        ChatPromptTemplate: The two message prompt.
+    """
+    return ChatPromptTemplate.from_messages(
+        [("system", system_template), ("human", history_template)]
+    )
+
 
 class StageAnalyzerChain(LLMChain):
     """Chain to analyze which conversation stage should the conversation move into."""
 
+    @classmethod
+    @time_logger
+    def from_llm(
+        cls, llm: ChatLiteLLM, verbose: bool = True, incremental: bool = False
+    ) -> LLMChain:
+        """Get the response parser. An incremental chain also takes a conversation_summary of earlier turns."""
+        if incremental:
+            prompt = cacheable_prompt(
+                STAGE_ANALYZER_SYSTEM_PROMPT, STAGE_ANALYZER_INCREMENTAL_HISTORY_PROMPT
+            )
+        else:
+            prompt = cacheable_prompt(
+                STAGE_ANALYZER_SYSTEM_PROMPT, STAGE_ANALYZER_HISTORY_PROMPT
+            )
+        print(f"STAGE ANALYZER PROMPT {prompt}")
+        return cls(prompt=prompt, llm=llm, verbose=verbose)
+
+
+class ConversationSummaryChain(LLMChain):
+    """Chain to fold older turns of the conversation into a running summary."""
+
     @classmethod
     @time_logger
     def from_llm(cls, llm: ChatLiteLLM, verbose: bool = True) -> LLMChain:
         """Get the response parser."""
-        stage_analyzer_inception_prompt_template = STAGE_ANALYZER_INCEPTION_PROMPT
         prompt = PromptTemplate(
-            template=stage_analyzer_inception_prompt_template,
+            template=CONVERSATION_SUMMARY_PROMPT,
             input_variables=[
-                "conversation_history",
-                "conversation_stage_id",
-                "conversation_stages",
+                "salesperson_name",
+                "conversation_summary",
+                "new_turns",
+                "max_words",
             ],
         )
-        print(f"STAGE ANALYZER PROMPT {prompt}")
         return cls(prompt=prompt, llm=llm, verbose=verbose)
 
 
@@ -40,36 +89,30 @@ class SalesConversationChain(LLMChain):
         verbose: bool = True,
         use_custom_prompt: bool = False,
         custom_prompt: str = "You are an AI Sales agent, sell me this pencil",
+        joint_stage_generation: bool = False,
     ) -> LLMChain:
-        """Get the response parser."""
-        if use_custom_prompt:
-            sales_agent_inception_prompt = custom_prompt
-            prompt = PromptTemplate(
-                template=sales_agent_inception_prompt,
-                input_variables=[
-                    "salesperson_name",
-                    "salesperson_role",
-                    "company_name",
-                    "company_business",
-                    "company_values",
-                    "conversation_purpose",
-                    "conversation_type",
-                    "conversation_history",
-                ],
+        """
+        Get the response parser.
+
+        With joint_stage_generation, the chain answers with the next conversation stage id followed by the
+        utterance (see JointStageOutputParser) and also takes conversation_stage_id and conversation_stages.
+        The static instructions are sent as a separate system message, see cacheable_prompt. A custom
+        prompt is sent as a single system message.
+        """
+        if joint_stage_generation:
+            if use_custom_prompt:
+                raise ValueError(
+                    "joint_stage_generation cannot be used with a custom prompt"
+                )
+            prompt = cacheable_prompt(
+                SALES_AGENT_JOINT_STAGE_SYSTEM_PROMPT,
+                SALES_AGENT_JOINT_STAGE_HISTORY_PROMPT,
             )
+        elif use_custom_prompt:
+            # a custom prompt is a single template, sent as the system message
+            prompt = ChatPromptTemplate.from_messages([("system", custom_prompt)])
         else:
-            sales_agent_inception_prompt = SALES_AGENT_INCEPTION_PROMPT
-            prompt = PromptTemplate(
-                template=sales_agent_inception_prompt,
-                input_variables=[
-                    "salesperson_name",
-                    "salesperson_role",
-                    "company_name",
-                    "company_business",
-                    "company_values",
-                    "conversation_purpose",
-                    "conversation_type",
-                    "conversation_history",
-                ],
+            prompt = cacheable_prompt(
+                SALES_AGENT_SYSTEM_PROMPT, SALES_AGENT_HISTORY_PROMPT
             )
         return cls(prompt=prompt, llm=llm, verbose=verbose)
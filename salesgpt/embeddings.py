@@ -0,0 +1,138 @@
+import os
+import re
+import zlib
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import numpy as np
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
+from langchain_core.embeddings import Embeddings
+from langchain_core.pydantic_v1 import BaseModel
+from langchain_openai import OpenAIEmbeddings
+
+EMBEDDING_BACKENDS = ["openai", "local"]
+TOKEN_REGEX = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=65536)
+def _word_features(
+    word: str, n_features: int, ngram_range: Tuple[int, int]
+) -> Tuple[np.ndarray, np.ndarray]:
+    # the word itself plus its character n-grams, padded so prefixes and suffixes get their own n-grams
+    grams = [word]
+    padded = f" {word} "
+    for n in range(ngram_range[0], ngram_range[1] + 1):
+        grams.extend(padded[i : i + n] for i in range(len(padded) - n + 1))
+    # crc32 is stable across processes, unlike hash(), so persisted vectors stay valid
+    hashes = np.array([zlib.crc32(gram.encode("utf-8")) for gram in grams], dtype=np.uint32)
+    indices = (hashes % n_features).astype(np.int64)
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+    return indices, signs
+
+
+class HashingEmbeddings(BaseModel, Embeddings):
+    """
+    Local embedding model based on hashed word and character n-gram features.
+
+    Every word contributes itself and its character n-grams, hashed with a sign into n_features buckets.
+    Counts are log-scaled and the vectors L2-normalized, so cosine similarity measures shared vocabulary,
+    with character n-grams making it tolerant to typos and inflections. Texts are encoded in batches by
+    scattering their sparse features into one matrix. No network or model download is needed, and
+    embedding a query takes well under a millisecond.
+    """
+
+    n_features: int = 1024
+    ngram_range: Tuple[int, int] = (3, 5)
+    batch_size: int = 256
+
+    @property
+    def model_name(self) -> str:
+        return f"local-hashing-{self.n_features}"
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        rows, indices, signs = [], [], []
+        for row, text in enumerate(texts):
+            for word in TOKEN_REGEX.findall(text.lower()):
+                word_indices, word_signs = _word_features(
+                    word, self.n_features, tuple(self.ngram_range)
+                )
+                rows.append(np.full(len(word_indices), row, dtype=np.int64))
+                indices.append(word_indices)
+                signs.append(word_signs)
+        if not rows:
+            return np.zeros((len(texts), self.n_features), dtype=np.float32)
+        flat = np.concatenate(rows) * self.n_features + np.concatenate(indices)
+        counts = np.bincount(
+            flat, weights=np.concatenate(signs), minlength=len(texts) * self.n_features
+        ).reshape(len(texts), self.n_features)
+        vectors = (np.sign(counts) * np.log1p(np.abs(counts))).astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1.0)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Embeds texts into a matrix of L2-normalized vectors.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            np.ndarray: A float32 matrix with one row per text.
+        """
+        if not texts:
+            return np.zeros((0, self.n_features), dtype=np.float32)
+        return np.vstack(
+            [
+                self._encode_batch(texts[i : i + self.batch_size])
+                for i in range(0, len(texts), self.batch_size)
+            ]
+        )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode([text])[0].tolist()
+
+
+def build_embeddings(
+    embedding_model: str = "text-embedding-ada-002",
+    cache_dir: Optional[str] = None,
+    underlying_embeddings: Optional[Embeddings] = None,
+    embedding_backend: str = "openai",
+) -> Embeddings:
+    """
+    Builds the embedding model used to index the product catalog.
+
+    When a cache directory is given, document embeddings are persisted on disk keyed by a hash of the chunk text,
+    namespaced by the embedding model. Unchanged chunks are then never sent to the embedding API again,
+    across restarts and deploys.
+    With embedding_backend="local", a HashingEmbeddings model is used instead. It runs in-process, so it is
+    never cached and embedding_model is ignored.
+
+    Args:
+        embedding_model (str): Name of the embedding model.
+        cache_dir (Optional[str]): Directory for the persistent embedding cache. Caching is disabled if None.
+        underlying_embeddings (Optional[Embeddings]): Embeddings to wrap instead of OpenAIEmbeddings.
+        embedding_backend (str): "openai" or "local".
+
+    Returns:
+        Embeddings: The (optionally cache-backed) embedding model.
+    """
+    if embedding_backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"embedding_backend must be one of {EMBEDDING_BACKENDS}")
+    if embedding_backend == "local":
+        return underlying_embeddings or HashingEmbeddings()
+
+    if underlying_embeddings is None:
+        underlying_embeddings = OpenAIEmbeddings(model=embedding_model)
+    if cache_dir is None:
+        return underlying_embeddings
+
+    os.makedirs(cache_dir, exist_ok=True)
+    return CacheBackedEmbeddings.from_bytes_store(
+        underlying_embeddings,
+        LocalFileStore(cache_dir),
+        namespace=embedding_model,
+    )
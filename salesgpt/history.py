@@ -0,0 +1,122 @@
+import threading
+from typing import Any, List
+
+from salesgpt.cache import LRUTTLCache
+from salesgpt.tokens import count_tokens
+
+HISTORY_OMITTED_MARKER = "[{count} earlier turns omitted]"
+
+# token counts of conversation turns by (encoding name, turn), shared by all sessions
+_TURN_TOKEN_COUNTS = LRUTTLCache(max_size=50000)
+_TURN_TOKEN_COUNTS_LOCK = threading.Lock()
+
+
+def turn_token_count(turn: str, encoding_name: str = "cl100k_base") -> int:
+    """
+    Returns the number of tokens of a conversation turn.
+
+    Turns never change once they are in the history, so every turn is tokenized only once.
+
+    Args:
+        turn (str): The conversation turn.
+        encoding_name (str): Name of the tiktoken encoding.
+
+    Returns:
+        int: The number of tokens, including the newline joining it to the next turn.
+    """
+    key = (encoding_name, turn)
+    with _TURN_TOKEN_COUNTS_LOCK:
+        count = _TURN_TOKEN_COUNTS.get(key)
+    if count is None:
+        count = count_tokens(turn, encoding_name) + 1
+        with _TURN_TOKEN_COUNTS_LOCK:
+            _TURN_TOKEN_COUNTS[key] = count
+    return count
+
+
+def window_history(
+    conversation_history: List[str],
+    max_tokens: int,
+    pinned_turns: int = 2,
+    encoding_name: str = "cl100k_base",
+) -> List[str]:
+    """
+    Fits a conversation history into a token budget.
+
+    The first pinned_turns turns (the opening exchange) are always kept, followed by as many of the most
+    recent turns as fit into the remaining budget. The latest turn is kept even if it alone exceeds the
+    budget. Dropped turns are replaced by a single HISTORY_OMITTED_MARKER line. The history is walked from
+    the end and stops once the budget is spent, so the cost is proportional to the window, not to the
+    length of the conversation.
+
+    Args:
+        conversation_history (List[str]): The conversation turns.
+        max_tokens (int): The token budget for the history.
+        pinned_turns (int): Number of turns from the start of the conversation that are always kept.
+        encoding_name (str): Name of the tiktoken encoding used to count tokens.
+
+    Returns:
+        List[str]: The turns to put into the prompt.
+    """
+    length = len(conversation_history)
+    pinned = min(pinned_turns, length)
+    budget = max_tokens - sum(
+        turn_token_count(turn, encoding_name) for turn in conversation_history[:pinned]
+    )
+    start = length
+    while start > pinned:
+        count = turn_token_count(conversation_history[start - 1], encoding_name)
+        if count > budget and start < length:
+            break
+        budget -= count
+        start -= 1
+    if start == pinned:
+        return conversation_history
+    return (
+        conversation_history[:pinned]
+        + [HISTORY_OMITTED_MARKER.format(count=start - pinned)]
+        + conversation_history[start:]
+    )
+
+
+def render_history(state: Any, start: int = 0) -> str:
+    """
+    Joins the turns state.conversation_history[start:] into prompt text, one turn per line.
+
+    Histories grow by appending turns, so the rendered text is kept in state.rendered_history and only the
+    turns appended since the previous call are joined onto it. A history that was replaced or changed in
+    any other way (reset, rolled back or its last turn replaced) is rendered again.
+
+    Args:
+        state (Any): The conversation, a ConversationState or an agent holding its own conversation.
+        start (int): Index of the first turn to render.
+
+    Returns:
+        str: The rendered turns.
+    """
+    conversation_history = state.conversation_history
+    length = len(conversation_history)
+    entry = state.rendered_history
+    text = None
+    if entry is not None:
+        history, rendered_start, end, last_turn, rendered = entry
+        if (
+            history is conversation_history
+            and rendered_start == start
+            and start < end <= length
+            and conversation_history[end - 1] is last_turn
+        ):
+            text = rendered
+            if end < length:
+                text += "\n" + "\n".join(conversation_history[end:])
+    if text is None:
+        text = "\n".join(conversation_history[start:])
+    if length > start:
+        state.rendered_history = (
+            conversation_history,
+            start,
+            length,
+            conversation_history[-1],
+            text,
+        )
+    return text
@@ -0,0 +1,330 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple
+
+from langchain_community.vectorstores import Chroma
+from langchain_core.embeddings import Embeddings
+from tenacity import Retrying, stop_after_attempt, wait_exponential
+
+PARAGRAPH_SPLIT_REGEX = re.compile(r"\n\s*\n")
+SENTENCE_END_REGEX = re.compile(r"[.!?]\s")
+CHUNK_SEPARATOR = "\n\n"
+
+
+def iter_catalog_files(path: str) -> Iterator[str]:
+    """
+    Yields the catalog files at a path in a stable order.
+
+    Args:
+        path (str): A catalog file or a directory of catalog files. Hidden files and directories are skipped.
+
+    Returns:
+        Iterator[str]: Paths of the catalog files.
+    """
+    if not os.path.isdir(path):
+        yield path
+        return
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(files):
+            if not name.startswith("."):
+                yield os.path.join(root, name)
+
+
+def _split_paragraph(text: str, max_size: int) -> Tuple[List[str], str]:
+    # cuts after the last line end, else after the last sentence end, else at max_size
+    pieces = []
+    start = 0
+    while len(text) - start > max_size:
+        end = start + max_size
+        cut = text.rfind("\n", start, end) + 1
+        if cut <= start:
+            match = None
+            for match in SENTENCE_END_REGEX.finditer(text, start, end):
+                pass
+            cut = match.end() if match is not None else end
+        pieces.append(text[start:cut])
+        start = cut
+    return pieces, text[start:]
+
+
+def iter_paragraphs(
+    path: str, read_size: int = 1 << 20, max_size: Optional[int] = None
+) -> Iterator[str]:
+    """
+    Streams the blank-line separated paragraphs of a text file.
+
+    Args:
+        path (str): The text file.
+        read_size (int): Number of characters read at a time.
+        max_size (int, optional): Paragraphs longer than this many characters are split at line ends, or
+            sentence ends if a line is too long, so files without blank lines are streamed too.
+
+    Returns:
+        Iterator[str]: The non-empty paragraphs, stripped.
+    """
+    buffer = ""
+    with open(path, "r", encoding="utf-8") as f:
+        for block in iter(lambda: f.read(read_size), ""):
+            paragraphs = PARAGRAPH_SPLIT_REGEX.split(buffer + block)
+            # the last paragraph may continue in the next block
+            buffer = paragraphs.pop()
+            if max_size is not None:
+                split = []
+                for paragraph in paragraphs:
+                    pieces, rest = _split_paragraph(paragraph, max_size)
+                    split.extend(pieces)
+                    split.append(rest)
+                pieces, buffer = _split_paragraph(buffer, max_size)
+                paragraphs = split + pieces
+            for paragraph in paragraphs:
+                if paragraph.strip():
+                    yield paragraph.strip()
+    if buffer.strip():
+        yield buffer.strip()
+
+
+def iter_chunks(
+    paragraphs: Iterable[str], chunk_size: int = 5000, chunk_overlap: int = 200
+) -> Iterator[str]:
+    """
+    Merges paragraphs into chunks of at most chunk_size characters, like CharacterTextSplitter.
+
+    Consecutive chunks share trailing paragraphs of up to chunk_overlap characters. A paragraph longer
+    than chunk_size becomes a chunk of its own. Only the paragraphs of the current chunk are kept in memory.
+
+    Args:
+        paragraphs (Iterable[str]): The paragraphs in order.
+        chunk_size (int): Maximum chunk length in characters.
+        chunk_overlap (int): Maximum overlap between consecutive chunks in characters.
+
+    Returns:
+        Iterator[str]: The chunks.
+    """
+    separator_length = len(CHUNK_SEPARATOR)
+    window: deque = deque()
+    length = 0
+    for paragraph in paragraphs:
+        added_length = len(paragraph) + (separator_length if window else 0)
+        if window and length + added_length > chunk_size:
+            yield CHUNK_SEPARATOR.join(window)
+            while window and (
+                length > chunk_overlap
+                or length + separator_length + len(paragraph) > chunk_size
+            ):
+                removed = window.popleft()
+                length = length - len(removed) - separator_length if window else 0
+            added_length = len(paragraph) + (separator_length if window else 0)
+        window.append(paragraph)
+        length += added_length
+    if window:
+        yield CHUNK_SEPARATOR.join(window)
+
+
+def iter_catalog_chunks(
+    path: str, chunk_size: int = 5000, chunk_overlap: int = 200
+) -> Iterator[Tuple[str, dict]]:
+    """
+    Streams the chunks of a catalog file or directory of catalog files.
+
+    Args:
+        path (str): A catalog file or directory.
+        chunk_size (int): Maximum chunk length in characters.
+        chunk_overlap (int): Maximum overlap between consecutive chunks in characters.
+
+    Returns:
+        Iterator[Tuple[str, dict]]: The chunk texts with their metadata ({"source": <file path>}).
+    """
+    for file_path in iter_catalog_files(path):
+        source = os.path.abspath(file_path)
+        paragraphs = iter_paragraphs(file_path, max_size=chunk_size)
+        for chunk in iter_chunks(paragraphs, chunk_size, chunk_overlap):
+            yield chunk, {"source": source}
+
+
+def chunk_id(text: str, metadata: dict) -> str:
+    """Returns a deterministic id for a chunk, so re-ingesting a catalog never duplicates it."""
+    key = f"{metadata.get('source', '')}\n{text}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class ChromaCatalogWriter:
+    """Writes embedded catalog chunks into a Chroma collection."""
+
+    def __init__(self, vectorstore: Chroma):
+        self.vectorstore = vectorstore
+
+    def existing_ids(self, ids: List[str]) -> Set[str]:
+        """
+        Returns which of the ids are already in the collection.
+
+        Args:
+            ids (List[str]): The chunk ids.
+
+        Returns:
+            Set[str]: The ids already written.
+        """
+        return set(self.vectorstore._collection.get(ids=ids, include=[])["ids"])
+
+    def write(
+        self,
+        ids: List[str],
+        texts: List[str],
+        vectors: List[List[float]],
+        metadatas: List[dict],
+    ):
+        """
+        Upserts embedded chunks.
+
+        Args:
+            ids (List[str]): The chunk ids.
+            texts (List[str]): The chunk texts.
+            vectors (List[List[float]]): The chunk embeddings.
+            metadatas (List[dict]): The chunk metadata.
+
+        Returns:
+            None
+        """
+        self.vectorstore._collection.upsert(
+            ids=ids, embeddings=vectors, documents=texts, metadatas=metadatas
+        )
+
+
+@dataclass
+class IngestionStats:
+    """Progress of a catalog ingestion."""
+
+    chunks: int = 0
+    skipped: int = 0
+    characters: int = 0
+    batches: int = 0
+    retries: int = 0
+    sources: Set[str] = field(default_factory=set)
+    started: float = field(default_factory=time.perf_counter)
+    seconds: float = 0.0
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.chunks} chunks embedded, {self.skipped} already indexed, "
+            f"{len(self.sources)} files, {self.characters / 1e6:.1f}M characters "
+            f"in {self.seconds:.1f}s ({self.chunks_per_second:.1f} chunks/s, "
+            f"{self.batches} batches, {self.retries} retries)"
+        )
+
+
+def ingest_catalog(
+    chunks: Iterable[Tuple[str, dict]],
+    embeddings: Embeddings,
+    writer: ChromaCatalogWriter,
+    batch_size: int = 64,
+    max_concurrency: int = 4,
+    max_attempts: int = 3,
+    progress_interval: float = 10.0,
+    progress_callback: Optional[Callable[[IngestionStats], None]] = None,
+) -> IngestionStats:
+    """
+    Embeds a stream of catalog chunks in concurrent batches and writes them to the index as they complete.
+
+    At most max_concurrency batches are embedded at a time and the chunk stream is only consumed as batches
+    complete, so memory use is bounded by batch_size * (max_concurrency + 1) chunks however large the
+    catalog is. Chunks already in the index are skipped, so an interrupted ingestion resumes where it
+    stopped. Failed embedding calls are retried with exponential backoff.
+
+    Args:
+        chunks (Iterable[Tuple[str, dict]]): Chunk texts with their metadata, e.g. from iter_catalog_chunks.
+        embeddings (Embeddings): The embedding model.
+        writer (ChromaCatalogWriter): Destination of the embedded chunks.
+        batch_size (int): Number of chunks per embedding call.
+        max_concurrency (int): Maximum number of embedding calls in flight.
+        max_attempts (int): Attempts per batch before the ingestion fails.
+        progress_interval (float): Seconds between progress reports.
+        progress_callback (Optional[Callable[[IngestionStats], None]]): Called with the stats after every
+            written batch.
+
+    Returns:
+        IngestionStats: Counts and throughput of the ingestion.
+    """
+    stats = IngestionStats()
+    stats_lock = threading.Lock()
+    last_report = stats.started
+
+    def count_retry(retry_state):
+        with stats_lock:
+            stats.retries += 1
+
+    def embed(batch):
+        ids, texts, metadatas = batch
+        for attempt in Retrying(
+            stop=stop_after_attempt(max_attempts),
+            wait=wait_exponential(multiplier=1, min=1, max=30),
+            before_sleep=count_retry,
+            reraise=True,
+        ):
+            with attempt:
+                vectors = embeddings.embed_documents(texts)
+        return ids, texts, vectors, metadatas
+
+    def write(future):
+        nonlocal last_report
+        ids, texts, vectors, metadatas = future.result()
+        writer.write(ids, texts, vectors, metadatas)
+        stats.chunks += len(ids)
+        stats.batches += 1
+        now = time.perf_counter()
+        stats.seconds = now - stats.started
+        if progress_callback is not None:
+            progress_callback(stats)
+        if now - last_report >= progress_interval:
+            last_report = now
+            print(f"Ingesting product catalog: {stats.summary()}")
+
+    with ThreadPoolExecutor(
+        max_workers=max_concurrency, thread_name_prefix="catalog-ingestion"
+    ) as executor:
+        pending = set()
+        for batch in _batched(chunks, batch_size):
+            ids = [chunk_id(text, metadata) for text, metadata in batch]
+            for _, metadata in batch:
+                stats.sources.add(metadata.get("source", ""))
+            existing = writer.existing_ids(ids)
+            stats.skipped += len(existing)
+            batch = [
+                (i, text, metadata)
+                for i, (text, metadata) in zip(ids, batch)
+                if i not in existing
+            ]
+            if not batch:
+                continue
+            stats.characters += sum(len(text) for _, text, _ in batch)
+            if len(pending) >= max_concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(future)
+            pending.add(executor.submit(embed, tuple(map(list, zip(*batch)))))
+        for future in pending:
+            write(future)
+
+    stats.seconds = time.perf_counter() - stats.started
+    print(f"Ingested product catalog: {stats.summary()}")
+    return stats
+
+
+def _batched(items: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,229 @@
+import hashlib
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from langchain.indexes import SQLRecordManager, index
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from salesgpt.embeddings import EMBEDDING_BACKENDS
+from salesgpt.ingestion import iter_catalog_files
+from salesgpt.logger import time_logger
+
+
+@dataclass(frozen=True)
+class KnowledgeBaseConfig:
+    """
+    Retrieval and index options of a product knowledge base, see setup_knowledge_base.
+
+    Configs are hashable, so a config is also the registry key of the knowledge base it builds.
+    """
+
+    # embedding_backend="local" embeds in-process with HashingEmbeddings instead of embedding_model
+    embedding_model: str = "text-embedding-ada-002"
+    embedding_backend: str = "openai"
+    # caches chunk embeddings on disk and holds the persistent or memory-mapped index
+    persist_directory: Optional[str] = None
+    vector_store: str = "chroma"
+    chunk_size: int = 5000
+    chunk_overlap: int = 200
+    top_k: int = 4
+    # combines BM25 and vector rankings, lexical_weight being the weight of BM25
+    hybrid_search: bool = False
+    lexical_weight: float = 0.5
+    # "qa" answers with a RetrievalQA chain, "direct" returns the ranked passages without an LLM call
+    retrieval_mode: str = "qa"
+    qa_model_name: str = "gpt-4-0125-preview"
+    max_context_tokens: int = 800
+    compress_passages: bool = False
+    # answers price, size and availability questions from parsed product records
+    structured_lookup: bool = False
+    answer_cache: bool = False
+    answer_cache_size: int = 1024
+    answer_cache_ttl: float = 3600
+    answer_cache_similarity: float = 0.95
+    # starts retrieval for human turns that mention catalog products, see SalesGPT.human_step
+    prefetch: bool = False
+    # streams, chunks and embeds catalogs, or catalog directories, larger than memory
+    streaming_ingestion: bool = False
+    ingestion_batch_size: int = 64
+    ingestion_concurrency: int = 4
+
+    def __post_init__(self):
+        if self.vector_store not in ["chroma", "memmap"]:
+            raise ValueError("vector_store must be 'chroma' or 'memmap'")
+        if self.vector_store == "memmap" and not self.persist_directory:
+            raise ValueError("vector_store 'memmap' requires a persist_directory")
+        if self.retrieval_mode not in ["qa", "direct"]:
+            raise ValueError("retrieval_mode must be 'qa' or 'direct'")
+        if self.embedding_backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"embedding_backend must be one of {EMBEDDING_BACKENDS}")
+        if not 0 <= self.lexical_weight <= 1:
+            raise ValueError("lexical_weight must be between 0 and 1")
+        if self.streaming_ingestion and (
+            self.vector_store == "memmap"
+            or self.hybrid_search
+            or self.structured_lookup
+            or self.prefetch
+        ):
+            raise ValueError(
+                "streaming_ingestion does not support vector_store 'memmap', hybrid_search, "
+                "structured_lookup or prefetch"
+            )
+
+
+def catalog_hash(product_catalog: str) -> str:
+    """
+    Computes a content hash of a product catalog file or directory of catalog files.
+
+    Files are read in fixed-size blocks so large catalogs are hashed without loading them into memory.
+
+    Args:
+        product_catalog (str): Path to the product catalog file or directory.
+
+    Returns:
+        str: The hex SHA-256 digest of the catalog contents.
+    """
+    sha = hashlib.sha256()
+    is_directory = os.path.isdir(product_catalog)
+    for path in iter_catalog_files(product_catalog):
+        if is_directory:
+            sha.update(os.path.relpath(path, product_catalog).encode("utf-8") + b"\0")
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+    return sha.hexdigest()
+
+
+def index_catalog_texts(
+    texts: List[str],
+    embeddings: Embeddings,
+    persist_directory: str,
+    collection_name: str,
+    source: str,
+) -> Chroma:
+    """
+    Incrementally indexes catalog chunks into a persistent Chroma collection.
+
+    A record manager stored next to the collection remembers which chunks are already indexed, so re-indexing
+    only embeds new or changed chunks and deletes chunks that are no longer part of the catalog.
+
+    Args:
+        texts (List[str]): The catalog chunks.
+        embeddings (Embeddings): Embedding model used for new chunks.
+        persist_directory (str): Directory holding the Chroma collection and the record manager database.
+        collection_name (str): Name of the Chroma collection.
+        source (str): Identifier of the catalog the chunks come from.
+
+    Returns:
+        Chroma: The up-to-date vector store.
+    """
+    os.makedirs(persist_directory, exist_ok=True)
+    vectorstore = Chroma(
+        collection_name=collection_name,
+        embedding_function=embeddings,
+        persist_directory=os.path.join(persist_directory, "chroma"),
+    )
+    record_manager = SQLRecordManager(
+        f"chroma/{collection_name}",
+        db_url=f"sqlite:///{os.path.join(persist_directory, 'record_manager.sqlite')}",
+    )
+    record_manager.create_schema()
+
+    docs = [Document(page_content=text, metadata={"source": source}) for text in texts]
+    result = index(
+        docs,
+        record_manager,
+        vectorstore,
+        cleanup="full",
+        source_id_key="source",
+    )
+    print(f"Indexed product catalog {source}: {result}")
+    return vectorstore
+
+
+class KnowledgeBaseRegistry:
+    """
+    Process-wide registry of product knowledge bases.
+
+    Knowledge bases are keyed by catalog content hash, embedding model and build options, so every session
+    that uses the same catalog shares one index instead of re-splitting and re-embedding the catalog.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Tuple[str, str, Hashable], threading.Lock] = {}
+        self._knowledge_bases: Dict[Tuple[str, str, Hashable], Any] = {}
+        self.hits = 0
+        self.builds = 0
+
+    def _lock_for(self, key: Tuple[str, str, Hashable]) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    @time_logger
+    def get_or_build(
+        self,
+        catalog_hash: str,
+        embedding_model: str,
+        builder: Callable[[], Any],
+        options: Optional[Hashable] = None,
+    ) -> Any:
+        """
+        Returns the knowledge base for the given key, building it on first use.
+
+        Builds for the same key are serialized so concurrent sessions never embed a catalog twice,
+        while builds for different catalogs can proceed in parallel.
+
+        Args:
+            catalog_hash (str): Content hash of the product catalog.
+            embedding_model (str): Name of the embedding model used to index the catalog.
+            builder (Callable[[], Any]): Called without arguments to build the knowledge base on a miss.
+            options (Optional[Hashable]): Build options that change the resulting knowledge base, e.g. a
+                KnowledgeBaseConfig.
+
+        Returns:
+            Any: The shared knowledge base.
+        """
+        key = (catalog_hash, embedding_model, options)
+        with self._lock_for(key):
+            knowledge_base = self._knowledge_bases.get(key)
+            if knowledge_base is not None:
+                self.hits += 1
+                return knowledge_base
+            knowledge_base = builder()
+            self._knowledge_bases[key] = knowledge_base
+            self.builds += 1
+            return knowledge_base
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns registry counters.
+
+        Returns:
+            Dict[str, int]: Number of cached knowledge bases, cache hits and builds.
+        """
+        return {
+            "knowledge_bases": len(self._knowledge_bases),
+            "hits": self.hits,
+            "builds": self.builds,
+        }
+
+    def clear(self):
+        """
+        Drops all cached knowledge bases and resets the counters.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._knowledge_bases.clear()
+            self._key_locks.clear()
+            self.hits = 0
+            self.builds = 0
+
+
+KNOWLEDGE_BASE_REGISTRY = KnowledgeBaseRegistry()
@@ -1,5 +1,5 @@
 import re
-from typing import Union
+from typing import Dict, Optional, Tuple, Union
 
 from langchain.agents.agent import AgentOutputParser
 from langchain.agents.conversational.prompt import FORMAT_INSTRUCTIONS
@@ -31,3 +31,134 @@ class SalesConvoOutputParser(AgentOutputParser):
     @property
     def _type(self) -> str:
         return "sales-agent"
+
+
+STAGE_LINE_REGEX = re.compile(
+    r"^\s*[\[(*#]*\s*(?:(?:conversation\s+)?stage(?:\s*id)?\s*[*]*\s*[:=#\-]?\s*)?"
+    r"[\[(*]*\s*(\d+)\s*[\])*.:]*\s*$",
+    re.IGNORECASE,
+)
+INLINE_STAGE_REGEX = re.compile(
+    r"^\s*[\[(*#]*\s*(?:conversation\s+)?stage(?:\s*id)?\s*[*]*\s*[:=#\-]?\s*"
+    r"[\[(*]*\s*(\d+)\s*[\])*.:,\-]*\s*",
+    re.IGNORECASE,
+)
+STAGE_HEADER_MAX_CHARS = 40
+END_OF_TURN = "<END_OF_TURN>"
+
+
+class JointStageOutputParser:
+    """
+    Splits a joint stage-and-utterance generation into the stage id and the utterance.
+
+    The generation is expected to start with a "Stage: <id>" line followed by "<ai_prefix>: <utterance>".
+    Variations such as "3", "**Stage 3**" or "Stage 3 - <utterance>" on one line are accepted, and a
+    generation without a stage header is treated as a plain utterance. Text can be fed in streamed deltas:
+    feed returns the part of each delta that belongs to the utterance, so utterance tokens can be forwarded
+    as they arrive. At most the first line (or STAGE_HEADER_MAX_CHARS characters) is held back, and a tail
+    that may be the start of an <END_OF_TURN> marker.
+    """
+
+    def __init__(self, ai_prefix: str = "AI", conversation_stages: Optional[Dict] = None):
+        self.ai_prefix = ai_prefix
+        self.conversation_stages = conversation_stages
+        self.stage_id: Optional[str] = None
+        self.utterance = ""
+        self._buffer = ""
+        self._header_done = False
+        self._prefix_done = False
+
+    def _could_be_header(self) -> bool:
+        text = self._buffer.lstrip().lstrip("[(*# ").lower()
+        if not text or text[0].isdigit():
+            return True
+        return any(
+            text.startswith(word) or word.startswith(text)
+            for word in ("stage", "conversation stage")
+        )
+
+    def _parse_header(self):
+        first_line, newline, rest = self._buffer.partition("\n")
+        match = STAGE_LINE_REGEX.match(first_line) if newline else None
+        if match:
+            self._buffer = rest
+        else:
+            match = INLINE_STAGE_REGEX.match(self._buffer)
+            if match:
+                self._buffer = self._buffer[match.end() :]
+        if match and (
+            self.conversation_stages is None or match.group(1) in self.conversation_stages
+        ):
+            self.stage_id = match.group(1)
+        self._header_done = True
+
+    def _strip_prefix(self, final: bool) -> bool:
+        text = self._buffer.lstrip()
+        prefix = f"{self.ai_prefix}:"
+        if not final and prefix.startswith(text):
+            return False
+        if text.startswith(prefix):
+            text = text[len(prefix) :].lstrip()
+        self._buffer = text
+        self._prefix_done = True
+        return True
+
+    def _flush(self, final: bool = False) -> str:
+        text = self._buffer.replace(END_OF_TURN, "")
+        self._buffer = ""
+        if not final:
+            # hold back a tail that may continue as the end of turn marker in the next delta
+            start = text.rfind("<", max(0, len(text) - len(END_OF_TURN) + 1))
+            if start != -1 and END_OF_TURN.startswith(text[start:]):
+                text, self._buffer = text[:start], text[start:]
+        self.utterance += text
+        return text
+
+    def feed(self, text: str) -> str:
+        """
+        Adds a streamed delta of the generation.
+
+        Args:
+            text (str): The delta.
+
+        Returns:
+            str: The utterance text that can be forwarded, possibly empty while the header is parsed.
+        """
+        self._buffer += text or ""
+        if not self._header_done:
+            if not self._could_be_header():
+                self._header_done = True
+            elif "\n" in self._buffer or len(self._buffer) > STAGE_HEADER_MAX_CHARS:
+                self._parse_header()
+            else:
+                return ""
+        if not self._prefix_done and not self._strip_prefix(final=False):
+            return ""
+        return self._flush()
+
+    def finish(self) -> str:
+        """
+        Ends the generation.
+
+        Returns:
+            str: The remaining utterance text that was held back.
+        """
+        if not self._header_done:
+            self._parse_header()
+        if not self._prefix_done:
+            self._strip_prefix(final=True)
+        return self._flush(final=True)
+
+    def parse(self, text: str) -> Tuple[Optional[str], str]:
+        """
+        Parses a complete generation.
+
+        Args:
+            text (str): The generation.
+
+        Returns:
+            Tuple[Optional[str], str]: The stage id, or None if there is no valid one, and the utterance.
+        """
+        self.feed(text)
+        self.finish()
+        return self.stage_id, self.utterance.strip()
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.pydantic_v1 import PrivateAttr
+from langchain_core.retrievers import BaseRetriever
+
+from salesgpt.cache import LRUTTLCache
+from salesgpt.catalog import ProductIndex
+
+
+class PrefetchingRetriever(BaseRetriever):
+    """
+    Retriever that starts catalog retrieval as soon as the prospect mentions a product.
+
+    prefetch is called with the human turn before the agent's LLM call. If the turn mentions products from the
+    catalog vocabulary, retrieval for it runs in a background thread while the agent is reasoning. When the
+    agent then calls ProductSearch about the same products and asks about nothing the turn did not mention
+    (see ProductIndex.topic_terms), the prefetched documents are used, waiting for the background
+    retrieval if it is still in flight. Other queries go to the wrapped retriever.
+    """
+
+    retriever: BaseRetriever
+    product_index: ProductIndex
+    ttl: float = 120
+    max_workers: int = 4
+
+    _executor: ThreadPoolExecutor = PrivateAttr()
+    _prefetched: LRUTTLCache = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+    _stats: Dict[str, int] = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="catalog-prefetch"
+        )
+        self._prefetched = LRUTTLCache(max_size=256, ttl=self.ttl)
+        self._lock = threading.Lock()
+        self._stats = {"prefetches": 0, "hits": 0, "misses": 0}
+
+    def detect_products(self, text: str) -> Optional[FrozenSet[str]]:
+        """
+        Detects the catalog products a text refers to.
+
+        Args:
+            text (str): A human turn or a search query.
+
+        Returns:
+            Optional[FrozenSet[str]]: Names of the mentioned products, or None if there are none.
+        """
+        products = self.product_index.find(text)
+        if not products:
+            return None
+        return frozenset(product.name for product in products)
+
+    def _key(self, text: str) -> Optional[Tuple[FrozenSet[str], FrozenSet[str]]]:
+        products = self.detect_products(text)
+        if products is None:
+            return None
+        return products, self.product_index.topic_terms(text)
+
+    def prefetch(self, text: str) -> bool:
+        """
+        Starts retrieval for a human turn in the background if it mentions catalog products.
+
+        Args:
+            text (str): The human turn.
+
+        Returns:
+            bool: Whether a prefetch was started.
+        """
+        key = self._key(text)
+        if key is None:
+            return False
+        with self._lock:
+            if key in self._prefetched:
+                return False
+            future = self._executor.submit(
+                self.retriever.get_relevant_documents, text
+            )
+            self._prefetched[key] = future
+            self._stats["prefetches"] += 1
+        return True
+
+    def _find_prefetched(
+        self, products: FrozenSet[str], topic: FrozenSet[str]
+    ) -> Optional[Future]:
+        future = self._prefetched.get((products, topic))
+        if future is not None:
+            return future
+        # the prefetched turn may have mentioned more than the query asks about
+        self._prefetched.expire()
+        for (prefetched_products, prefetched_topic), future in self._prefetched.items():
+            if prefetched_products == products and topic <= prefetched_topic:
+                return future
+        return None
+
+    def _prefetched_future(self, query: str) -> Optional[Future]:
+        key = self._key(query)
+        with self._lock:
+            future = None if key is None else self._find_prefetched(*key)
+            if future is None or (future.done() and future.exception() is not None):
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            return future
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        future = self._prefetched_future(query)
+        if future is not None:
+            try:
+                return future.result()
+            except Exception as e:
+                print(f"Prefetched retrieval failed, retrieving again: {e}")
+        return self.retriever.get_relevant_documents(
+            query, callbacks=run_manager.get_child()
+        )
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        future = self._prefetched_future(query)
+        if future is not None:
+            try:
+                return await asyncio.wrap_future(future)
+            except Exception as e:
+                print(f"Prefetched retrieval failed, retrieving again: {e}")
+        return await self.retriever.aget_relevant_documents(
+            query, callbacks=run_manager.get_child()
+        )
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._stats)
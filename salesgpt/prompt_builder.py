@@ -0,0 +1,108 @@
+from string import Formatter
+from typing import Any, Dict, List
+
+from langchain.prompts import ChatPromptTemplate
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_core.prompts.chat import BaseChatPromptTemplate
+
+
+def _escape(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+class PromptBuilder:
+    """
+    Renders a two message prompt (see cacheable_prompt) with everything static rendered only once.
+
+    The system message only uses inputs that are fixed for an agent configuration, so it is rendered when
+    the builder is created. The static inputs of the history template are substituted at the same time,
+    which leaves a small template with only the per-turn fields, e.g. the conversation history and the
+    current stage id. Rendering a turn is then a single str.format of that template.
+    """
+
+    def __init__(
+        self, system_template: str, history_template: str, static_inputs: Dict[str, Any]
+    ):
+        self.system_prompt = system_template.format(**static_inputs)
+        parts = []
+        self.input_variables: List[str] = []
+        for literal, field, format_spec, conversion in Formatter().parse(
+            history_template
+        ):
+            parts.append(_escape(literal))
+            if field is None:
+                continue
+            if field in static_inputs:
+                parts.append(_escape(str(static_inputs[field])))
+            else:
+                if field not in self.input_variables:
+                    self.input_variables.append(field)
+                parts.append("{" + field + "}")
+        self.history_template = "".join(parts)
+
+    def format_history(self, **inputs: Any) -> str:
+        """
+        Renders the history message.
+
+        Args:
+            **inputs: The per-turn inputs, see input_variables. Other inputs are ignored.
+
+        Returns:
+            str: The content of the history message.
+        """
+        return self.history_template.format(**inputs)
+
+    def messages(self, **inputs: Any) -> List[Dict[str, str]]:
+        """
+        Renders the prompt as OpenAI style chat messages.
+
+        Args:
+            **inputs: The per-turn inputs, see input_variables. Other inputs are ignored.
+
+        Returns:
+            List[Dict[str, str]]: The system message and the history message.
+        """
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": self.format_history(**inputs)},
+        ]
+
+
+class PrecompiledChatPrompt(BaseChatPromptTemplate):
+    """Chat prompt rendered by a PromptBuilder, for use in an LLMChain. source is the uncompiled prompt."""
+
+    builder: Any
+    source: Any
+
+    @classmethod
+    def from_chat_prompt(
+        cls, prompt: ChatPromptTemplate, static_inputs: Dict[str, Any]
+    ) -> "PrecompiledChatPrompt":
+        """
+        Precompiles a two message prompt made by cacheable_prompt.
+
+        Args:
+            prompt (ChatPromptTemplate): The prompt with a system and a history message template.
+            static_inputs (Dict[str, Any]): The inputs that are fixed for the agent configuration. Inputs
+                the prompt does not use are ignored.
+
+        Returns:
+            PrecompiledChatPrompt: The prompt, which only takes the per-turn inputs.
+        """
+        system, history = prompt.messages
+        builder = PromptBuilder(
+            system.prompt.template, history.prompt.template, static_inputs
+        )
+        return cls(
+            builder=builder, source=prompt, input_variables=builder.input_variables
+        )
+
+    def format_messages(self, **kwargs: Any) -> List[BaseMessage]:
+        return [
+            SystemMessage(content=self.builder.system_prompt),
+            HumanMessage(content=self.builder.format_history(**kwargs)),
+        ]
+
+    @property
+    def _prompt_type(self) -> str:
+        return "precompiled-chat"
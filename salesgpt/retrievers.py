@@ -0,0 +1,342 @@
+import asyncio
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.pydantic_v1 import PrivateAttr
+from langchain_core.retrievers import BaseRetriever
+
+from salesgpt.tokens import count_tokens
+
+SENTENCE_SPLIT_REGEX = re.compile(r"(?<=[.!?])\s+|\n+")
+WORD_REGEX = re.compile(r"[a-z0-9$][a-z0-9$,.\-]*[a-z0-9]|[a-z0-9$]")
+STOPWORDS = set(
+    "a an and are as at be by can do does for from have how i in is it its me much "
+    "of on or that the this to what which with you your".split()
+)
+
+
+def query_terms(text: str) -> List[str]:
+    """
+    Lowercases a text and splits it into content words, dropping stopwords.
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        List[str]: The content words in order of appearance.
+    """
+    return [word for word in WORD_REGEX.findall(text.lower()) if word not in STOPWORDS]
+
+
+def compress_passage(passage: str, query: str) -> str:
+    """
+    Keeps only the sentences of a passage that are relevant to the query.
+
+    The first sentence is always kept because catalog passages start with the product name.
+    Sentences sharing at least one content word with the query are kept in their original order.
+
+    Args:
+        passage (str): The retrieved passage.
+        query (str): The search query.
+
+    Returns:
+        str: The compressed passage, or the original one if nothing matched.
+    """
+    terms = set(query_terms(query))
+    sentences = [s.strip() for s in SENTENCE_SPLIT_REGEX.split(passage) if s.strip()]
+    if not sentences or not terms:
+        return passage
+    kept = [sentences[0]] + [
+        sentence
+        for sentence in sentences[1:]
+        if terms.intersection(query_terms(sentence))
+    ]
+    if len(kept) == 1:
+        return passage
+    return "\n".join(kept)
+
+
+def truncate_to_tokens(
+    text: str, max_tokens: int, token_counter: Callable[[str], int] = count_tokens
+) -> str:
+    """
+    Truncates a text at a word boundary so that it fits into max_tokens.
+
+    Args:
+        text (str): The text to truncate.
+        max_tokens (int): The token budget.
+        token_counter (Callable[[str], int]): Function counting the tokens of a text.
+
+    Returns:
+        str: The truncated text.
+    """
+    if token_counter(text) <= max_tokens:
+        return text
+    words = text.split(" ")
+    low, high = 0, len(words)
+    # binary search for the longest prefix that fits
+    while low < high:
+        mid = (low + high + 1) // 2
+        if token_counter(" ".join(words[:mid])) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return " ".join(words[:low])
+
+
+class DirectRetrievalKnowledgeBase:
+    """
+    Knowledge base that answers with ranked catalog passages instead of an LLM generated answer.
+
+    The passages are returned straight into the agent's observation, so a product question costs one LLM
+    call (the agent's) instead of two. Passages are added in rank order until max_tokens is reached and can
+    optionally be compressed to the sentences that are relevant to the query.
+    """
+
+    def __init__(
+        self,
+        retriever: BaseRetriever,
+        max_tokens: int = 800,
+        compress: bool = False,
+        token_counter: Callable[[str], int] = count_tokens,
+    ):
+        self.retriever = retriever
+        self.max_tokens = max_tokens
+        self.compress = compress
+        self.token_counter = token_counter
+
+    def format_documents(self, query: str, documents: List[Document]) -> str:
+        """
+        Formats ranked documents into a token-budgeted observation.
+
+        Args:
+            query (str): The search query.
+            documents (List[Document]): The retrieved documents, best first.
+
+        Returns:
+            str: The passages separated by blank lines, or "I don't know." if nothing was found.
+        """
+        passages = []
+        budget = self.max_tokens
+        for document in documents:
+            passage = document.page_content.strip()
+            if self.compress:
+                passage = compress_passage(passage, query)
+            tokens = self.token_counter(passage)
+            if tokens > budget:
+                if not passages:
+                    passages.append(
+                        truncate_to_tokens(passage, budget, self.token_counter)
+                    )
+                break
+            passages.append(passage)
+            budget -= tokens
+        if not passages:
+            return "I don't know."
+        return "\n\n".join(passages)
+
+    def run(self, query: str) -> str:
+        """
+        Retrieves the catalog passages relevant to the query.
+
+        Args:
+            query (str): The search query.
+
+        Returns:
+            str: The formatted passages.
+        """
+        return self.format_documents(query, self.retriever.get_relevant_documents(query))
+
+    async def arun(self, query: str) -> str:
+        """
+        Asynchronously retrieves the catalog passages relevant to the query.
+
+        Args:
+            query (str): The search query.
+
+        Returns:
+            str: The formatted passages.
+        """
+        documents = await self.retriever.aget_relevant_documents(query)
+        return self.format_documents(query, documents)
+
+
+def index_terms(text: str) -> List[str]:
+    """
+    Splits a text into the terms indexed for lexical search.
+
+    Compound words such as "cloud-comfort" or SKUs such as "eco-200" are kept whole and also split into
+    their parts, so both exact identifiers and partial names match.
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        List[str]: The terms, with repetitions.
+    """
+    terms = []
+    for word in query_terms(text):
+        terms.append(word)
+        parts = [part for part in re.split(r"[,.\-]", word) if part]
+        if len(parts) > 1:
+            terms.extend(part for part in parts if part not in STOPWORDS)
+    return terms
+
+
+class BM25Retriever(BaseRetriever):
+    """
+    Lexical retriever ranking documents with Okapi BM25 over an inverted index.
+
+    Each term maps to NumPy arrays of the documents containing it and their precomputed BM25 term weights,
+    so a query only touches the postings of its own terms.
+    """
+
+    documents: List[Document]
+    k: int = 4
+    k1: float = 1.5
+    b: float = 0.75
+
+    _postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        term_counts = [Counter(index_terms(d.page_content)) for d in self.documents]
+        lengths = np.array([sum(c.values()) for c in term_counts], dtype=np.float32)
+        average_length = float(lengths.mean()) if len(lengths) else 0.0
+        average_length = average_length or 1.0
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for doc_id, counts in enumerate(term_counts):
+            for term, count in counts.items():
+                postings[term].append((doc_id, count))
+
+        n = len(self.documents)
+        self._postings = {}
+        for term, entries in postings.items():
+            doc_ids = np.array([doc_id for doc_id, _ in entries], dtype=np.int64)
+            tf = np.array([count for _, count in entries], dtype=np.float32)
+            idf = math.log(1 + (n - len(entries) + 0.5) / (len(entries) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[doc_ids] / average_length)
+            self._postings[term] = (doc_ids, idf * tf * (self.k1 + 1) / (tf + norm))
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: Iterable[str],
+        metadatas: Optional[Iterable[dict]] = None,
+        **kwargs: Any,
+    ) -> "BM25Retriever":
+        """
+        Builds a BM25 retriever over texts.
+
+        Args:
+            texts (Iterable[str]): The texts to index.
+            metadatas (Optional[Iterable[dict]]): Metadata of each text.
+
+        Returns:
+            BM25Retriever: The retriever.
+        """
+        texts = list(texts)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        documents = [
+            Document(page_content=text, metadata=metadata)
+            for text, metadata in zip(texts, metadatas)
+        ]
+        return cls(documents=documents, **kwargs)
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """
+        Scores the documents matching the query.
+
+        Args:
+            query (str): The search query.
+            k (int): Maximum number of results.
+
+        Returns:
+            List[Tuple[int, float]]: Indices and BM25 scores of the best documents, best first.
+        """
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        for term in set(index_terms(query)):
+            posting = self._postings.get(term)
+            if posting is not None:
+                scores[posting[0]] += posting[1]
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        ranked = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(int(i), float(scores[i])) for i in ranked]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return [self.documents[i] for i, _ in self.search(query, self.k)]
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[Document]], weights: List[float], k: int, c: int = 60
+) -> List[Document]:
+    """
+    Fuses ranked document lists with weighted reciprocal rank fusion.
+
+    A document scores the sum of weight / (c + rank) over the rankings it appears in. Documents are
+    identified by their text, so the same chunk returned by several retrievers is merged.
+
+    Args:
+        rankings (List[List[Document]]): Ranked documents of each retriever, best first.
+        weights (List[float]): Weight of each ranking.
+        k (int): Number of documents to return.
+        c (int): Rank smoothing constant.
+
+    Returns:
+        List[Document]: The k best documents.
+    """
+    scores: Dict[str, float] = defaultdict(float)
+    documents: Dict[str, Document] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, document in enumerate(ranking, start=1):
+            scores[document.page_content] += weight / (c + rank)
+            documents.setdefault(document.page_content, document)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[content] for content in best]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever combining several retrievers, e.g. dense vectors and BM25, with reciprocal rank fusion.
+
+    The retrievers run concurrently in the async path, and only the k best fused documents are returned.
+    """
+
+    retrievers: List[BaseRetriever]
+    weights: List[float]
+    k: int = 4
+    c: int = 60
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        rankings = [
+            retriever.get_relevant_documents(query, callbacks=run_manager.get_child())
+            for retriever in self.retrievers
+        ]
+        return reciprocal_rank_fusion(rankings, self.weights, self.k, self.c)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        rankings = await asyncio.gather(
+            *[
+                retriever.aget_relevant_documents(
+                    query, callbacks=run_manager.get_child()
+                )
+                for retriever in self.retrievers
+            ]
+        )
+        return reciprocal_rank_fusion(rankings, self.weights, self.k, self.c)
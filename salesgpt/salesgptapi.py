@@ -1,12 +1,41 @@
 import asyncio
 import json
 import re
+import threading
+from typing import Any, Dict, Optional, Tuple
 
 from langchain_community.chat_models import BedrockChat, ChatLiteLLM
 from langchain_openai import ChatOpenAI
 
 from salesgpt.agents import SalesGPT
 from salesgpt.models import BedrockCustomModel
+from salesgpt.state import ConversationState, SalesGPTSession
+
+
+# engines are never mutated by sessions, so all sessions with the same configuration share one
+ENGINES: Dict[Tuple, SalesGPT] = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+def prompt_cache_stats() -> Dict[str, Any]:
+    """
+    Returns the prompt cache metrics of all shared engines combined.
+
+    Returns:
+        Dict[str, Any]: LLM calls, prompt tokens, cached prompt tokens and the cached ratio.
+    """
+    totals = {"llm_calls": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0}
+    for engine in list(ENGINES.values()):
+        if engine.prompt_cache_usage is None:
+            continue
+        stats = engine.prompt_cache_usage.stats()
+        for key in totals:
+            totals[key] += stats[key]
+    prompt_tokens = totals["prompt_tokens"]
+    totals["cached_prompt_ratio"] = (
+        totals["cached_prompt_tokens"] / prompt_tokens if prompt_tokens else 0.0
+    )
+    return totals
 
 
 class SalesGPTAPI:
@@ -18,26 +47,58 @@ class SalesGPTAPI:
         model_name: str = "gpt-3.5-turbo",
         product_catalog: str = "examples/sample_product_catalog.txt",
         use_tools=True,
+        background_stage_analysis: bool = False,
+        stage_analysis_timeout: Optional[float] = None,
     ):
         self.config_path = config_path
         self.verbose = verbose
         self.max_num_turns = max_num_turns
         self.model_name = model_name
-        if "anthropic" in model_name:
-            self.llm = BedrockCustomModel(
-                type="bedrock-model",
-                model=model_name,
-                system_prompt="You are a helpful assistant.",
-            )
-        else:
-            self.llm = ChatLiteLLM(temperature=0.2, model=model_name)
         self.product_catalog = product_catalog
-        self.conversation_history = []
         self.use_tools = use_tools
+        # with background stage analysis the reply is returned before the stage of the next turn is known
+        self.background_stage_analysis = background_stage_analysis
+        self.stage_analysis_timeout = stage_analysis_timeout
+        self.stage_task: Optional[asyncio.Task] = None
+        # length of the history the stage task analyzes
+        self.stage_task_turns = 0
         self.sales_agent = self.initialize_agent()
-        self.current_turn = 0
+        self.llm = self.sales_agent.engine.stage_analyzer_chain.llm
+
+    @property
+    def current_turn(self) -> int:
+        return self.sales_agent.state.current_turn
+
+    @current_turn.setter
+    def current_turn(self, current_turn: int):
+        self.sales_agent.state.current_turn = current_turn
+
+    @property
+    def engine_key(self) -> Tuple:
+        return (
+            self.config_path,
+            self.model_name,
+            self.product_catalog,
+            bool(self.use_tools),
+            self.verbose,
+        )
+
+    def build_llm(self):
+        if "anthropic" in self.model_name:
+            return BedrockCustomModel(
+                type="bedrock-model",
+                model=self.model_name,
+                system_prompt="You are a helpful assistant.",
+            )
+        return ChatLiteLLM(temperature=0.2, model=self.model_name)
+
+    def build_engine(self) -> SalesGPT:
+        """
+        Builds the SalesGPT engine for this API's configuration.
 
-    def initialize_agent(self):
+        Returns:
+            SalesGPT: The engine with its LLM, chains, tools and knowledge base.
+        """
         config = {"verbose": self.verbose}
         if self.config_path:
             with open(self.config_path, "r") as f:
@@ -59,13 +120,187 @@ class SalesGPTAPI:
                 }
             )
 
-        sales_agent = SalesGPT.from_llm(self.llm, **config)
+        engine = SalesGPT.from_llm(self.build_llm(), **config)
+        print(f"SalesGPT use_tools: {engine.use_tools}")
+        return engine
 
-        print(f"SalesGPT use_tools: {sales_agent.use_tools}")
-        sales_agent.seed_agent()
-        return sales_agent
+    def get_engine(self) -> SalesGPT:
+        """
+        Returns the shared engine for this API's configuration, building it on first use.
+
+        Returns:
+            SalesGPT: The shared engine.
+        """
+        key = self.engine_key
+        engine = ENGINES.get(key)
+        if engine is None:
+            with _ENGINES_LOCK:
+                engine = ENGINES.get(key)
+                if engine is None:
+                    engine = self.build_engine()
+                    ENGINES[key] = engine
+        return engine
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the session as a JSON serializable dictionary.
+
+        Only the conversation state and the configuration reference are included. The engine is rebuilt
+        from the configuration (or taken from ENGINES) by from_dict.
+
+        Returns:
+            Dict[str, Any]: The configuration reference and the conversation state.
+        """
+        return {
+            "config_path": self.config_path,
+            "verbose": self.verbose,
+            "max_num_turns": self.max_num_turns,
+            "model_name": self.model_name,
+            "product_catalog": self.product_catalog,
+            "use_tools": self.use_tools,
+            "background_stage_analysis": self.background_stage_analysis,
+            "stage_analysis_timeout": self.stage_analysis_timeout,
+            "state": self.sales_agent.state.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SalesGPTAPI":
+        """
+        Restores a session created by to_dict.
+
+        Args:
+            data (Dict[str, Any]): The configuration reference and the conversation state.
+
+        Returns:
+            SalesGPTAPI: The session.
+        """
+        data = dict(data)
+        state = ConversationState.from_dict(data.pop("state"))
+        api = cls(**data)
+        api.sales_agent.state = state
+        return api
+
+    def merge_into(self, stored: Optional["SalesGPTAPI"]) -> "SalesGPTAPI":
+        """
+        Merges this session with the version of it a session store currently holds, see SessionStore.update.
+
+        Stores that restore a new object on every get can hold a newer turn than this object by the time a
+        background task of this object finishes. The session with the longer history is kept and takes
+        over the background results of the other one, so neither newer turns nor late results are lost.
+
+        Args:
+            stored (Optional[SalesGPTAPI]): The stored session, None if there is none.
+
+        Returns:
+            SalesGPTAPI: The session to store.
+        """
+        if stored is None or stored is self:
+            return self
+        state = self.sales_agent.state
+        stored_state = stored.sales_agent.state
+        if len(stored_state.conversation_history) > len(state.conversation_history):
+            stored_state.merge_analysis(state)
+            return stored
+        state.merge_analysis(stored_state)
+        return self
+
+    def initialize_agent(self) -> SalesGPTSession:
+        """
+        Starts a new conversation on the shared engine.
+
+        Returns:
+            SalesGPTSession: The seeded session, which only owns its ConversationState.
+        """
+        return self.get_engine().new_session()
 
     async def do(self, human_input=None):
+        """
+        Runs one turn of the conversation.
+
+        If the turn is cancelled, e.g. because newer input superseded it, the conversation state is rolled
+        back to how it was before the turn, after the stage analysis of the previous turn was applied.
+
+        Args:
+            human_input (str, optional): The human message of the turn.
+
+        Returns:
+            dict: The response payload.
+        """
+        await self.await_stage_analysis()
+        state = self.sales_agent.state
+        history_length = len(state.conversation_history)
+        snapshot = (
+            state.conversation_stage_id,
+            state.current_conversation_stage,
+            state.current_turn,
+            state.stage_analyzed_turns,
+            [list(entry) for entry in state.stage_path],
+        )
+        try:
+            return await self._do(human_input)
+        except asyncio.CancelledError:
+            if self.stage_task is not None:
+                # it analyzes the turn that is rolled back
+                self.stage_task.cancel()
+                self.stage_task = None
+            del state.conversation_history[history_length:]
+            (
+                state.conversation_stage_id,
+                state.current_conversation_stage,
+                state.current_turn,
+                state.stage_analyzed_turns,
+                state.stage_path,
+            ) = snapshot
+            raise
+
+    async def await_stage_analysis(self):
+        """
+        Waits for the background stage analysis of the previous turn.
+
+        If it does not finish within stage_analysis_timeout seconds, it is cancelled and the turn continues
+        with the previous stage. An analysis of turns that are no longer in the history is cancelled right
+        away. If the waiting turn is cancelled, the analysis keeps running for the next turn.
+
+        Returns:
+            None
+        """
+        task, self.stage_task = self.stage_task, None
+        if task is None:
+            return
+        if len(self.sales_agent.conversation_history) < self.stage_task_turns:
+            # the history was replaced since, so the decision would describe another conversation
+            task.cancel()
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(task), self.stage_analysis_timeout)
+        except asyncio.CancelledError:
+            if not task.done():
+                self.stage_task = task
+            raise
+        except asyncio.TimeoutError:
+            task.cancel()
+            print("Stage analysis is too slow - continuing with the previous stage.")
+        except Exception as e:
+            print(f"Stage analysis failed - continuing with the previous stage: {e}")
+
+    async def await_stage_analysis_of(self, previous: "SalesGPTAPI"):
+        """
+        Waits for the background stage analysis another object of this session started and takes over its
+        decision, see await_stage_analysis.
+
+        Stores that restore a new object on every get hand the next turn an object that does not know the
+        stage task of the previous turn. Awaiting it here lets that turn reply in the analyzed stage.
+
+        Args:
+            previous (SalesGPTAPI): The object that ran the previous turn of this session.
+
+        Returns:
+            None
+        """
+        await previous.await_stage_analysis()
+        self.sales_agent.state.merge_analysis(previous.sales_agent.state)
+
+    async def _do(self, human_input=None):
         self.current_turn += 1
         current_turns = self.current_turn
         if current_turns >= self.max_num_turns:
@@ -79,7 +314,19 @@ class SalesGPTAPI:
             self.sales_agent.human_step(human_input)
 
         ai_log = await self.sales_agent.astep(stream=False)
-        await self.sales_agent.adetermine_conversation_stage()
+        if self.sales_agent.joint_stage_generation:
+            # the stage was generated together with the reply
+            pass
+        elif self.background_stage_analysis:
+            # the stage is only needed for the next turn, which awaits it
+            self.stage_task = asyncio.create_task(
+                self.sales_agent.adetermine_conversation_stage()
+            )
+            self.stage_task_turns = len(self.sales_agent.conversation_history)
+        else:
+            await self.sales_agent.adetermine_conversation_stage()
+        # older turns are folded into the summary off the response path
+        self.sales_agent.schedule_summary()
         # TODO - handle end of conversation in the API - send a special token to the client?
         if self.verbose:
             print("=" * 10)
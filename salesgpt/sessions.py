@@ -0,0 +1,785 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from salesgpt.cache import LRUTTLCache
+
+T = TypeVar("T")
+
+
+def estimate_session_bytes(session: Any) -> int:
+    """
+    Estimates the memory owned by one API session.
+
+    Counts the session object, its attributes, its conversation history and the rendered history text. The shared engine
+    (LLM clients, chains and knowledge base) is not owned by any session and is not counted.
+
+    Args:
+        session (Any): A SalesGPTAPI session.
+
+    Returns:
+        int: The estimated size in bytes.
+    """
+    size = sys.getsizeof(session)
+    attributes = getattr(session, "__dict__", None)
+    if attributes is not None:
+        size += sys.getsizeof(attributes)
+        size += sum(
+            sys.getsizeof(value)
+            for value in attributes.values()
+            if isinstance(value, (str, int, float, bool))
+        )
+    agent = getattr(session, "sales_agent", None)
+    state = getattr(agent, "state", None)
+    if state is not None:
+        size += sys.getsizeof(agent) + sys.getsizeof(state)
+        size += sys.getsizeof(state.conversation_history)
+        size += sum(sys.getsizeof(line) for line in state.conversation_history)
+        if getattr(state, "rendered_history", None) is not None:
+            size += sys.getsizeof(state.rendered_history[-1])
+    return size
+
+
+class SessionStore(ABC):
+    """
+    Interface of the stores keeping API sessions between requests.
+
+    get returns a session that can be used for the next turn and save must be called after every turn.
+    """
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[Any]:
+        """Returns the stored session, or None if it does not exist or expired."""
+
+    @abstractmethod
+    def save(self, session_id: str, session: Any):
+        """Stores the session after a turn."""
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Removes the session."""
+
+    def update(
+        self, session_id: str, merge: Callable[[Optional[Any]], Optional[Any]]
+    ):
+        """
+        Saves the session merge returns for the currently stored session.
+
+        Use this instead of save when the session may be out of date, e.g. when a background task of an
+        earlier turn finishes on a session the store has since restored again.
+
+        Args:
+            session_id (str): The session id.
+            merge (Callable[[Optional[Any]], Optional[Any]]): Takes the stored session, or None, and
+                returns the session to save, or None to save nothing.
+
+        Returns:
+            None
+        """
+        session = merge(self.get(session_id))
+        if session is not None:
+            self.save(session_id, session)
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """Returns the store's metrics."""
+
+
+class MemorySessionStore(SessionStore):
+    """
+    In-process store of API sessions bounded by count, idle time and estimated memory.
+
+    Sessions are kept in least-recently-used order, so evicting for size and expiring idle sessions are
+    both O(1) per session. The estimated size of a session is updated whenever it is saved.
+    """
+
+    def __init__(
+        self,
+        max_sessions: Optional[int] = 10000,
+        ttl: Optional[float] = 3600,
+        max_bytes: Optional[int] = None,
+        sizeof: Callable[[Any], int] = estimate_session_bytes,
+        clock: Callable[[], float] = time.monotonic,
+        on_evict: Optional[Callable[[str, Any], None]] = None,
+    ):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self._sizes: Dict[str, int] = {}
+        self._bytes = 0
+        self._sessions = LRUTTLCache(
+            max_size=max_sessions, ttl=ttl, on_evict=self._on_evict, clock=clock
+        )
+
+    def _on_evict(self, session_id: str, session: Any):
+        self._bytes -= self._sizes.pop(session_id, 0)
+        if self.on_evict is not None:
+            self.on_evict(session_id, session)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._sessions
+
+    def get(self, session_id: str) -> Optional[Any]:
+        """
+        Returns a live session and marks it as recently used.
+
+        Args:
+            session_id (str): The session id.
+
+        Returns:
+            Optional[Any]: The session, or None if it is unknown, expired or was evicted.
+        """
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def save(self, session_id: str, session: Any):
+        """
+        Stores a session, evicting the least recently used sessions if a limit is exceeded.
+
+        Args:
+            session_id (str): The session id.
+            session (Any): The session.
+
+        Returns:
+            None
+        """
+        size = self.sizeof(session)
+        with self._lock:
+            self._bytes += size - self._sizes.get(session_id, 0)
+            self._sizes[session_id] = size
+            self._sessions[session_id] = session
+            while (
+                self.max_bytes is not None
+                and self._bytes > self.max_bytes
+                and len(self._sessions) > 1
+            ):
+                self._sessions.evict_oldest()
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id)
+            self._bytes -= self._sizes.pop(session_id, 0)
+
+    def expire(self):
+        """Removes all sessions idle for longer than the TTL."""
+        with self._lock:
+            self._sessions.expire()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns session metrics.
+
+        Returns:
+            Dict[str, Any]: Live sessions, evictions, expirations and estimated memory in bytes.
+        """
+        with self._lock:
+            self._sessions.expire()
+            return {
+                "live_sessions": len(self._sessions),
+                "evictions": self._sessions.evictions,
+                "expirations": self._sessions.expirations,
+                "estimated_bytes": self._bytes,
+            }
+
+
+class SpillingSessionStore(SessionStore):
+    """
+    Session store that moves idle sessions out of memory into compressed snapshots on local disk.
+
+    Sessions idle for more than spill_after seconds, or evicted from memory because of max_sessions or
+    max_bytes, are written as zlib compressed to_dict() JSON into directory. The next get restores a spilled
+    session with session_factory and makes it resident again, so resident memory tracks the active
+    sessions only. Snapshots idle for more than ttl seconds are deleted.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        session_factory: Callable[[Dict[str, Any]], Any],
+        spill_after: float = 300,
+        ttl: Optional[float] = 86400,
+        max_sessions: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+        compression_level: int = 6,
+    ):
+        self.directory = directory
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.compression_level = compression_level
+        os.makedirs(directory, exist_ok=True)
+        self._memory = MemorySessionStore(
+            max_sessions=max_sessions,
+            ttl=spill_after,
+            max_bytes=max_bytes,
+            clock=clock,
+            on_evict=self._spill,
+        )
+        self.spills = 0
+        self.rehydrations = 0
+        self.rehydration_seconds = 0.0
+        self.max_rehydration_seconds = 0.0
+
+    def _snapshot_path(self, session_id: str) -> str:
+        name = hashlib.sha256(session_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{name}.json.z")
+
+    def _spill(self, session_id: str, session: Any):
+        data = json.dumps(session.to_dict(), separators=(",", ":")).encode("utf-8")
+        path = self._snapshot_path(session_id)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(zlib.compress(data, self.compression_level))
+        os.replace(tmp_path, path)
+        self.spills += 1
+
+    def _rehydrate(self, session_id: str) -> Optional[Any]:
+        start = time.perf_counter()
+        path = self._snapshot_path(session_id)
+        try:
+            if self.ttl is not None and time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                data = json.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return None
+        session = self.session_factory(data)
+        os.remove(path)
+        self._memory.save(session_id, session)
+        elapsed = time.perf_counter() - start
+        self.rehydrations += 1
+        self.rehydration_seconds += elapsed
+        self.max_rehydration_seconds = max(self.max_rehydration_seconds, elapsed)
+        return session
+
+    def get(self, session_id: str) -> Optional[Any]:
+        """
+        Returns a session, rehydrating it from its snapshot if it was spilled.
+
+        Args:
+            session_id (str): The session id.
+
+        Returns:
+            Optional[Any]: The session, or None if it is unknown or its snapshot expired.
+        """
+        session = self._memory.get(session_id)
+        if session is None:
+            session = self._rehydrate(session_id)
+        return session
+
+    def save(self, session_id: str, session: Any):
+        self._memory.save(session_id, session)
+
+    def delete(self, session_id: str):
+        self._memory.delete(session_id)
+        try:
+            os.remove(self._snapshot_path(session_id))
+        except FileNotFoundError:
+            pass
+
+    def spill_idle(self):
+        """Spills all sessions idle for longer than spill_after and deletes expired snapshots."""
+        self._memory.expire()
+        if self.ttl is None:
+            return
+        deadline = time.time() - self.ttl
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json.z") and entry.stat().st_mtime < deadline:
+                os.remove(entry.path)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns session metrics.
+
+        Returns:
+            Dict[str, Any]: Resident and spilled sessions, estimated resident memory, snapshot bytes,
+            spills and rehydration latencies.
+        """
+        self.spill_idle()
+        memory_stats = self._memory.stats()
+        snapshots = [
+            entry.stat().st_size
+            for entry in os.scandir(self.directory)
+            if entry.name.endswith(".json.z")
+        ]
+        return {
+            "live_sessions": memory_stats["live_sessions"],
+            "spilled_sessions": len(snapshots),
+            "estimated_bytes": memory_stats["estimated_bytes"],
+            "snapshot_bytes": sum(snapshots),
+            "spills": self.spills,
+            "rehydrations": self.rehydrations,
+            "avg_rehydration_ms": (
+                1000 * self.rehydration_seconds / self.rehydrations
+                if self.rehydrations
+                else 0.0
+            ),
+            "max_rehydration_ms": 1000 * self.max_rehydration_seconds,
+        }
+
+
+_UPSERT_SESSION = (
+    "INSERT INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?) "
+    "ON CONFLICT(session_id) DO UPDATE SET "
+    "data = excluded.data, updated_at = excluded.updated_at"
+)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Session store persisting conversation state in an SQLite database shared by all API workers.
+
+    Sessions are stored as their to_dict() JSON, i.e. the conversation state and a reference to the agent
+    configuration, and restored with session_factory, so any worker can continue any conversation. The
+    database runs in WAL mode, so readers never block the writer, and every load or save is a single
+    indexed statement. Sessions idle for more than ttl seconds are treated as missing and deleted.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        session_factory: Callable[[Dict[str, Any]], Any],
+        ttl: Optional[float] = 3600,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.clock = clock
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=5, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)"
+        )
+        self.loads = 0
+        self.saves = 0
+        self.load_seconds = 0.0
+        self.save_seconds = 0.0
+
+    def _is_expired(self, updated_at: float) -> bool:
+        return self.ttl is not None and self.clock() - updated_at > self.ttl
+
+    def get(self, session_id: str) -> Optional[Any]:
+        """
+        Loads a session.
+
+        Args:
+            session_id (str): The session id.
+
+        Returns:
+            Optional[Any]: The restored session, or None if it is unknown or expired.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data, updated_at FROM sessions WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        if self._is_expired(row[1]):
+            self.delete(session_id)
+            return None
+        session = self.session_factory(json.loads(row[0]))
+        self.loads += 1
+        self.load_seconds += time.perf_counter() - start
+        return session
+
+    def save(self, session_id: str, session: Any):
+        """
+        Saves a session, replacing its previous version.
+
+        Args:
+            session_id (str): The session id.
+            session (Any): The session. It must implement to_dict().
+
+        Returns:
+            None
+        """
+        start = time.perf_counter()
+        data = json.dumps(session.to_dict(), separators=(",", ":"))
+        with self._lock:
+            self._connection.execute(_UPSERT_SESSION, (session_id, data, self.clock()))
+        self.saves += 1
+        self.save_seconds += time.perf_counter() - start
+
+    def update(
+        self, session_id: str, merge: Callable[[Optional[Any]], Optional[Any]]
+    ):
+        """
+        Saves the session merge returns for the currently stored session.
+
+        The load, the merge and the save run in one write transaction, so no other worker can save the
+        session in between.
+
+        Args:
+            session_id (str): The session id.
+            merge (Callable[[Optional[Any]], Optional[Any]]): Takes the stored session, or None, and
+                returns the session to save, or None to save nothing.
+
+        Returns:
+            None
+        """
+        start = time.perf_counter()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._connection.execute(
+                    "SELECT data, updated_at FROM sessions WHERE session_id = ?",
+                    (session_id,),
+                ).fetchone()
+                stored = None
+                if row is not None and not self._is_expired(row[1]):
+                    stored = self.session_factory(json.loads(row[0]))
+                session = merge(stored)
+                if session is not None:
+                    data = json.dumps(session.to_dict(), separators=(",", ":"))
+                    self._connection.execute(
+                        _UPSERT_SESSION, (session_id, data, self.clock())
+                    )
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+        self.saves += 1
+        self.save_seconds += time.perf_counter() - start
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM sessions WHERE session_id = ?", (session_id,)
+            )
+
+    def expire(self) -> int:
+        """
+        Deletes all expired sessions.
+
+        Returns:
+            int: The number of deleted sessions.
+        """
+        if self.ttl is None:
+            return 0
+        with self._lock:
+            cursor = self._connection.execute(
+                "DELETE FROM sessions WHERE updated_at < ?", (self.clock() - self.ttl,)
+            )
+        return cursor.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns session metrics.
+
+        Returns:
+            Dict[str, Any]: Stored sessions, expirations, database size and average load and save times.
+        """
+        expirations = self.expire()
+        with self._lock:
+            (sessions,) = self._connection.execute(
+                "SELECT COUNT(*) FROM sessions"
+            ).fetchone()
+        return {
+            "live_sessions": sessions,
+            "expirations": expirations,
+            "database_bytes": os.path.getsize(self.path),
+            "loads": self.loads,
+            "saves": self.saves,
+            "avg_load_ms": 1000 * self.load_seconds / self.loads if self.loads else 0.0,
+            "avg_save_ms": 1000 * self.save_seconds / self.saves if self.saves else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class SessionBusyError(RuntimeError):
+    """Raised when a session already has the maximum number of pending turns."""
+
+
+class SessionTurnQueue:
+    """
+    Runs the turns of each session one at a time, in arrival order.
+
+    Each session gets an asyncio lock while it has pending turns, and at most max_pending turns may wait
+    for it; more raise SessionBusyError. A request repeating a message that is already pending for the
+    session, e.g. a double submit, does not queue another turn but waits for the result of the pending one.
+    Turns are only serialized within one process.
+    """
+
+    def __init__(self, max_pending: int = 4):
+        self.max_pending = max_pending
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._pending: Dict[str, int] = {}
+        self._in_flight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self.coalesced = 0
+        self.rejected = 0
+
+    async def run(
+        self, session_id: str, message: str, turn: Callable[[], Awaitable[T]]
+    ) -> T:
+        """
+        Runs a turn after all earlier turns of the session have finished.
+
+        Args:
+            session_id (str): The session id.
+            message (str): The human message of the turn, used to detect duplicate requests.
+            turn (Callable[[], Awaitable[T]]): Coroutine function running the turn.
+
+        Returns:
+            T: The result of the turn, or of the pending turn with the same message.
+
+        Raises:
+            SessionBusyError: If the session already has max_pending pending turns.
+        """
+        key = (session_id, message)
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(in_flight)
+        if self._pending.get(session_id, 0) >= self.max_pending:
+            self.rejected += 1
+            raise SessionBusyError(f"Session {session_id} has too many pending turns")
+
+        future = asyncio.get_running_loop().create_future()
+        # nobody may wait for the result, so failures must not be reported as never retrieved
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._in_flight[key] = future
+        self._pending[session_id] = self._pending.get(session_id, 0) + 1
+        lock = self._locks.setdefault(session_id, asyncio.Lock())
+        try:
+            async with lock:
+                result = await turn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._in_flight[key]
+            self._pending[session_id] -= 1
+            if not self._pending[session_id]:
+                del self._pending[session_id]
+                del self._locks[session_id]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending_turns": sum(self._pending.values()),
+            "coalesced_turns": self.coalesced,
+            "rejected_turns": self.rejected,
+        }
+
+
+class _Burst:
+    __slots__ = ("messages", "future", "task", "started")
+
+    def __init__(self, future: asyncio.Future):
+        self.messages: List[str] = []
+        self.future = future
+        self.task: Optional[asyncio.Task] = None
+        self.started = False
+
+
+class MessageCoalescer:
+    """
+    Merges bursts of human messages sent to a session in quick succession into a single agent turn.
+
+    A turn starts once no new message has arrived for window seconds. A message arriving while the turn
+    for the burst is already running cancels that turn and restarts the window, so the agent answers all
+    messages of the burst at once. The turn must leave the session unchanged when cancelled, see
+    SalesGPTAPI.do. Every request of a burst receives the result of the final turn.
+    """
+
+    def __init__(self, window: float = 0.5, separator: str = "\n"):
+        self.window = window
+        self.separator = separator
+        self._bursts: Dict[str, _Burst] = {}
+        self.turns = 0
+        self.merged_messages = 0
+        self.cancelled_turns = 0
+
+    async def submit(
+        self, session_id: str, message: str, turn: Callable[[str], Awaitable[T]]
+    ) -> T:
+        """
+        Adds a message to the session's current burst and waits for the burst's turn.
+
+        Args:
+            session_id (str): The session id.
+            message (str): The human message.
+            turn (Callable[[str], Awaitable[T]]): Coroutine function running a turn for the merged messages.
+
+        Returns:
+            T: The result of the turn that answered this message.
+        """
+        burst = self._bursts.get(session_id)
+        if burst is None:
+            burst = _Burst(asyncio.get_running_loop().create_future())
+            # the burst may fail while nobody waits for it, e.g. after a client disconnect
+            burst.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._bursts[session_id] = burst
+        else:
+            self.merged_messages += 1
+            if burst.started:
+                self.cancelled_turns += 1
+            burst.task.cancel()
+        burst.messages.append(message)
+        burst.started = False
+        burst.task = asyncio.create_task(self._run(session_id, burst, turn))
+        return await asyncio.shield(burst.future)
+
+    async def _run(
+        self, session_id: str, burst: _Burst, turn: Callable[[str], Awaitable[T]]
+    ):
+        await asyncio.sleep(self.window)
+        burst.started = True
+        try:
+            result = await turn(self.separator.join(burst.messages))
+        except asyncio.CancelledError:
+            # superseded by a newer message, whose task takes over the burst
+            raise
+        except Exception as e:
+            self._finish(session_id, burst)
+            burst.future.set_exception(e)
+        else:
+            self._finish(session_id, burst)
+            burst.future.set_result(result)
+
+    def _finish(self, session_id: str, burst: _Burst):
+        self.turns += 1
+        if self._bursts.get(session_id) is burst:
+            del self._bursts[session_id]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "coalescer_turns": self.turns,
+            "merged_messages": self.merged_messages,
+            "cancelled_turns": self.cancelled_turns,
+        }
+
+
+class StageAnalysisTracker:
+    """
+    In-process registry of the sessions whose background stage analysis is still running, by session id.
+
+    Session stores that restore a new object on every get, e.g. SQLiteSessionStore, hand the next turn an
+    object that does not know the stage task of the previous turn. wait makes that turn wait for the task
+    anyway, like the memory store does. Only the tasks of this process are known: a turn that another worker
+    serves continues with the stored stage, and the late decision is merged into the store when it is done.
+    """
+
+    def __init__(self):
+        self._sessions: Dict[str, Any] = {}
+
+    def track(self, session_id: str, session: Any):
+        """
+        Registers a session whose stage task is still running. Finished tasks are forgotten.
+
+        Args:
+            session_id (str): The session id.
+            session (Any): The SalesGPTAPI that started the stage task.
+        """
+        task = session.stage_task
+        if task is None or task.done():
+            return
+        self._sessions[session_id] = session
+        task.add_done_callback(
+            lambda task: self._sessions.get(session_id) is session
+            and self._sessions.pop(session_id)
+        )
+
+    async def wait(self, session_id: str, session: Any):
+        """
+        Waits for the stage task of the previous turn of a session and applies its decision to session.
+
+        Args:
+            session_id (str): The session id.
+            session (Any): The SalesGPTAPI that runs the next turn.
+        """
+        previous = self._sessions.pop(session_id, None)
+        if previous is None or previous is session:
+            return
+        try:
+            await session.await_stage_analysis_of(previous)
+        except asyncio.CancelledError:
+            # the next turn waits instead
+            self.track(session_id, previous)
+            raise
+
+    def stats(self) -> Dict[str, int]:
+        return {"pending_stage_analyses": len(self._sessions)}
+
+
+class ResponseReplayCache:
+    """
+    Makes retried requests idempotent by replaying the response of the first request with the same key.
+
+    Keeps the results of completed requests and the futures of in-flight ones in an LRU cache with an idle
+    TTL, so a retry returns the original response, or waits for it if the original is still running,
+    instead of running the turn again. Failed requests are not cached, so they can be retried.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: Optional[float] = 600):
+        self._entries = LRUTTLCache(max_size=max_size, ttl=ttl)
+        self.replays = 0
+
+    async def run(self, key: Tuple, compute: Callable[[], Awaitable[T]]) -> T:
+        """
+        Returns the response for key, computing it only for the first request.
+
+        Args:
+            key (Tuple): The idempotency key, e.g. (session_id, request_id).
+            compute (Callable[[], Awaitable[T]]): Coroutine function computing the response.
+
+        Returns:
+            T: The response of the first request with this key.
+        """
+        future = self._entries.get(key)
+        if future is not None:
+            self.replays += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._entries[key] = future
+        try:
+            result = await compute()
+        except asyncio.CancelledError:
+            self._entries.pop(key)
+            future.cancel()
+            raise
+        except Exception as e:
+            self._entries.pop(key)
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        return {"replay_entries": len(self._entries), "replayed_requests": self.replays}
@@ -0,0 +1,634 @@
+import json
+import math
+import re
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import litellm
+import numpy as np
+from langchain_community.chat_models.litellm import _create_retry_decorator
+from langchain_core.callbacks import BaseCallbackManager
+from langchain_core.embeddings import Embeddings
+from langchain_core.outputs import LLMResult
+from litellm.utils import UnsupportedParamsError
+
+from salesgpt.chains import StageAnalyzerChain
+from salesgpt.embeddings import HashingEmbeddings
+from salesgpt.prompt_builder import PrecompiledChatPrompt
+from salesgpt.prompts import (
+    STAGE_ANALYZER_HISTORY_PROMPT,
+    STAGE_ANALYZER_INCREMENTAL_HISTORY_PROMPT,
+    STAGE_ANALYZER_SYSTEM_PROMPT,
+)
+from salesgpt.retrievers import WORD_REGEX
+from salesgpt.stages import CONVERSATION_STAGES, STAGE_EXAMPLES, STAGE_KEYWORDS
+from salesgpt.tokens import encode_tokens, encoding_name_for_model
+
+STAGE_CLASSIFIERS = ["chain", "single_token", "local"]
+LOGPROBS_PROVIDERS = ("openai", "azure")
+STAGE_ID_REGEX = re.compile(r"\d+")
+TURN_MARKUP_REGEX = re.compile(r"^[^:\n]{1,40}:\s*|<END_OF_TURN>|<END_OF_CALL>")
+
+
+def format_conversation_stages(conversation_stages: Dict[str, str]) -> str:
+    """
+    Formats the conversation stages as the "<id>: <description>" lines of the stage analyzer prompt.
+
+    Args:
+        conversation_stages (Dict[str, str]): Stage descriptions by stage id.
+
+    Returns:
+        str: One line per stage.
+    """
+    return "\n".join(f"{key}: {value}" for key, value in conversation_stages.items())
+
+
+def parse_stage_id(
+    text: Optional[str], conversation_stages: Dict[str, str]
+) -> Optional[str]:
+    """
+    Extracts a valid stage id from an LLM answer.
+
+    Args:
+        text (Optional[str]): The answer, e.g. "3" or "Stage 3.".
+        conversation_stages (Dict[str, str]): The valid stages.
+
+    Returns:
+        Optional[str]: The first valid stage id in the answer, or None.
+    """
+    for match in STAGE_ID_REGEX.findall(text or ""):
+        if match in conversation_stages:
+            return match
+    return None
+
+
+def model_provider(model_name: str) -> Optional[str]:
+    """
+    Returns the litellm provider of a model.
+
+    Args:
+        model_name (str): The litellm model name, e.g. "gpt-3.5-turbo" or "claude-2".
+
+    Returns:
+        Optional[str]: The provider, e.g. "openai" or "anthropic", or None if litellm does not know it.
+    """
+    try:
+        return litellm.get_llm_provider(model_name)[1]
+    except ValueError:
+        return None
+
+
+def supports_param(model_name: str, **param: Any) -> bool:
+    """
+    Checks whether litellm accepts an OpenAI completion parameter for a model's provider.
+
+    Args:
+        model_name (str): The litellm model name.
+        **param (Any): The parameter and an example value, e.g. logit_bias={0: 100}.
+
+    Returns:
+        bool: False if litellm would raise UnsupportedParamsError or does not know the provider.
+    """
+    provider = model_provider(model_name)
+    if provider is None:
+        return False
+    try:
+        # frequency_penalty defaults to 0 here, which providers without it would reject on its own
+        litellm.get_optional_params(
+            model=model_name,
+            custom_llm_provider=provider,
+            frequency_penalty=None,
+            **param,
+        )
+    except UnsupportedParamsError:
+        return False
+    return True
+
+
+@dataclass
+class StageDecision:
+    """The stage a conversation should move to, with the classifier's confidence."""
+
+    stage_id: str
+    confidence: float
+    classifier: str
+
+
+class StageClassifier(ABC):
+    """
+    Interface of the conversation stage classifiers.
+
+    classify gets the conversation history and the current stage id and returns a StageDecision. In
+    incremental stage analysis the history only holds the turns since the last decision and
+    conversation_summary summarizes the turns before them.
+    aclassify runs classify unless a backend has a native async implementation.
+    """
+
+    name = "base"
+
+    def __init__(self, conversation_stages: Optional[Dict[str, str]] = None):
+        self.conversation_stages = conversation_stages or CONVERSATION_STAGES
+        self.stages_text = format_conversation_stages(self.conversation_stages)
+
+    def _stage_analyzer_inputs(
+        self,
+        conversation_history: List[str],
+        conversation_stage_id: str,
+        conversation_summary: Optional[str] = None,
+    ) -> Dict[str, str]:
+        inputs = {
+            "conversation_history": "\n".join(conversation_history).rstrip("\n"),
+            "conversation_stage_id": conversation_stage_id,
+            "conversation_stages": self.stages_text,
+        }
+        if conversation_summary is not None:
+            inputs["conversation_summary"] = conversation_summary
+        return inputs
+
+    def _decision(
+        self, text: Optional[str], conversation_stage_id: str, confidence: float = 1.0
+    ) -> StageDecision:
+        stage_id = parse_stage_id(text, self.conversation_stages)
+        if stage_id is None:
+            print(f"Invalid stage analyzer output {text!r}, keeping the current stage")
+            return StageDecision(conversation_stage_id, 0.0, self.name)
+        return StageDecision(stage_id, confidence, self.name)
+
+    @abstractmethod
+    def classify(
+        self,
+        conversation_history: List[str],
+        conversation_stage_id: str,
+        conversation_summary: Optional[str] = None,
+    ) -> StageDecision:
+        """Returns the stage the conversation should move to."""
+
+    async def aclassify(
+        self,
+        conversation_history: List[str],
+        conversation_stage_id: str,
+        conversation_summary: Optional[str] = None,
+    ) -> StageDecision:
+        return self.classify(
+            conversation_history, conversation_stage_id, conversation_summary
+        )
+
+
+class ChainStageClassifier(StageClassifier):
+    """Classifies the stage with the StageAnalyzerChain, i.e. a full LLM completion per decision."""
+
+    name = "chain"
+
+    def __init__(self, chain: Any, conversation_stages: Optional[Dict[str, str]] = None):
+        super().__init__(conversation_stages)
+        self.chain = chain
+        self._incremental_chain = None
+
+    def _chain_for(self, conversation_summary: Optional[str]) -> Any:
+        if conversation_summary is None:
+            return self.chain
+        if self._incremental_chain is None:
+            chain = StageAnalyzerChain.from_llm(
+                self.chain.llm, verbose=self.chain.verbose, incremental=True
+            )
+            chain.prompt = PrecompiledChatPrompt.from_chat_prompt(
+                chain.prompt, {"conversation_stages": self.stages_text}
+            )
+            self._incremental_chain = chain
+        return self._incremental_chain
+
+    def classify(
+        self,
+        conversation_history: List[str],
+        conversation_stage_id: str,
+        conversation_summary: Optional[str] = None,
+    ) -> StageDecision:
+        output = self._chain_for(conversation_summary).invoke(
+            input=self._stage_analyzer_inputs(
+                conversation_history, conversation_stage_id, conversation_summary
+            ),
+            return_only_outputs=False,
+        )
+        print("Stage analyzer output")
+        print(output)
+        return self._decision(output.get("text"), conversation_stage_id)
+
+    async def aclassify(
+        self,
+        conversation_history: List[str],
+        conversation_stage_id: str,
+        conversation_summary: Optional[str] = None,
+    ) -> StageDecision:
+        output = await self._chain_for(conversation_summary).ainvoke(
+            input=self._stage_analyzer_inputs(
+                conversation_history, conversation_stage_id, conversation_summary
+            ),
+            return_only_outputs=False,
+        )
+        print("Stage analyzer output")
+        print(output)
+        return self._decision(output.get("text"), conversation_stage_id)
+
+
+class SingleTokenStageClassifier(StageClassifier):
+    """
+    Classifies the stage with an LLM call that can only answer with one stage id token.
+
+    The stage analyzer prompt is sent with max_tokens=1 and a logit bias that restricts the answer to the
+    token ids of the valid stage ids, so the call returns after a single output token and can never answer
+    with anything but a stage. With logprobs enabled, the probability of that token is the confidence.
+    Stage ids must each encode to a single token. The logit bias is only sent to providers litellm accepts
+    it for and logprobs only to OpenAI and Azure. Other providers, e.g. Anthropic or Bedrock, get
+    max_tokens=1 and their answer is parsed like the chain classifier's, with confidence 1.
+    """
+
+    name = "single_token"
+
+    def __init__(
+        self,
+        llm: Any,
+        conversation_stages: Optional[Dict[str, str]] = None,
+        encoding_name: Optional[str] = None,
+        logprobs: bool = True,
+        completion: Optional[Callable[..., Any]] = None,
+        acompletion: Optional[Callable[..., Any]] = None,
+    ):
+        super().__init__(conversation_stages)
+        self.model_name = llm.model
+        # litellm passes logprobs through to the provider unchecked, only the OpenAI APIs accept it
+        self.logprobs = logprobs and model_provider(self.model_name) in LOGPROBS_PROVIDERS
+        self.completion = completion or llm.client.completion
+        self.acompletion = acompletion or llm.client.acompletion
+        # both paths retry like ChatLiteLLM and report their usage to the llm's callbacks
+        self.retry = _create_retry_decorator(llm)
+        callbacks = llm.callbacks
+        if isinstance(callbacks, BaseCallbackManager):
+            callbacks = callbacks.handlers
+        self.callbacks = list(callbacks or [])
+        # rendered once, so every request starts with the same cacheable system message
+        self.system_prompt = STAGE_ANALYZER_SYSTEM_PROMPT.format(
+            conversation_stages=self.stages_text
+        )
+        self.logit_bias = None
+        if supports_param(self.model_name, logit_bias={0: 100}):
+            self.logit_bias = self._build_logit_bias(
+                encoding_name or encoding_name_for_model(self.model_name)
+            )
+
+    def _build_logit_bias(self, encoding_name: str) -> Optional[Dict[int, int]]:
+        logit_bias = {}
+        for stage_id in self.conversation_stages:
+            token_ids = encode_tokens(stage_id, encoding_name)
+            if token_ids is None:
+                print("No tokenizer available, stage answers are not constrained")
+                return None
+            if len(token_ids) != 1:
+                raise ValueError(
+                    f"Stage id {stage_id!r} is not a single {encoding_name} token, "
+                    "use the chain stage classifier for these stages"
+                )
+            logit_bias[token_ids[0]] = 100
+        return logit_bias
+
+    def _request(
+        self,
+        conversation_history: List[str],
+        conversation_stage_id: str,
+        conversation_summary: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        history_template = (
+            STAGE_ANALYZER_HISTORY_PROMPT
+            if conversation_summary is None
+            else STAGE_ANALYZER_INCREMENTAL_HISTORY_PROMPT
+        )
+        inputs = self._stage_analyzer_inputs(
+            conversation_history, conversation_stage_id, conversation_summary
+        )
+        request = {
+            "model": self.model_name,
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": history_template.format(**inputs)},
+            ],
+            "max_tokens": 1,
+            "temperature": 0,
+        }
+        if self.logit_bias:
+            request["logit_bias"] = self.logit_bias
+        if self.logprobs:
+            request["logprobs"] = True
+        return request
+
+    def _report_usage(self, response: Any):
+        # the completion is called directly, so the llm's callbacks only see the usage this way
+        result = LLMResult(
+            generations=[],
+            llm_output={"token_usage": _get(response, "usage"), "model_name": self.model_name},
+        )
+        for handler in self.callbacks:
+            handler.on_llm_end(result)
+
+    def _parse(self, response: Any, conversation_stage_id: str) -> StageDecision:
+        choice = _get(response, "choices")[0]
+        text = _get(_get(choice, "message"), "content")
+        confidence = 1.0
+        logprobs = _get(choice, "logprobs")
+        content = _get(logprobs, "content") if logprobs is not None else None
+        if content:
+            confidence = math.exp(_get(content[0], "logprob"))
+        return self._decision(text, conversation_stage_id, confidence)
+
+    def classify(
+        self,
+        conversation_history: List[str],
+        conversation_stage_id: str,
+        conversation_summary: Optional[str] = None,
+    ) -> StageDecision:
+        response = self.retry(self.completion)(
+            **self._request(
+                conversation_history, conversation_stage_id, conversation_summary
+            )
+        )
+        self._report_usage(response)
+        return self._parse(response, conversation_stage_id)
+
+    async def aclassify(
+        self,
+        conversation_history: List[str],
+        conversation_stage_id: str,
+        conversation_summary: Optional[str] = None,
+    ) -> StageDecision:
+        response = await self.retry(self.acompletion)(
+            **self._request(
+                conversation_history, conversation_stage_id, conversation_summary
+            )
+        )
+        self._report_usage(response)
+        return self._parse(response, conversation_stage_id)
+
+
+def _get(obj: Any, key: str) -> Any:
+    # litellm responses are objects, cached or mocked responses are often plain dicts
+    if isinstance(obj, dict):
+        return obj.get(key)
+    return getattr(obj, key, None)
+
+
+class LocalStageClassifier(StageClassifier):
+    """
+    Classifies the stage in-process from labeled example turns, escalating to an LLM when unsure.
+
+    The latest turns are embedded and compared with the embedded example turns. Of the k most similar
+    examples, those with a cosine similarity of at least min_similarity vote for their stage with that
+    similarity, stage keywords found in the latest turns add keyword_weight each, and staying in the current
+    stage gets a stay_weight bonus. The confidence is the winning stage's share of all votes plus smoothing,
+    so a single weak match is never confident. Below confidence_threshold the decision is handed to the
+    fallback classifier, so the LLM is only called for the turns that are actually ambiguous.
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        examples: Sequence[Tuple[str, str]] = STAGE_EXAMPLES,
+        keywords: Optional[Dict[str, List[str]]] = STAGE_KEYWORDS,
+        embeddings: Optional[Embeddings] = None,
+        fallback: Optional[StageClassifier] = None,
+        conversation_stages: Optional[Dict[str, str]] = None,
+        k: int = 5,
+        confidence_threshold: float = 0.5,
+        min_similarity: float = 0.45,
+        keyword_weight: float = 0.5,
+        stay_weight: float = 0.1,
+        smoothing: float = 0.5,
+        context_turns: int = 1,
+    ):
+        super().__init__(conversation_stages)
+        examples = [
+            (text, stage_id)
+            for text, stage_id in examples
+            if stage_id in self.conversation_stages
+        ]
+        if not examples:
+            raise ValueError("The local stage classifier needs labeled example turns")
+        self.embeddings = embeddings or HashingEmbeddings()
+        self.fallback = fallback
+        self.k = k
+        self.confidence_threshold = confidence_threshold
+        self.min_similarity = min_similarity
+        self.keyword_weight = keyword_weight
+        self.stay_weight = stay_weight
+        self.smoothing = smoothing
+        self.context_turns = context_turns
+        self.keywords = {
+            stage_id: [" ".join(WORD_REGEX.findall(word.lower())) for word in words]
+            for stage_id, words in (keywords or {}).items()
+            if stage_id in self.conversation_stages
+        }
+        self.example_stages = [stage_id for _, stage_id in examples]
+        self.example_matrix = _normalize_rows(
+            np.asarray(
+                self.embeddings.embed_documents([text for text, _ in examples]),
+                dtype=np.float32,
+            )
+        )
+        self.local_decisions = 0
+        self.escalations = 0
+
+    def _context(self, conversation_history: List[str]) -> str:
+        turns = conversation_history[-self.context_turns :]
+        return " ".join(TURN_MARKUP_REGEX.sub(" ", turn).strip() for turn in turns)
+
+    def predict(
+        self,
+        conversation_history: List[str],
+        conversation_stage_id: str,
+        conversation_summary: Optional[str] = None,
+    ) -> StageDecision:
+        """
+        Classifies the stage locally, without escalating.
+
+        Args:
+            conversation_history (List[str]): The conversation so far, or the turns since the last decision.
+            conversation_stage_id (str): The current stage id.
+            conversation_summary (Optional[str]): Summary of the earlier turns in incremental stage analysis.
+
+        Returns:
+            StageDecision: The most likely stage and its share of the votes.
+        """
+        if not conversation_history:
+            # nothing new since the last decision, or no conversation yet
+            stage_id = "1" if conversation_summary is None else conversation_stage_id
+            return StageDecision(stage_id, 1.0, self.name)
+        context = self._context(conversation_history)
+        query = _normalize_rows(
+            np.asarray([self.embeddings.embed_query(context)], dtype=np.float32)
+        )[0]
+        similarities = self.example_matrix @ query
+        k = min(self.k, len(similarities))
+        nearest = np.argpartition(-similarities, k - 1)[:k]
+
+        votes: Dict[str, float] = defaultdict(float)
+        for i in nearest:
+            if similarities[i] >= self.min_similarity:
+                votes[self.example_stages[i]] += float(similarities[i])
+        padded = f" {' '.join(WORD_REGEX.findall(context.lower()))} "
+        for stage_id, words in self.keywords.items():
+            for word in words:
+                if f" {word} " in padded:
+                    votes[stage_id] += self.keyword_weight
+        total = sum(votes.values())
+        if total == 0:
+            return StageDecision(conversation_stage_id, 0.0, self.name)
+        votes[conversation_stage_id] += self.stay_weight
+        total += self.stay_weight + self.smoothing
+        stage_id = max(votes, key=votes.get)
+        return StageDecision(stage_id, votes[stage_id] / total, self.name)
+
+    def classify(
+        self,
+        conversation_history: List[str],
+        conversation_stage_id: str,
+        conversation_summary: Optional[str] = None,
+    ) -> StageDecision:
+        decision = self.predict(
+            conversation_history, conversation_stage_id, conversation_summary
+        )
+        if self.fallback is None or decision.confidence >= self.confidence_threshold:
+            self.local_decisions += 1
+            return decision
+        self.escalations += 1
+        return self.fallback.classify(
+            conversation_history, conversation_stage_id, conversation_summary
+        )
+
+    async def aclassify(
+        self,
+        conversation_history: List[str],
+        conversation_stage_id: str,
+        conversation_summary: Optional[str] = None,
+    ) -> StageDecision:
+        decision = self.predict(
+            conversation_history, conversation_stage_id, conversation_summary
+        )
+        if self.fallback is None or decision.confidence >= self.confidence_threshold:
+            self.local_decisions += 1
+            return decision
+        self.escalations += 1
+        return await self.fallback.aclassify(
+            conversation_history, conversation_stage_id, conversation_summary
+        )
+
+    def stats(self) -> Dict[str, int]:
+        return {"local_decisions": self.local_decisions, "escalations": self.escalations}
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1.0)
+
+
+def record_stage_turns(
+    stage_path: List[List[Any]], stage_id: str, turns: int, max_segments: int = 8
+) -> List[List[Any]]:
+    """
+    Adds turns spent in a stage to a conversation's stage path.
+
+    The stage path is a list of [stage id, number of turns] segments, merged when the stage did not change
+    and capped to the last max_segments segments, so it stays small however long the conversation runs.
+
+    Args:
+        stage_path (List[List[Any]]): The stage path, updated in place.
+        stage_id (str): The stage the turns were spent in.
+        turns (int): Number of turns.
+        max_segments (int): Maximum number of segments kept.
+
+    Returns:
+        List[List[Any]]: The updated stage path.
+    """
+    if turns <= 0:
+        return stage_path
+    if stage_path and stage_path[-1][0] == stage_id:
+        stage_path[-1][1] += turns
+    else:
+        stage_path.append([stage_id, turns])
+    del stage_path[:-max_segments]
+    return stage_path
+
+
+def summarize_stage_path(
+    stage_path: List[List[Any]],
+    analyzed_turns: int,
+    conversation_stages: Optional[Dict[str, str]] = None,
+) -> str:
+    """
+    Renders the compact conversation summary used by incremental stage analysis.
+
+    Args:
+        stage_path (List[List[Any]]): The [stage id, number of turns] segments of the conversation.
+        analyzed_turns (int): Number of turns covered by the summary.
+        conversation_stages (Optional[Dict[str, str]]): Stage descriptions by stage id.
+
+    Returns:
+        str: The summary, of bounded length.
+    """
+    if not analyzed_turns:
+        return "The conversation has just started."
+    conversation_stages = conversation_stages or CONVERSATION_STAGES
+    segments = ", ".join(
+        f"{stage_id} {conversation_stages.get(stage_id, '').split(':')[0]} ({turns} turns)"
+        for stage_id, turns in stage_path
+    )
+    return f"{analyzed_turns} turns so far. Stages, most recent last: {segments}."
+
+
+def build_stage_classifier(
+    stage_classifier: str,
+    llm: Any,
+    stage_analyzer_chain: Any,
+    conversation_stages: Optional[Dict[str, str]] = None,
+    fallback: str = "single_token",
+    examples_path: Optional[str] = None,
+    **kwargs: Any,
+) -> StageClassifier:
+    """
+    Builds a stage classifier from its agent config.
+
+    Args:
+        stage_classifier (str): "chain", "single_token" or "local".
+        llm (Any): The agent's ChatLiteLLM.
+        stage_analyzer_chain (Any): The agent's StageAnalyzerChain.
+        conversation_stages (Optional[Dict[str, str]]): Stage descriptions by stage id.
+        fallback (str): For "local", the classifier to escalate to: "chain", "single_token" or "none".
+        examples_path (Optional[str]): For "local", a JSON file of [turn, stage id] pairs used instead of
+            STAGE_EXAMPLES.
+        **kwargs: Further options of the chosen classifier, e.g. confidence_threshold or k.
+
+    Returns:
+        StageClassifier: The classifier.
+    """
+    if stage_classifier not in STAGE_CLASSIFIERS:
+        raise ValueError(
+            f"stage_classifier must be one of {STAGE_CLASSIFIERS}, got {stage_classifier!r}"
+        )
+    if stage_classifier == "chain":
+        return ChainStageClassifier(stage_analyzer_chain, conversation_stages)
+    if stage_classifier == "single_token":
+        return SingleTokenStageClassifier(llm, conversation_stages, **kwargs)
+
+    if fallback not in STAGE_CLASSIFIERS[:2] + ["none"]:
+        raise ValueError(f"Invalid local stage classifier fallback {fallback!r}")
+    if examples_path:
+        with open(examples_path, "r") as f:
+            kwargs["examples"] = [tuple(example) for example in json.load(f)]
+    return LocalStageClassifier(
+        fallback=None
+        if fallback == "none"
+        else build_stage_classifier(
+            fallback, llm, stage_analyzer_chain, conversation_stages
+        ),
+        conversation_stages=conversation_stages,
+        **kwargs,
+    )
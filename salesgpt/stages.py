@@ -11,3 +11,44 @@ CONVERSATION_STAGES = {
     "7": "Close: Ask for the sale by proposing a next step. This could be a demo, a trial or a meeting with decision-makers. Ensure to summarize what has been discussed and reiterate the benefits.",
     "8": "End conversation: It's time to end the call as there is nothing else to be said.",
 }
+
+# Labeled example turns for the local stage classifier, as (turn, stage id) pairs.
+# Add turns from your own conversations to make local classification more accurate.
+STAGE_EXAMPLES = [
+    ("Hello, who is this?", "1"),
+    ("Hi, how are you? Who am I speaking with?", "1"),
+    ("Good morning, what is this call about?", "1"),
+    ("Yes, I handle the purchasing for our household.", "2"),
+    ("I am the one who decides what we buy for the house.", "2"),
+    ("You should talk to my wife, she makes those decisions.", "2"),
+    ("What makes your mattresses different from the others?", "3"),
+    ("Why should I choose your company?", "3"),
+    ("What are the benefits of your products?", "3"),
+    ("I have been sleeping badly and wake up with back pain.", "4"),
+    ("My current mattress is too soft and I get hot at night.", "4"),
+    ("I usually sleep about six hours but I would like eight.", "4"),
+    ("Which mattress would you recommend for me?", "5"),
+    ("Do you have something that helps with back pain?", "5"),
+    ("Tell me more about the mattress you mentioned.", "5"),
+    ("That sounds too expensive for me.", "6"),
+    ("I am not sure it is worth the price.", "6"),
+    ("I already have a mattress that works fine.", "6"),
+    ("Okay, how do I order one?", "7"),
+    ("Can we schedule a trial or a demo?", "7"),
+    ("Sounds good, send me the payment link.", "7"),
+    ("I am not interested, thanks.", "8"),
+    ("I have to go now, goodbye.", "8"),
+    ("Please do not call me again.", "8"),
+]
+
+# Words and phrases that point to a conversation stage when the prospect uses them.
+STAGE_KEYWORDS = {
+    "1": ["hello", "who is this", "who am i speaking"],
+    "2": ["decide", "decides", "decision", "in charge"],
+    "3": ["different", "benefits", "why should"],
+    "4": ["pain", "problem", "sleeping badly", "wake up"],
+    "5": ["recommend", "suggest", "tell me more"],
+    "6": ["expensive", "worth", "not sure", "already have"],
+    "7": ["order", "purchase", "trial", "demo", "payment", "schedule"],
+    "8": ["goodbye", "not interested", "have to go", "do not call"],
+}
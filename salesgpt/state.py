@@ -0,0 +1,210 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+from salesgpt.stages import CONVERSATION_STAGES
+
+
+class ConversationState:
+    """
+    Per-session state of a sales conversation.
+
+    This is everything that changes while a conversation runs. Everything else, i.e. the LLM, the chains,
+    the tools and the persona, lives in a SalesGPT engine that is shared by all sessions with the same
+    configuration.
+    """
+
+    # the persisted fields, see to_dict
+    FIELDS = (
+        "conversation_history",
+        "conversation_stage_id",
+        "current_conversation_stage",
+        "current_turn",
+        "stage_analyzed_turns",
+        "stage_path",
+        "conversation_summary",
+        "summarized_turns",
+    )
+    __slots__ = FIELDS + ("rendered_history",)
+
+    def __init__(
+        self,
+        conversation_history: Optional[List[str]] = None,
+        conversation_stage_id: str = "1",
+        current_conversation_stage: Optional[str] = None,
+        current_turn: int = 0,
+        stage_analyzed_turns: int = 0,
+        stage_path: Optional[List[List[Any]]] = None,
+        conversation_summary: str = "",
+        summarized_turns: int = 0,
+    ):
+        self.conversation_history = (
+            conversation_history if conversation_history is not None else []
+        )
+        self.conversation_stage_id = conversation_stage_id
+        self.current_conversation_stage = (
+            current_conversation_stage
+            if current_conversation_stage is not None
+            else CONVERSATION_STAGES.get(conversation_stage_id)
+        )
+        self.current_turn = current_turn
+        # how many turns stage analysis has seen, and the stages they were spent in
+        self.stage_analyzed_turns = stage_analyzed_turns
+        self.stage_path = stage_path if stage_path is not None else []
+        # running summary of the first summarized_turns turns of the history
+        self.conversation_summary = conversation_summary
+        self.summarized_turns = summarized_turns
+        # the history text rendered for the previous turn, see render_history
+        self.rendered_history: Optional[Tuple] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the state as a JSON serializable dictionary.
+
+        Returns:
+            Dict[str, Any]: The state fields.
+        """
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ConversationState":
+        """
+        Restores a state from a dictionary created by to_dict.
+
+        Args:
+            data (Dict[str, Any]): The state fields.
+
+        Returns:
+            ConversationState: The restored state.
+        """
+        return cls(**{field: data[field] for field in cls.FIELDS if field in data})
+
+    def merge_analysis(self, other: "ConversationState"):
+        """
+        Takes over the stage decision and the summary of another version of this conversation if they
+        cover more turns.
+
+        Nothing is taken if the history of other is not a prefix of this history, as its results then
+        describe a different conversation.
+
+        Args:
+            other (ConversationState): The other version, e.g. the one a background task updated.
+
+        Returns:
+            None
+        """
+        analyzed = other.conversation_history
+        if self.conversation_history[: len(analyzed)] != analyzed:
+            return
+        if other.stage_analyzed_turns > self.stage_analyzed_turns:
+            self.conversation_stage_id = other.conversation_stage_id
+            self.current_conversation_stage = other.current_conversation_stage
+            self.stage_analyzed_turns = other.stage_analyzed_turns
+            self.stage_path = list(other.stage_path)
+        if other.summarized_turns > self.summarized_turns:
+            self.conversation_summary = other.conversation_summary
+            self.summarized_turns = other.summarized_turns
+
+    def __repr__(self) -> str:
+        return (
+            f"ConversationState(turns={len(self.conversation_history)}, "
+            f"conversation_stage_id={self.conversation_stage_id!r}, "
+            f"current_turn={self.current_turn})"
+        )
+
+
+class SalesGPTSession:
+    """
+    A conversation held by a shared SalesGPT engine.
+
+    Exposes the SalesGPT conversation methods and attributes for one ConversationState, so a session can be
+    used wherever a SalesGPT agent was used. Engine attributes such as use_tools or salesperson_name are
+    read from the engine.
+    """
+
+    __slots__ = ("engine", "state", "summary_task")
+
+    def __init__(self, engine: Any, state: Optional[ConversationState] = None):
+        self.engine = engine
+        self.state = state if state is not None else ConversationState()
+        self.summary_task: Optional[asyncio.Task] = None
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.engine, name)
+
+    @property
+    def conversation_history(self) -> List[str]:
+        return self.state.conversation_history
+
+    @conversation_history.setter
+    def conversation_history(self, conversation_history: List[str]):
+        self.state.conversation_history = conversation_history
+        self.state.rendered_history = None
+
+    @property
+    def conversation_stage_id(self) -> str:
+        return self.state.conversation_stage_id
+
+    @property
+    def current_conversation_stage(self) -> str:
+        return self.state.current_conversation_stage
+
+    @property
+    def current_turn(self) -> int:
+        return self.state.current_turn
+
+    @property
+    def stage_analyzed_turns(self) -> int:
+        return self.state.stage_analyzed_turns
+
+    @property
+    def stage_path(self) -> List[List[Any]]:
+        return self.state.stage_path
+
+    @property
+    def conversation_summary(self) -> str:
+        return self.state.conversation_summary
+
+    @property
+    def summarized_turns(self) -> int:
+        return self.state.summarized_turns
+
+    def seed_agent(self):
+        return self.engine.seed_agent(state=self.state)
+
+    def human_step(self, human_input: str):
+        return self.engine.human_step(human_input, state=self.state)
+
+    def determine_conversation_stage(self):
+        return self.engine.determine_conversation_stage(state=self.state)
+
+    async def adetermine_conversation_stage(self):
+        return await self.engine.adetermine_conversation_stage(state=self.state)
+
+    def step(self, stream: bool = False):
+        return self.engine.step(stream=stream, state=self.state)
+
+    async def astep(self, stream: bool = False):
+        return await self.engine.astep(stream=stream, state=self.state)
+
+    def summarize_conversation(self):
+        return self.engine.summarize_conversation(state=self.state)
+
+    async def asummarize_conversation(self):
+        return await self.engine.asummarize_conversation(state=self.state)
+
+    def schedule_summary(self) -> Optional[asyncio.Task]:
+        """
+        Starts summarizing older turns in the background if the history has grown past the engine's threshold.
+
+        At most one summary runs per session at a time. The turn that schedules it does not wait for it,
+        later turns use the new summary once it is ready.
+
+        Returns:
+            Optional[asyncio.Task]: The started summary task, or None if none was needed.
+        """
+        if self.summary_task is not None and not self.summary_task.done():
+            return None
+        if not self.engine.needs_summary(state=self.state):
+            return None
+        self.summary_task = asyncio.create_task(self.asummarize_conversation())
+        return self.summary_task
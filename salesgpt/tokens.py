@@ -0,0 +1,71 @@
+from functools import lru_cache
+from typing import List, Optional
+
+import tiktoken
+from tiktoken.model import encoding_name_for_model as _tiktoken_encoding_name
+
+# rough average for English text, used when no tokenizer can be loaded
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(encoding_name: str):
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        # tiktoken downloads its vocabularies on first use, which fails in air-gapped deployments
+        print(f"Could not load tiktoken encoding {encoding_name}, approximating: {e}")
+        return None
+
+
+def count_tokens(text: str, encoding_name: str = "cl100k_base") -> int:
+    """
+    Counts the tokens in a text.
+
+    Uses the tiktoken encoding if it can be loaded and falls back to a character based estimate otherwise.
+
+    Args:
+        text (str): The text to count tokens of.
+        encoding_name (str): Name of the tiktoken encoding.
+
+    Returns:
+        int: The number of tokens.
+    """
+    encoding = _get_encoding(encoding_name)
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def encoding_name_for_model(model_name: str, default: str = "cl100k_base") -> str:
+    """
+    Returns the name of the tiktoken encoding a model uses.
+
+    Args:
+        model_name (str): The model name, optionally with a provider prefix such as "openai/".
+        default (str): Returned for models tiktoken does not know.
+
+    Returns:
+        str: The encoding name.
+    """
+    try:
+        return _tiktoken_encoding_name(model_name.split("/")[-1])
+    except KeyError:
+        return default
+
+
+def encode_tokens(text: str, encoding_name: str = "cl100k_base") -> Optional[List[int]]:
+    """
+    Encodes a text into token ids.
+
+    Args:
+        text (str): The text to encode.
+        encoding_name (str): Name of the tiktoken encoding.
+
+    Returns:
+        Optional[List[int]]: The token ids, or None if the encoding cannot be loaded.
+    """
+    encoding = _get_encoding(encoding_name)
+    if encoding is None:
+        return None
+    return encoding.encode(text, disallowed_special=())
@@ -1,5 +1,8 @@
+import dataclasses
+import hashlib
 import json
 import os
+from typing import Dict, Tuple
 
 import boto3
 import requests
@@ -8,35 +11,221 @@ from langchain.chains import RetrievalQA
 from langchain.text_splitter import CharacterTextSplitter
 from langchain_community.chat_models import BedrockChat
 from langchain_community.vectorstores import Chroma
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_openai import ChatOpenAI
 from litellm import completion
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
+from salesgpt.cache import CachedKnowledgeBase, SemanticAnswerCache
+from salesgpt.catalog import (
+    ProductIndex,
+    StructuredProductSearch,
+    parse_product_catalog,
+)
+from salesgpt.embeddings import HashingEmbeddings, build_embeddings
+from salesgpt.ingestion import (
+    ChromaCatalogWriter,
+    ingest_catalog,
+    iter_catalog_chunks,
+)
+from salesgpt.knowledge_base import (
+    KNOWLEDGE_BASE_REGISTRY,
+    KnowledgeBaseConfig,
+    catalog_hash,
+    index_catalog_texts,
+)
+from salesgpt.prefetch import PrefetchingRetriever
+from salesgpt.retrievers import (
+    BM25Retriever,
+    DirectRetrievalKnowledgeBase,
+    HybridRetriever,
+)
+from salesgpt.vector_index import MemmapRetriever, MemmapVectorIndex
+
+
 def setup_knowledge_base(
-    product_catalog: str = None, model_name: str = "gpt-3.5-turbo"
+    product_catalog: str = None, model_name: str = "gpt-3.5-turbo", **options
 ):
     """
-    We assume that the product catalog is simply a text string.
-    """
-    # load product catalog
-    with open(product_catalog, "r") as f:
-        product_catalog = f.read()
+    Returns the shared knowledge base of a product catalog, building it on first use.
 
-    text_splitter = CharacterTextSplitter(chunk_size=5000, chunk_overlap=200)
-    texts = text_splitter.split_text(product_catalog)
+    Args:
+        product_catalog (str): The catalog file, or a directory of them with streaming_ingestion.
+        model_name (str): Unused, kept for compatibility.
+        **options: The KnowledgeBaseConfig fields.
 
-    llm = ChatOpenAI(model_name="gpt-4-0125-preview", temperature=0)
+    Returns:
+        Any: The knowledge base, which answers product questions with run and arun.
+    """
+    config = KnowledgeBaseConfig(**options)
+    if os.path.isdir(product_catalog) and not config.streaming_ingestion:
+        raise ValueError("A product catalog directory requires streaming_ingestion")
+    if config.embedding_backend == "local":
+        # names the index files, registry entries and caches of the local vectors
+        config = dataclasses.replace(
+            config, embedding_model=HashingEmbeddings().model_name
+        )
 
-    embeddings = OpenAIEmbeddings()
-    docsearch = Chroma.from_texts(
-        texts, embeddings, collection_name="product-knowledge-base"
+    key = catalog_hash(product_catalog)
+    # names the in-memory Chroma collection, one per registry entry
+    build_hash = hashlib.sha256(
+        json.dumps([key, dataclasses.asdict(config)], sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    return KNOWLEDGE_BASE_REGISTRY.get_or_build(
+        key,
+        config.embedding_model,
+        lambda: _build_knowledge_base(product_catalog, key, config, build_hash),
+        options=config,
     )
 
-    knowledge_base = RetrievalQA.from_chain_type(
-        llm=llm, chain_type="stuff", retriever=docsearch.as_retriever()
-    )
+
+# answer caches outlive the knowledge bases of older catalog versions,
+# keyed by catalog path and config
+ANSWER_CACHES: Dict[Tuple[str, KnowledgeBaseConfig], SemanticAnswerCache] = {}
+
+
+def _build_knowledge_base(
+    product_catalog: str,
+    product_catalog_hash: str,
+    config: KnowledgeBaseConfig,
+    build_hash: str = None,
+):
+    catalog_path = os.path.abspath(product_catalog)
+    if config.persist_directory:
+        embeddings = build_embeddings(
+            config.embedding_model,
+            cache_dir=os.path.join(config.persist_directory, "embedding_cache"),
+            embedding_backend=config.embedding_backend,
+        )
+    else:
+        embeddings = build_embeddings(
+            config.embedding_model, embedding_backend=config.embedding_backend
+        )
+
+    if not config.streaming_ingestion:
+        # load product catalog
+        with open(product_catalog, "r") as f:
+            product_catalog = f.read()
+
+        text_splitter = CharacterTextSplitter(
+            chunk_size=config.chunk_size, chunk_overlap=config.chunk_overlap
+        )
+        texts = text_splitter.split_text(product_catalog)
+
+    if config.streaming_ingestion:
+        # chunk ids are content based, so a catalog version gets its own collection
+        collection_name = (
+            f"product-knowledge-base-{product_catalog_hash[:16]}"
+            f"-{config.chunk_size}-{config.chunk_overlap}"
+        )
+        if config.embedding_backend != "openai":
+            collection_name = f"{collection_name}-{config.embedding_backend}"
+        docsearch = Chroma(
+            collection_name=collection_name,
+            embedding_function=embeddings,
+            persist_directory=(
+                os.path.join(config.persist_directory, "chroma")
+                if config.persist_directory
+                else None
+            ),
+        )
+        ingest_catalog(
+            iter_catalog_chunks(catalog_path, config.chunk_size, config.chunk_overlap),
+            embeddings,
+            ChromaCatalogWriter(docsearch),
+            batch_size=config.ingestion_batch_size,
+            max_concurrency=config.ingestion_concurrency,
+        )
+        retriever = docsearch.as_retriever(search_kwargs={"k": config.top_k})
+    elif config.vector_store == "memmap":
+        # the index is immutable, a changed catalog or chunking gets a new index directory
+        index = MemmapVectorIndex.load_or_build(
+            os.path.join(
+                config.persist_directory,
+                f"memmap-{config.embedding_model}-{config.chunk_size}"
+                f"-{config.chunk_overlap}-{product_catalog_hash[:16]}",
+            ),
+            texts,
+            embeddings,
+            metadatas=[{"source": catalog_path} for _ in texts],
+        )
+        retriever = MemmapRetriever(index=index, embeddings=embeddings, k=config.top_k)
+    elif config.persist_directory:
+        # one stable collection per catalog file so edits are indexed incrementally
+        path_hash = hashlib.sha256(catalog_path.encode("utf-8")).hexdigest()
+        collection_name = f"product-knowledge-base-{path_hash[:16]}"
+        if config.embedding_backend != "openai":
+            # vectors of different backends must not share a collection
+            collection_name = f"{collection_name}-{config.embedding_backend}"
+        docsearch = index_catalog_texts(
+            texts,
+            embeddings,
+            config.persist_directory,
+            collection_name=collection_name,
+            source=catalog_path,
+        )
+        retriever = docsearch.as_retriever(search_kwargs={"k": config.top_k})
+    else:
+        # in-memory collections live as long as the process, so builds with other options must not
+        # share one, and fixed ids make a rebuild with the same options replace the chunks
+        collection_name = f"product-knowledge-base-{(build_hash or product_catalog_hash)[:16]}"
+        docsearch = Chroma.from_texts(
+            texts,
+            embeddings,
+            ids=[str(i) for i in range(len(texts))],
+            collection_name=collection_name,
+        )
+        retriever = docsearch.as_retriever(search_kwargs={"k": config.top_k})
+
+    if config.hybrid_search:
+        lexical_retriever = BM25Retriever.from_texts(
+            texts, metadatas=[{"source": catalog_path} for _ in texts], k=config.top_k
+        )
+        retriever = HybridRetriever(
+            retrievers=[retriever, lexical_retriever],
+            weights=[1 - config.lexical_weight, config.lexical_weight],
+            k=config.top_k,
+        )
+
+    product_index = None
+    if config.structured_lookup or config.prefetch:
+        product_index = ProductIndex(parse_product_catalog(product_catalog))
+        print(f"Structured product index: {product_index.stats()}")
+
+    if config.prefetch:
+        retriever = PrefetchingRetriever(retriever=retriever, product_index=product_index)
+
+    if config.retrieval_mode == "direct":
+        knowledge_base = DirectRetrievalKnowledgeBase(
+            retriever,
+            max_tokens=config.max_context_tokens,
+            compress=config.compress_passages,
+        )
+    else:
+        llm = ChatOpenAI(model_name=config.qa_model_name, temperature=0)
+        knowledge_base = RetrievalQA.from_chain_type(
+            llm=llm, chain_type="stuff", retriever=retriever
+        )
+
+    if config.answer_cache:
+        answer_cache_key = (catalog_path, config)
+        cache = ANSWER_CACHES.get(answer_cache_key)
+        if cache is None:
+            cache = SemanticAnswerCache(
+                embeddings,
+                max_size=config.answer_cache_size,
+                ttl=config.answer_cache_ttl,
+                similarity_threshold=config.answer_cache_similarity,
+            )
+            ANSWER_CACHES[answer_cache_key] = cache
+        cache.invalidate(product_catalog_hash)
+        knowledge_base = CachedKnowledgeBase(
+            knowledge_base, cache, catalog_hash=product_catalog_hash
+        )
+
+    if config.structured_lookup:
+        knowledge_base = StructuredProductSearch(product_index, knowledge_base)
     return knowledge_base
 
 
@@ -245,16 +434,19 @@ def generate_calendly_invitation_link(query):
     else:
         return "Failed to create Calendly link: "
 
-def get_tools(product_catalog):
+def get_tools(product_catalog, knowledge_base=None, **config):
     # query to get_tools can be used to be embedded and relevant tools found
     # see here: https://langchain-langchain.vercel.app/docs/use_cases/agents/custom_agent_with_plugin_retrieval#tool-retriever
 
     # we only use four tools for now, but this is highly extensible!
-    knowledge_base = setup_knowledge_base(product_catalog)
+    # without a knowledge_base, the KnowledgeBaseConfig fields in config are passed to setup_knowledge_base
+    if knowledge_base is None:
+        knowledge_base = setup_knowledge_base(product_catalog, **config)
     tools = [
         Tool(
             name="ProductSearch",
             func=knowledge_base.run,
+            coroutine=knowledge_base.arun,
             description="useful for when you need to answer questions about product information or services offered, availability and their costs.",
         ),
         Tool(
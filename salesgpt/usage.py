@@ -0,0 +1,189 @@
+import json
+import threading
+from typing import Any, Callable, Dict, List
+
+import litellm
+from langchain_core.callbacks import BaseCallbackHandler, BaseCallbackManager
+from langchain_core.outputs import LLMResult
+
+
+def _get(obj: Any, key: str) -> Any:
+    # litellm reports usage as objects, langchain and cached responses as plain dicts
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(key)
+    return getattr(obj, key, None)
+
+
+def cached_prompt_tokens(usage: Any) -> int:
+    """
+    Returns the number of prompt tokens a provider served from its prompt cache.
+
+    OpenAI style providers report them in usage.prompt_tokens_details.cached_tokens, Anthropic in
+    usage.cache_read_input_tokens.
+
+    Args:
+        usage (Any): The usage of an LLM response, as a dict or an object.
+
+    Returns:
+        int: The cached prompt tokens, 0 if the provider did not report any.
+    """
+    cached = _get(_get(usage, "prompt_tokens_details"), "cached_tokens")
+    if cached is None:
+        cached = _get(usage, "cache_read_input_tokens")
+    return cached or 0
+
+
+def provider_usage(original_response: Any) -> Any:
+    """
+    Returns the usage of a raw provider response, as litellm logs it before converting the response.
+
+    Args:
+        original_response (Any): The provider's response, e.g. an OpenAI ChatCompletion or a JSON string.
+
+    Returns:
+        Any: The usage, or None if the response has none.
+    """
+    if isinstance(original_response, (str, bytes)):
+        try:
+            original_response = json.loads(original_response)
+        except ValueError:
+            return None
+    elif hasattr(original_response, "model_dump"):
+        original_response = original_response.model_dump()
+    return _get(original_response, "usage")
+
+
+class LiteLLMUsageClient:
+    """
+    The litellm module as a ChatLiteLLM client, with the cached prompt tokens kept in the response usage.
+
+    litellm 1.10.2 builds the usage of its responses from the prompt, completion and total tokens only. This
+    client reads the cached prompt tokens from the raw provider response that litellm passes to logger_fn
+    and sets them as usage.prompt_tokens_details.cached_tokens, so PromptCacheUsage can count them.
+    """
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(litellm, name)
+
+    @staticmethod
+    def _logger(
+        kwargs: Dict[str, Any], raw_responses: List[Any]
+    ) -> Callable[[Dict[str, Any]], None]:
+        logger_fn = kwargs.pop("logger_fn", None)
+
+        def log(model_call_details: Dict[str, Any]):
+            raw_responses.append(model_call_details.get("original_response"))
+            if logger_fn is not None:
+                logger_fn(model_call_details)
+
+        return log
+
+    @staticmethod
+    def _add_cached_tokens(response: Any, raw_responses: List[Any]) -> Any:
+        usage = _get(response, "usage")
+        if usage is None or cached_prompt_tokens(usage):
+            return response
+        # logger_fn runs before the call, with the raw response and with the converted response
+        for original_response in raw_responses:
+            cached = cached_prompt_tokens(provider_usage(original_response))
+            if cached:
+                usage.prompt_tokens_details = {"cached_tokens": cached}
+                break
+        return response
+
+    def completion(self, **kwargs: Any) -> Any:
+        raw_responses: List[Any] = []
+        logger_fn = self._logger(kwargs, raw_responses)
+        response = litellm.completion(logger_fn=logger_fn, **kwargs)
+        return self._add_cached_tokens(response, raw_responses)
+
+    async def acompletion(self, **kwargs: Any) -> Any:
+        raw_responses: List[Any] = []
+        logger_fn = self._logger(kwargs, raw_responses)
+        response = await litellm.acompletion(logger_fn=logger_fn, **kwargs)
+        return self._add_cached_tokens(response, raw_responses)
+
+
+LITELLM_USAGE_CLIENT = LiteLLMUsageClient()
+
+
+class PromptCacheUsage(BaseCallbackHandler):
+    """
+    Callback handler keeping running totals of the prompt tokens sent and the prompt tokens providers
+    served from their prompt cache.
+
+    One instance is shared by all the chains of an agent, so the cached ratio shows how well the prompt
+    layout reuses the cached prefix across turns and sessions.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def record(self, usage: Any):
+        """
+        Adds the usage of one LLM response. Responses without usage are ignored.
+
+        Args:
+            usage (Any): The usage of an LLM response, as a dict or an object.
+        """
+        if not usage:
+            return
+        prompt_tokens = _get(usage, "prompt_tokens") or 0
+        cached_tokens = cached_prompt_tokens(usage)
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        """Adds the usage that langchain chat models report under "token_usage" of the llm_output."""
+        if response.llm_output:
+            self.record(response.llm_output.get("token_usage"))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns prompt cache metrics.
+
+        Returns:
+            Dict[str, Any]: LLM calls, prompt tokens, cached prompt tokens and the cached ratio.
+        """
+        with self._lock:
+            return {
+                "llm_calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_prompt_tokens": self.cached_tokens,
+                "cached_prompt_ratio": (
+                    self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+                ),
+            }
+
+
+def with_callback(llm: Any, handler: BaseCallbackHandler) -> Any:
+    """
+    Returns a copy of a langchain LLM that also calls handler. The LLM itself is not changed.
+
+    A ChatLiteLLM copy uses the LiteLLMUsageClient, so handler also sees the cached prompt tokens.
+
+    Args:
+        llm (Any): The langchain LLM or chat model.
+        handler (BaseCallbackHandler): The callback handler to add.
+
+    Returns:
+        Any: The copy of the LLM.
+    """
+    callbacks = llm.callbacks
+    if isinstance(callbacks, BaseCallbackManager):
+        callbacks = callbacks.copy()
+        callbacks.add_handler(handler)
+    else:
+        callbacks = [*(callbacks or []), handler]
+    # BaseModel.copy leaves out excluded fields like tags and metadata, so copy all values instead
+    values = {**llm.__dict__, "callbacks": callbacks}
+    if values.get("client") is litellm:
+        values["client"] = LITELLM_USAGE_CLIENT
+    return type(llm).construct(_fields_set=llm.__fields_set__ | {"callbacks"}, **values)
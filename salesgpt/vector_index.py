@@ -0,0 +1,190 @@
+import json
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from salesgpt.logger import time_logger
+
+VECTORS_FILE = "vectors.npy"
+RECORDS_FILE = "records.bin"
+OFFSETS_FILE = "offsets.npy"
+
+
+class MemmapVectorIndex:
+    """
+    Read-only vector index backed by memory-mapped NumPy files.
+
+    Vectors are stored L2-normalized as float32 so cosine similarity is a single matrix-vector product.
+    Texts and metadata are stored as JSON records in one blob with an offsets array and are only decoded
+    for the top-k hits. Every process that loads the same index directory shares one page-cache copy.
+    """
+
+    def __init__(self, vectors: np.ndarray, records: np.ndarray, offsets: np.ndarray):
+        self.vectors = vectors
+        self.records = records
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    @classmethod
+    @time_logger
+    def build(
+        cls,
+        index_dir: str,
+        texts: List[str],
+        embeddings: Embeddings,
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+    ) -> "MemmapVectorIndex":
+        """
+        Embeds the texts and writes the index to index_dir, then loads it memory-mapped.
+
+        The index is written to a temporary directory and renamed into place, so concurrent workers never
+        observe a partially written index. If another worker finished first, its index is used.
+
+        Args:
+            index_dir (str): Directory the index is written to.
+            texts (List[str]): Texts to index. Without texts an empty index is written.
+            embeddings (Embeddings): Embedding model used for the texts.
+            metadatas (Optional[List[Dict[str, Any]]]): Optional metadata for every text.
+
+        Returns:
+            MemmapVectorIndex: The loaded index.
+        """
+        metadatas = metadatas or [{} for _ in texts]
+        if texts:
+            vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors /= np.where(norms == 0, 1.0, norms)
+        else:
+            # e.g. an empty catalog, the index finds nothing
+            vectors = np.zeros((0, 0), dtype=np.float32)
+
+        encoded = [
+            json.dumps({"text": text, "metadata": metadata}).encode("utf-8")
+            for text, metadata in zip(texts, metadatas)
+        ]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(record) for record in encoded])
+
+        parent_dir = os.path.dirname(os.path.abspath(index_dir))
+        os.makedirs(parent_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=parent_dir, prefix=".tmp-index-")
+        try:
+            np.save(os.path.join(tmp_dir, VECTORS_FILE), vectors)
+            np.save(os.path.join(tmp_dir, OFFSETS_FILE), offsets)
+            with open(os.path.join(tmp_dir, RECORDS_FILE), "wb") as f:
+                for record in encoded:
+                    f.write(record)
+            os.rename(tmp_dir, index_dir)
+        except OSError:
+            # another worker already published this index
+            if not os.path.isdir(index_dir):
+                raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return cls.load(index_dir)
+
+    @classmethod
+    def load(cls, index_dir: str) -> "MemmapVectorIndex":
+        """
+        Loads an index read-only with memory mapping.
+
+        Args:
+            index_dir (str): Directory the index was written to.
+
+        Returns:
+            MemmapVectorIndex: The loaded index.
+        """
+        vectors = np.load(os.path.join(index_dir, VECTORS_FILE), mmap_mode="r")
+        offsets = np.load(os.path.join(index_dir, OFFSETS_FILE), mmap_mode="r")
+        records_path = os.path.join(index_dir, RECORDS_FILE)
+        if os.path.getsize(records_path) == 0:
+            records = np.zeros(0, dtype=np.uint8)
+        else:
+            records = np.memmap(records_path, dtype=np.uint8, mode="r")
+        return cls(vectors, records, offsets)
+
+    @classmethod
+    def load_or_build(
+        cls,
+        index_dir: str,
+        texts: List[str],
+        embeddings: Embeddings,
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+    ) -> "MemmapVectorIndex":
+        """
+        Loads the index from index_dir if it exists, otherwise builds it.
+
+        Returns:
+            MemmapVectorIndex: The loaded index.
+        """
+        if os.path.isdir(index_dir):
+            return cls.load(index_dir)
+        return cls.build(index_dir, texts, embeddings, metadatas)
+
+    def record(self, i: int) -> Dict[str, Any]:
+        """
+        Decodes the text and metadata stored for the i-th vector.
+
+        Args:
+            i (int): Position of the vector in the index.
+
+        Returns:
+            Dict[str, Any]: A dictionary with "text" and "metadata" keys.
+        """
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return json.loads(self.records[start:end].tobytes().decode("utf-8"))
+
+    def search(self, query_vector: List[float], k: int = 4) -> List[Tuple[int, float]]:
+        """
+        Finds the k vectors with the highest cosine similarity to the query vector.
+
+        Args:
+            query_vector (List[float]): The query embedding.
+            k (int): Number of results to return.
+
+        Returns:
+            List[Tuple[int, float]]: Positions and similarity scores, best first.
+        """
+        if len(self) == 0:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        scores = self.vectors @ query
+        k = min(k, scores.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+
+class MemmapRetriever(BaseRetriever):
+    """Retriever that queries a MemmapVectorIndex."""
+
+    index: Any
+    embeddings: Embeddings
+    k: int = 4
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        hits = self.index.search(self.embeddings.embed_query(query), k=self.k)
+        documents = []
+        for i, score in hits:
+            record = self.index.record(i)
+            documents.append(
+                Document(
+                    page_content=record["text"],
+                    metadata={**record["metadata"], "score": score},
+                )
+            )
+        return documents
@@ -1,3 +1,4 @@
+import asyncio
 import os
 from unittest.mock import MagicMock, patch, AsyncMock
 
@@ -101,3 +102,135 @@ class TestSalesGPTAPI:
         for key in expected_keys:
             assert key in payload, f"Payload missing expected key: {key}"
             
+
+
+class TestBackgroundStageAnalysis:
+    @staticmethod
+    async def reply(self, stream=False, state=None):
+        state.conversation_history.append("Ted Lasso: Hi! <END_OF_TURN>")
+        return {}
+
+    @pytest.mark.asyncio
+    async def test_reply_returns_before_stage_analysis(self):
+        analysis_done = asyncio.Event()
+
+        async def slow_stage_analysis(self, state=None):
+            await asyncio.sleep(0.05)
+            state.conversation_stage_id = "2"
+            analysis_done.set()
+
+        api = SalesGPTAPI(
+            config_path="", use_tools=False, background_stage_analysis=True
+        )
+        with patch("salesgpt.salesgptapi.SalesGPT.astep", self.reply), patch(
+            "salesgpt.salesgptapi.SalesGPT.adetermine_conversation_stage",
+            slow_stage_analysis,
+        ):
+            await api.do(human_input="Hello")
+            assert not analysis_done.is_set()
+            assert api.sales_agent.conversation_stage_id == "1"
+
+            await api.do(human_input="Tell me more")
+
+        assert analysis_done.is_set()
+        assert api.sales_agent.conversation_stage_id == "2"
+        assert api.stage_task is not None
+
+    @pytest.mark.asyncio
+    async def test_slow_stage_analysis_is_cancelled(self):
+        async def stuck_stage_analysis(self, state=None):
+            await asyncio.sleep(10)
+            state.conversation_stage_id = "7"
+
+        api = SalesGPTAPI(
+            config_path="",
+            use_tools=False,
+            background_stage_analysis=True,
+            stage_analysis_timeout=0.01,
+        )
+        with patch("salesgpt.salesgptapi.SalesGPT.astep", self.reply), patch(
+            "salesgpt.salesgptapi.SalesGPT.adetermine_conversation_stage",
+            stuck_stage_analysis,
+        ):
+            await api.do(human_input="Hello")
+            first_task = api.stage_task
+            await api.do(human_input="Tell me more")
+
+        await asyncio.sleep(0)
+        assert first_task.cancelled()
+        assert api.sales_agent.conversation_stage_id == "1"
+        api.stage_task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await api.stage_task
+
+    @pytest.mark.asyncio
+    async def test_cancelled_turn_keeps_previous_stage_analysis(self):
+        release = asyncio.Event()
+        replying = asyncio.Event()
+
+        async def stage_analysis(self, state=None):
+            await release.wait()
+            state.stage_analyzed_turns = len(state.conversation_history)
+            state.stage_path = [["1", state.stage_analyzed_turns]]
+            state.conversation_stage_id = "3"
+
+        async def slow_reply(self, stream=False, state=None):
+            replying.set()
+            await asyncio.sleep(10)
+
+        api = SalesGPTAPI(
+            config_path="", use_tools=False, background_stage_analysis=True
+        )
+        with patch(
+            "salesgpt.salesgptapi.SalesGPT.adetermine_conversation_stage",
+            stage_analysis,
+        ):
+            with patch("salesgpt.salesgptapi.SalesGPT.astep", self.reply):
+                await api.do(human_input="Hello")
+            first_task = api.stage_task
+
+            with patch("salesgpt.salesgptapi.SalesGPT.astep", slow_reply):
+                # cancelled while waiting for the stage analysis, which is kept
+                turn = asyncio.create_task(api.do(human_input="Tell me more"))
+                await asyncio.sleep(0.01)
+                turn.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await turn
+                assert api.stage_task is first_task
+
+                # cancelled after the stage analysis was applied
+                turn = asyncio.create_task(api.do(human_input="Tell me more"))
+                release.set()
+                await replying.wait()
+                turn.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await turn
+
+        state = api.sales_agent.state
+        assert len(state.conversation_history) == 2
+        assert state.current_turn == 1
+        assert state.conversation_stage_id == "3"
+        assert state.stage_analyzed_turns == 2
+        assert state.stage_path == [["1", 2]]
+        assert api.stage_task is None
+
+    @pytest.mark.asyncio
+    async def test_analysis_of_replaced_history_is_cancelled(self):
+        async def stuck_stage_analysis(self, state=None):
+            await asyncio.sleep(10)
+
+        api = SalesGPTAPI(
+            config_path="", use_tools=False, background_stage_analysis=True
+        )
+        with patch("salesgpt.salesgptapi.SalesGPT.astep", self.reply), patch(
+            "salesgpt.salesgptapi.SalesGPT.adetermine_conversation_stage",
+            stuck_stage_analysis,
+        ):
+            await api.do(human_input="Hello")
+            first_task = api.stage_task
+            api.sales_agent.conversation_history = []
+            await asyncio.wait_for(api.do(human_input="Hi again"), 1)
+
+        await asyncio.sleep(0)
+        assert first_task.cancelled()
+        api.stage_task.cancel()
@@ -0,0 +1,116 @@
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from salesgpt.cache import (
+    CachedKnowledgeBase,
+    LRUTTLCache,
+    SemanticAnswerCache,
+    normalize_query,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class KeywordEmbeddings(Embeddings):
+    """Embeds texts by the presence of a few keywords, so similar questions get identical vectors."""
+
+    keywords = ["price", "memory", "foam", "latex", "size"]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        text = text.lower()
+        return [float(keyword in text) for keyword in self.keywords]
+
+
+class CountingKnowledgeBase:
+    def __init__(self):
+        self.calls = 0
+
+    def run(self, query):
+        self.calls += 1
+        return f"answer {self.calls}"
+
+    async def arun(self, query):
+        return self.run(query)
+
+
+def test_lru_ttl_cache_evicts_least_recently_used():
+    evicted = []
+    cache = LRUTTLCache(max_size=2, on_evict=lambda key, value: evicted.append(key))
+    cache["a"] = 1
+    cache["b"] = 2
+    cache.get("a")
+    cache["c"] = 3
+
+    assert evicted == ["b"]
+    assert "a" in cache and "c" in cache
+    assert cache.evictions == 1
+
+
+def test_lru_ttl_cache_expires_idle_entries():
+    clock = FakeClock()
+    cache = LRUTTLCache(ttl=10, clock=clock)
+    cache["a"] = 1
+    clock.now = 5
+    cache["b"] = 2
+    clock.now = 12
+
+    assert cache.expire() == [("a", 1)]
+    assert cache.get("b") == 2
+    clock.now = 30
+    assert cache.get("b") is None
+    assert cache.expirations == 2
+
+
+def test_normalize_query():
+    assert normalize_query("  What's the PRICE? ") == normalize_query("what s the price")
+
+
+def test_semantic_cache_exact_and_similar_hits():
+    knowledge_base = CountingKnowledgeBase()
+    cache = SemanticAnswerCache(KeywordEmbeddings(), similarity_threshold=0.99)
+    cached = CachedKnowledgeBase(knowledge_base, cache)
+
+    first = cached.run("What's the price of the memory foam mattress?")
+    assert cached.run("what's the price of the memory foam mattress") == first
+    assert cached.run("memory foam mattress price please") == first
+    assert cached.run("Which sizes does the latex mattress come in?") != first
+
+    assert knowledge_base.calls == 2
+    stats = cache.stats()
+    assert stats["exact_hits"] == 1
+    assert stats["semantic_hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["hit_rate"] == 0.5
+
+
+def test_semantic_cache_invalidates_on_catalog_change():
+    knowledge_base = CountingKnowledgeBase()
+    cache = SemanticAnswerCache()
+    cache.invalidate("hash-1")
+    old = CachedKnowledgeBase(knowledge_base, cache, catalog_hash="hash-1")
+    old.run("price")
+    assert cache.stats()["entries"] == 1
+
+    cache.invalidate("hash-2")
+    assert cache.stats()["entries"] == 0
+
+    old.run("price")
+    assert cache.stats()["entries"] == 0, "Stale knowledge bases should bypass the cache."
+
+
+@pytest.mark.asyncio
+async def test_semantic_cache_async():
+    knowledge_base = CountingKnowledgeBase()
+    cached = CachedKnowledgeBase(knowledge_base, SemanticAnswerCache(KeywordEmbeddings()))
+    first = await cached.arun("price of latex")
+    assert await cached.arun("latex price") == first
+    assert knowledge_base.calls == 1
@@ -0,0 +1,122 @@
+import os
+
+import pytest
+
+from salesgpt.catalog import (
+    ProductIndex,
+    StructuredProductSearch,
+    parse_product_catalog,
+)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data")
+
+
+class FallbackKnowledgeBase:
+    def __init__(self):
+        self.queries = []
+
+    def run(self, query):
+        self.queries.append(query)
+        return "semantic answer"
+
+    async def arun(self, query):
+        return self.run(query)
+
+
+@pytest.fixture
+def products():
+    with open(os.path.join(DATA_DIR, "sample_product_catalog.txt")) as f:
+        return parse_product_catalog(f.read())
+
+
+@pytest.fixture
+def product_index(products):
+    return ProductIndex(products)
+
+
+def test_parse_product_catalog(products):
+    assert [product.name for product in products] == [
+        "Luxury Cloud-Comfort Memory Foam Mattress",
+        "Classic Harmony Spring Mattress",
+        "EcoGreen Hybrid Latex Mattress",
+        "Plush Serenity Bamboo Mattress",
+    ]
+    assert products[1].price == 1299.0
+    assert products[1].price_text == "$1,299"
+    assert products[0].sizes == ["Twin", "Queen", "King"]
+    assert products[3].sizes == ["King"], "Misspelled size labels should still parse."
+
+
+def test_parse_prefixed_product_names():
+    catalog = "Sleep Haven product 1: Cozy Mattress\nVery cozy.\nPrice: $10\nSizes available for this product: Twin"
+    products = parse_product_catalog(catalog)
+    assert products[0].name == "Cozy Mattress"
+    assert products[0].sizes == ["Twin"]
+
+
+def test_find_by_exact_and_fuzzy_name(product_index):
+    assert [p.name for p in product_index.find("the Classic Harmony Spring Mattress")] == [
+        "Classic Harmony Spring Mattress"
+    ]
+    assert [p.name for p in product_index.find("the bambo one")] == [
+        "Plush Serenity Bamboo Mattress"
+    ]
+    assert len(product_index.find("your mattresses")) == 4
+    assert product_index.find("a sofa") == []
+
+
+def test_answer_price_and_availability(product_index):
+    assert (
+        product_index.answer("How much is the memory foam mattress?")
+        == "Luxury Cloud-Comfort Memory Foam Mattress. Price: $999. Sizes available: Twin, Queen, King."
+    )
+    assert (
+        product_index.answer("Is the latex mattress available in twin?")
+        == "EcoGreen Hybrid Latex Mattress is available in Twin."
+    )
+    assert product_index.answer("Is the latex mattress available in king?").startswith(
+        "EcoGreen Hybrid Latex Mattress is not available in King."
+    )
+    assert product_index.answer("Tell me about the bamboo mattress") is None
+
+
+def test_answer_only_covers_products_in_the_asked_size():
+    index = ProductIndex(
+        parse_product_catalog(
+            "Product 1: Cloud Mattress\nPrice: $999\nSizes available: Twin, Queen\n\n"
+            "Product 2: Spring Mattress\nPrice: $1,299\nSizes available: King"
+        )
+    )
+
+    assert (
+        index.answer("What is the price of the queen mattress?")
+        == "Cloud Mattress is available in Queen. Price: $999."
+    )
+    # a named product without the size is still told apart
+    assert index.answer("How much is the spring mattress in queen?").startswith(
+        "Spring Mattress is not available in Queen."
+    )
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "What does the warranty cost for the spring mattress?",
+        "How much does shipping cost for the latex mattress?",
+        "Do you offer a mattress that helps with back pain?",
+        "Do you sell the bamboo mattress with a return policy?",
+        "Do you carry pillows for the memory foam mattress?",
+    ],
+)
+def test_answer_leaves_other_questions_to_semantic_search(product_index, query):
+    assert product_index.answer(query) is None
+
+
+def test_structured_search_falls_back(product_index):
+    fallback = FallbackKnowledgeBase()
+    knowledge_base = StructuredProductSearch(product_index, fallback)
+
+    assert "$2,599" in knowledge_base.run("price of the bamboo mattress")
+    assert knowledge_base.run("Is the spring mattress good for back pain?") == "semantic answer"
+    assert fallback.queries == ["Is the spring mattress good for back pain?"]
+    assert knowledge_base.stats() == {"structured_hits": 1, "fallbacks": 1}
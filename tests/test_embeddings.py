@@ -0,0 +1,111 @@
+import os
+
+import numpy as np
+import pytest
+
+from salesgpt.embeddings import HashingEmbeddings, _word_features, build_embeddings
+from salesgpt.knowledge_base import KNOWLEDGE_BASE_REGISTRY
+from salesgpt.tools import setup_knowledge_base
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data")
+CATALOG_PATH = os.path.join(DATA_DIR, "sample_product_catalog.txt")
+
+
+@pytest.fixture
+def embeddings():
+    return HashingEmbeddings()
+
+
+def cosine(a, b):
+    return float(np.dot(a, b))
+
+
+def test_hashing_embeddings_are_deterministic_and_normalized(embeddings):
+    first = embeddings.embed_query("Luxury Cloud-Comfort Memory Foam Mattress")
+    second = HashingEmbeddings().embed_query("Luxury Cloud-Comfort Memory Foam Mattress")
+
+    assert first == second
+    assert len(first) == embeddings.n_features
+    assert np.linalg.norm(first) == pytest.approx(1.0, abs=1e-5)
+    assert np.linalg.norm(embeddings.embed_query("")) == 0
+
+
+def test_hashing_embeddings_rank_shared_vocabulary(embeddings):
+    query = embeddings.embed_query("memory foam mattress price")
+    related = embeddings.embed_query("Luxury Cloud-Comfort Memory Foam Mattress. Price: $999")
+    typo = embeddings.embed_query("memroy foam matress")
+    unrelated = embeddings.embed_query("Can we schedule a call next Tuesday?")
+
+    assert cosine(query, related) > cosine(query, unrelated)
+    assert cosine(query, typo) > cosine(query, unrelated)
+
+
+def test_hashing_embeddings_batches_match_single_texts():
+    embeddings = HashingEmbeddings(batch_size=2)
+    texts = ["king size bed", "queen size mattress", "bamboo pillow", ""]
+
+    batched = embeddings.encode(texts)
+
+    assert batched.shape == (4, embeddings.n_features)
+    for text, row in zip(texts, batched):
+        assert np.allclose(row, embeddings.embed_query(text))
+
+
+def test_hashing_embeddings_hash_every_word_once(embeddings):
+    # query latency is measured by examples/embedding_latency_benchmark.py
+    query = "Do you have the hybrid mattress in king size?"
+    first = embeddings.embed_query(query)
+    misses = _word_features.cache_info().misses
+
+    assert embeddings.embed_query(query) == first
+    assert embeddings.embed_query("king size hybrid?") != first
+    assert _word_features.cache_info().misses == misses
+
+
+def test_build_embeddings_local_backend():
+    assert isinstance(build_embeddings(embedding_backend="local"), HashingEmbeddings)
+    with pytest.raises(ValueError):
+        build_embeddings(embedding_backend="unknown")
+
+
+def test_setup_knowledge_base_offline():
+    KNOWLEDGE_BASE_REGISTRY.clear()
+    knowledge_base = setup_knowledge_base(
+        CATALOG_PATH,
+        embedding_backend="local",
+        retrieval_mode="direct",
+        chunk_size=200,
+        chunk_overlap=0,
+        top_k=1,
+    )
+
+    answer = knowledge_base.run("Tell me about the bamboo mattress")
+
+    assert "Plush Serenity Bamboo Mattress" in answer
+    KNOWLEDGE_BASE_REGISTRY.clear()
+
+
+def test_in_memory_builds_with_other_options_do_not_share_chunks():
+    KNOWLEDGE_BASE_REGISTRY.clear()
+
+    def build(top_k):
+        return setup_knowledge_base(
+            CATALOG_PATH,
+            embedding_backend="local",
+            retrieval_mode="direct",
+            chunk_size=200,
+            chunk_overlap=0,
+            top_k=top_k,
+        )
+
+    first = build(1).retriever.vectorstore
+    second = build(2).retriever.vectorstore
+    chunks = first._collection.count()
+    KNOWLEDGE_BASE_REGISTRY.clear()
+    rebuilt = build(1).retriever.vectorstore
+
+    assert first._collection.name != second._collection.name
+    assert rebuilt._collection.name == first._collection.name
+    assert second._collection.count() == chunks
+    assert rebuilt._collection.count() == chunks
+    KNOWLEDGE_BASE_REGISTRY.clear()
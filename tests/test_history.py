@@ -0,0 +1,85 @@
+from unittest.mock import patch
+
+import pytest
+from langchain_community.chat_models import ChatLiteLLM
+
+from salesgpt import history
+from salesgpt.agents import SalesGPT
+from salesgpt.history import turn_token_count, window_history
+
+
+@pytest.fixture(autouse=True)
+def clear_token_counts():
+    history._TURN_TOKEN_COUNTS.clear()
+    yield
+    history._TURN_TOKEN_COUNTS.clear()
+
+
+def make_history(turns):
+    return [
+        f"{'Ted Lasso' if i % 2 == 0 else 'User'}: turn number {i} <END_OF_TURN>"
+        for i in range(turns)
+    ]
+
+
+def test_history_within_budget_is_unchanged():
+    conversation_history = make_history(4)
+
+    assert window_history(conversation_history, 10000) == conversation_history
+
+
+def test_window_pins_first_exchange_and_keeps_recent_turns():
+    conversation_history = make_history(40)
+    per_turn = turn_token_count(conversation_history[10])
+    budget = per_turn * 8
+
+    window = window_history(conversation_history, budget, pinned_turns=2)
+
+    assert window[:2] == conversation_history[:2]
+    assert window[2] == "[32 earlier turns omitted]"
+    assert window[3:] == conversation_history[-6:]
+    assert sum(turn_token_count(turn) for turn in window[:2] + window[3:]) <= budget
+
+
+def test_window_always_keeps_latest_turn():
+    conversation_history = make_history(6) + ["User: " + "very long " * 200]
+
+    window = window_history(conversation_history, 50, pinned_turns=2)
+
+    assert window[-1] == conversation_history[-1]
+    assert window[2] == "[4 earlier turns omitted]"
+
+
+def test_turns_are_tokenized_once():
+    conversation_history = make_history(100)
+    with patch("salesgpt.history.count_tokens", return_value=10) as count_tokens:
+        window_history(conversation_history, 200)
+        first_calls = count_tokens.call_count
+        conversation_history.append("User: one more question <END_OF_TURN>")
+        window_history(conversation_history, 200)
+
+    # only the turns inside the window are tokenized, and each of them only once
+    assert first_calls < 25
+    assert count_tokens.call_count == first_calls + 1
+
+
+def test_agent_prompts_use_history_budget():
+    engine = SalesGPT.from_llm(
+        ChatLiteLLM(model="gpt-3.5-turbo"), use_tools=False, history_max_tokens=100
+    )
+    session = engine.new_session()
+    session.conversation_history.extend(make_history(60))
+
+    formatted = engine.format_conversation_history(session.state)
+    messages = engine._prep_messages(state=session.state)
+
+    assert formatted.startswith("Ted Lasso: turn number 0 <END_OF_TURN>\nUser: turn number 1")
+    assert "earlier turns omitted]" in formatted
+    assert formatted.endswith("turn number 59 <END_OF_TURN>")
+    assert formatted in messages[-1]["content"]
+    assert "turn number 30 " not in messages[-1]["content"]
+
+    engine.history_max_tokens = None
+    assert engine.format_conversation_history(session.state) == "\n".join(
+        session.conversation_history
+    )
@@ -0,0 +1,137 @@
+import os
+import re
+from typing import List
+
+import pytest
+from langchain.text_splitter import CharacterTextSplitter
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import Chroma
+
+from salesgpt.ingestion import (
+    ChromaCatalogWriter,
+    ingest_catalog,
+    iter_catalog_chunks,
+    iter_catalog_files,
+    iter_chunks,
+    iter_paragraphs,
+)
+from salesgpt.knowledge_base import KNOWLEDGE_BASE_REGISTRY, catalog_hash
+from salesgpt.tools import setup_knowledge_base
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data")
+CATALOG_PATH = os.path.join(DATA_DIR, "sample_product_catalog.txt")
+
+
+class FlakyEmbeddings(DeterministicFakeEmbedding):
+    failures: int = 1
+    calls: int = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("embedding API unavailable")
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def catalog_dir(tmp_path):
+    with open(CATALOG_PATH) as f:
+        catalog = f.read()
+    (tmp_path / "a.txt").write_text(catalog)
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "nested" / "b.txt").write_text(catalog.replace("Mattress", "Bed"))
+    (tmp_path / ".hidden").write_text("ignored")
+    return tmp_path
+
+
+def test_iter_paragraphs_streams_across_blocks():
+    with open(CATALOG_PATH) as f:
+        expected = [p.strip() for p in re.split(r"\n\s*\n", f.read()) if p.strip()]
+    assert list(iter_paragraphs(CATALOG_PATH, read_size=7)) == expected
+
+
+def test_iter_paragraphs_splits_files_without_blank_lines(tmp_path):
+    lines = [f"Product {i}: a mattress. Price: ${i}." for i in range(20000)]
+    path = tmp_path / "catalog.txt"
+    path.write_text("\n".join(lines) + "\n" + "One long line. " * 100 + "x" * 700)
+
+    paragraphs = list(iter_paragraphs(str(path), read_size=4096, max_size=500))
+
+    assert max(len(p) for p in paragraphs) <= 500
+    assert "\n".join(paragraphs[:-6]) == "\n".join(lines)
+    # a line that is too long is split at sentence ends, text without any at max_size
+    sentences = ("One long line. " * 33).strip()
+    assert paragraphs[-6:] == [sentences] * 3 + ["One long line.", "x" * 500, "x" * 200]
+
+
+@pytest.mark.parametrize("chunk_size,chunk_overlap", [(5000, 200), (600, 300), (50, 0)])
+def test_iter_chunks_matches_character_text_splitter(chunk_size, chunk_overlap):
+    with open(CATALOG_PATH) as f:
+        catalog = f.read()
+    splitter = CharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    chunks = list(iter_chunks(iter_paragraphs(CATALOG_PATH), chunk_size, chunk_overlap))
+
+    assert [c.replace("\n\n", " ") for c in chunks] == [
+        c.replace("\n\n", " ") for c in splitter.split_text(catalog)
+    ]
+
+
+def test_catalog_directory_files_and_hash(catalog_dir):
+    files = [os.path.relpath(p, catalog_dir) for p in iter_catalog_files(str(catalog_dir))]
+    assert files == ["a.txt", os.path.join("nested", "b.txt")]
+
+    before = catalog_hash(str(catalog_dir))
+    (catalog_dir / "nested" / "b.txt").write_text("changed")
+    assert catalog_hash(str(catalog_dir)) != before
+
+
+def test_ingest_catalog_batches_retries_and_resumes(catalog_dir):
+    embeddings = FlakyEmbeddings(size=16)
+    vectorstore = Chroma(
+        collection_name="test-ingestion", embedding_function=embeddings
+    )
+    writer = ChromaCatalogWriter(vectorstore)
+    progress = []
+    chunks = list(iter_catalog_chunks(str(catalog_dir), chunk_size=200, chunk_overlap=0))
+
+    stats = ingest_catalog(
+        iter(chunks),
+        embeddings,
+        writer,
+        batch_size=2,
+        max_concurrency=2,
+        progress_callback=lambda s: progress.append(s.chunks),
+    )
+
+    assert stats.chunks == len(chunks) == vectorstore._collection.count()
+    assert stats.retries == 1
+    assert len(stats.sources) == 2
+    assert progress[-1] == len(chunks)
+
+    calls = embeddings.calls
+    rerun = ingest_catalog(iter(chunks), embeddings, writer, batch_size=2)
+    assert rerun.chunks == 0
+    assert rerun.skipped == len(chunks)
+    assert embeddings.calls == calls
+    vectorstore.delete_collection()
+
+
+def test_setup_knowledge_base_streams_catalog_directory(catalog_dir):
+    KNOWLEDGE_BASE_REGISTRY.clear()
+    with pytest.raises(ValueError):
+        setup_knowledge_base(str(catalog_dir), embedding_backend="local")
+
+    knowledge_base = setup_knowledge_base(
+        str(catalog_dir),
+        embedding_backend="local",
+        retrieval_mode="direct",
+        streaming_ingestion=True,
+        chunk_size=200,
+        chunk_overlap=0,
+        top_k=1,
+    )
+
+    assert "Plush Serenity Bamboo Bed" in knowledge_base.run("plush serenity bamboo bed")
+    KNOWLEDGE_BASE_REGISTRY.clear()
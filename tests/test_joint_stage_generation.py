@@ -0,0 +1,160 @@
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from langchain_community.chat_models import ChatLiteLLM
+
+from salesgpt.agents import SalesGPT
+from salesgpt.parsers import JointStageOutputParser
+from salesgpt.salesgptapi import ENGINES, SalesGPTAPI
+from salesgpt.stages import CONVERSATION_STAGES
+
+
+@pytest.fixture
+def engine():
+    return SalesGPT.from_llm(
+        ChatLiteLLM(model="gpt-3.5-turbo"),
+        use_tools=False,
+        joint_stage_generation="True",
+    )
+
+
+def chunk(content):
+    return {"choices": [{"delta": {"content": content}}]}
+
+
+@pytest.mark.parametrize(
+    "text, stage_id, utterance",
+    [
+        ("Stage: 3\nTed Lasso: Our mattresses are cooler. <END_OF_TURN>", "3", "Our mattresses are cooler."),
+        ("4\nTed Lasso: How do you sleep?", "4", "How do you sleep?"),
+        ("**Stage 6**\n\nTed Lasso: I hear you.", "6", "I hear you."),
+        ("Stage 7 - Ted Lasso: Shall we book a trial?", "7", "Shall we book a trial?"),
+        ("Ted Lasso: No header here.", None, "No header here."),
+        ("24 hours is plenty.", None, "24 hours is plenty."),
+        ("Stage: 12\nTed Lasso: Hi.", None, "Hi."),
+    ],
+)
+def test_joint_output_parser(text, stage_id, utterance):
+    parser = JointStageOutputParser("Ted Lasso", CONVERSATION_STAGES)
+
+    assert parser.parse(text) == (stage_id, utterance)
+
+
+def test_joint_output_parser_streams_utterance_tokens():
+    parser = JointStageOutputParser("Ted Lasso", CONVERSATION_STAGES)
+    deltas = ["Sta", "ge:", " 5", "\n", "Ted", " Lasso", ":", " The", " Cloud", " Nine"]
+
+    forwarded = [parser.feed(delta) for delta in deltas]
+
+    assert forwarded[:7] == [""] * 7
+    assert forwarded[7:] == ["The", " Cloud", " Nine"]
+    assert parser.stage_id == "5"
+    assert parser.finish() == ""
+    assert parser.utterance == "The Cloud Nine"
+
+
+def test_joint_output_parser_drops_end_of_turn_split_across_deltas():
+    parser = JointStageOutputParser("Ted Lasso", CONVERSATION_STAGES)
+    deltas = ["Stage: 5\nTed Lasso:", " Sleep well", " <END_", "OF_T", "URN>"]
+
+    forwarded = "".join(parser.feed(delta) for delta in deltas) + parser.finish()
+
+    assert forwarded == "Sleep well "
+    assert parser.utterance == "Sleep well "
+    # text that only looks like the start of the marker is forwarded once it is ruled out
+    parser = JointStageOutputParser("Ted Lasso", CONVERSATION_STAGES)
+    assert parser.feed("Ted Lasso: 2 <") == "2 "
+    assert parser.feed(" 3") == "< 3"
+    assert parser.feed(" <END") == " "
+    assert parser.finish() == "<END"
+
+
+def test_joint_generation_updates_stage_in_one_call(engine):
+    session = engine.new_session()
+    session.human_step("My back hurts every morning.")
+    chain = engine.sales_conversation_utterance_chain
+
+    with patch.object(
+        type(chain),
+        "invoke",
+        return_value={"text": "Stage: 4\nTed Lasso: How long has that been going on?"},
+    ) as invoke:
+        session.step()
+
+    inputs = invoke.call_args.args[0]
+    assert inputs["conversation_stage_id"] == "1"
+    assert "4: Needs analysis" in chain.prompt.builder.system_prompt
+    assert "conversation_stages" not in inputs
+    assert session.conversation_stage_id == "4"
+    assert session.current_conversation_stage.startswith("Needs analysis")
+    assert session.conversation_history[-1] == (
+        "Ted Lasso: How long has that been going on? <END_OF_TURN>"
+    )
+
+
+def test_joint_stream_forwards_only_the_utterance(engine):
+    session = engine.new_session()
+    session.human_step("Sounds great, how do I order?")
+    stream = [chunk("Stage: 7\n"), chunk("Ted Lasso:"), chunk(" Here is"), chunk(" the link."), chunk(None)]
+
+    with patch.object(
+        type(engine.sales_conversation_utterance_chain.llm),
+        "completion_with_retry",
+        return_value=iter(stream),
+    ):
+        generator = session.step(stream=True)
+        contents = [c["choices"][0]["delta"]["content"] for c in generator]
+
+    assert contents == ["Here is", " the link.", None]
+    assert session.conversation_stage_id == "7"
+    assert session.conversation_history[-1] == "Ted Lasso: Here is the link. <END_OF_TURN>"
+
+
+@pytest.mark.asyncio
+async def test_joint_async_stream(engine):
+    async def stream():
+        for content in ["3\nTed Lasso: We", " use cooling gel."]:
+            yield chunk(content)
+
+    session = engine.new_session()
+    with patch.object(
+        SalesGPT, "acompletion_with_retry", new_callable=AsyncMock, return_value=stream()
+    ):
+        generator = await session.astep(stream=True)
+        contents = [c["choices"][0]["delta"]["content"] async for c in generator]
+
+    assert "".join(contents) == "We use cooling gel."
+    assert session.conversation_stage_id == "3"
+
+
+def test_joint_generation_is_rejected_with_tools():
+    with pytest.raises(ValueError):
+        SalesGPT.from_llm(
+            ChatLiteLLM(model="gpt-3.5-turbo"),
+            use_tools=True,
+            joint_stage_generation=True,
+        )
+
+
+@pytest.mark.asyncio
+async def test_api_skips_stage_analysis_in_joint_mode(tmp_path):
+    config_path = tmp_path / "agent.json"
+    config_path.write_text('{"joint_stage_generation": true}')
+    ENGINES.clear()
+    api = SalesGPTAPI(config_path=str(config_path), use_tools=False)
+    chain = api.sales_agent.sales_conversation_utterance_chain
+
+    with patch.object(
+        type(chain),
+        "ainvoke",
+        new_callable=AsyncMock,
+        return_value={"text": "Stage: 2\nTed Lasso: Are you the one who decides?"},
+    ), patch.object(
+        SalesGPT, "adetermine_conversation_stage", new_callable=AsyncMock
+    ) as determine:
+        payload = await api.do("Hi, I'm looking for a mattress.")
+
+    determine.assert_not_called()
+    assert payload["response"].strip() == "Are you the one who decides?"
+    assert payload["conversational_stage"].startswith("Qualification")
+    ENGINES.clear()
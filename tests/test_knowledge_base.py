@@ -0,0 +1,110 @@
+import os
+from typing import List
+
+import pytest
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+from salesgpt.embeddings import build_embeddings
+from salesgpt.knowledge_base import (
+    KnowledgeBaseConfig,
+    KnowledgeBaseRegistry,
+    catalog_hash,
+    index_catalog_texts,
+)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data")
+CATALOG_PATH = os.path.join(DATA_DIR, "sample_product_catalog.txt")
+
+
+@pytest.fixture
+def registry():
+    return KnowledgeBaseRegistry()
+
+
+def test_catalog_hash_is_stable():
+    assert catalog_hash(CATALOG_PATH) == catalog_hash(CATALOG_PATH)
+    assert len(catalog_hash(CATALOG_PATH)) == 64
+
+
+def test_registry_builds_once_per_key(registry):
+    builds = []
+
+    def builder():
+        builds.append(1)
+        return object()
+
+    key = catalog_hash(CATALOG_PATH)
+    first = registry.get_or_build(key, "text-embedding-ada-002", builder)
+    second = registry.get_or_build(key, "text-embedding-ada-002", builder)
+
+    assert first is second, "Sessions with the same catalog should share a knowledge base."
+    assert len(builds) == 1
+    assert registry.stats() == {"knowledge_bases": 1, "hits": 1, "builds": 1}
+
+
+def test_registry_separates_embedding_models(registry):
+    key = catalog_hash(CATALOG_PATH)
+    first = registry.get_or_build(key, "model-a", object)
+    second = registry.get_or_build(key, "model-b", object)
+
+    assert first is not second
+    assert registry.stats()["builds"] == 2
+
+    registry.clear()
+    assert registry.stats() == {"knowledge_bases": 0, "hits": 0, "builds": 0}
+
+
+def test_registry_is_keyed_by_knowledge_base_config(registry):
+    key = catalog_hash(CATALOG_PATH)
+    first = registry.get_or_build(key, "model-a", object, options=KnowledgeBaseConfig(top_k=2))
+    again = registry.get_or_build(key, "model-a", object, options=KnowledgeBaseConfig(top_k=2))
+    other = registry.get_or_build(key, "model-a", object, options=KnowledgeBaseConfig(top_k=3))
+
+    assert first is again
+    assert first is not other
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"vector_store": "faiss"},
+        {"vector_store": "memmap"},
+        {"retrieval_mode": "chat"},
+        {"lexical_weight": 2},
+        {"streaming_ingestion": True, "hybrid_search": True},
+    ],
+)
+def test_knowledge_base_config_validates_options(options):
+    with pytest.raises(ValueError):
+        KnowledgeBaseConfig(**options)
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    embedded: List[str] = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+def test_incremental_reindex_embeds_only_changed_chunks(tmp_path):
+    underlying = CountingEmbeddings(size=16, embedded=[])
+    embeddings = build_embeddings(
+        "fake-model",
+        cache_dir=str(tmp_path / "embedding_cache"),
+        underlying_embeddings=underlying,
+    )
+    texts = ["Product A. Price: $10", "Product B. Price: $20", "Product C. Price: $30"]
+    index_catalog_texts(
+        texts, embeddings, str(tmp_path), "test-catalog", source="catalog.txt"
+    )
+    assert len(underlying.embedded) == 3
+
+    underlying.embedded.clear()
+    updated_texts = ["Product A. Price: $10", "Product B. Price: $25"]
+    vectorstore = index_catalog_texts(
+        updated_texts, embeddings, str(tmp_path), "test-catalog", source="catalog.txt"
+    )
+
+    assert underlying.embedded == ["Product B. Price: $25"]
+    assert sorted(vectorstore.get()["documents"]) == sorted(updated_texts)
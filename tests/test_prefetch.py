@@ -0,0 +1,85 @@
+import os
+import threading
+from typing import List
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from salesgpt.catalog import ProductIndex, parse_product_catalog
+from salesgpt.prefetch import PrefetchingRetriever
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data")
+
+
+class RecordingRetriever(BaseRetriever):
+    queries: List[str] = []
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        self.queries.append(query)
+        return [Document(page_content=f"documents for {query}")]
+
+
+@pytest.fixture
+def product_index():
+    with open(os.path.join(DATA_DIR, "sample_product_catalog.txt")) as f:
+        return ProductIndex(parse_product_catalog(f.read()))
+
+
+def test_prefetch_serves_tool_query_about_same_product(product_index):
+    base = RecordingRetriever(queries=[])
+    retriever = PrefetchingRetriever(retriever=base, product_index=product_index)
+
+    assert retriever.prefetch("I like the sound of the bamboo mattress")
+    documents = retriever.get_relevant_documents("Plush Serenity Bamboo Mattress details")
+
+    assert documents[0].page_content == "documents for I like the sound of the bamboo mattress"
+    assert base.queries == ["I like the sound of the bamboo mattress"]
+    assert retriever.stats() == {"prefetches": 1, "hits": 1, "misses": 0}
+
+
+def test_prefetch_ignores_turns_without_products(product_index):
+    base = RecordingRetriever(queries=[])
+    retriever = PrefetchingRetriever(retriever=base, product_index=product_index)
+
+    assert not retriever.prefetch("Hi, who is this?")
+    retriever.get_relevant_documents("latex mattress")
+
+    assert base.queries == ["latex mattress"]
+    assert retriever.stats()["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_prefetch_async_waits_for_in_flight_retrieval(product_index):
+    release = threading.Event()
+
+    class SlowRetriever(RecordingRetriever):
+        def _get_relevant_documents(self, query, *, run_manager):
+            release.wait(timeout=5)
+            return super()._get_relevant_documents(query, run_manager=run_manager)
+
+    base = SlowRetriever(queries=[])
+    retriever = PrefetchingRetriever(retriever=base, product_index=product_index)
+    retriever.prefetch("how much is the latex mattress?")
+    release.set()
+
+    documents = await retriever.aget_relevant_documents("EcoGreen Hybrid Latex Mattress price")
+    assert documents[0].page_content == "documents for how much is the latex mattress?"
+    assert len(base.queries) == 1
+
+
+def test_prefetch_is_not_reused_for_other_questions_about_the_product(product_index):
+    base = RecordingRetriever(queries=[])
+    retriever = PrefetchingRetriever(retriever=base, product_index=product_index)
+
+    assert retriever.prefetch("Is the latex mattress good for back pain?")
+    assert not retriever.prefetch("is the LATEX mattress good for back pain")
+    assert retriever.prefetch("What is the warranty of the latex mattress?")
+    retriever.get_relevant_documents("EcoGreen Hybrid Latex Mattress return policy")
+    documents = retriever.get_relevant_documents("latex mattress back pain")
+
+    assert documents[0].page_content == (
+        "documents for Is the latex mattress good for back pain?"
+    )
+    assert "EcoGreen Hybrid Latex Mattress return policy" in base.queries
+    assert retriever.stats() == {"prefetches": 2, "hits": 1, "misses": 1}
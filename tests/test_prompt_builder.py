@@ -0,0 +1,147 @@
+import pytest
+from langchain_community.chat_models import ChatLiteLLM
+
+from salesgpt.agents import SalesGPT
+from salesgpt.chains import cacheable_prompt
+from salesgpt.history import render_history
+from salesgpt.prompt_builder import PrecompiledChatPrompt, PromptBuilder
+from salesgpt.prompts import (
+    SALES_AGENT_HISTORY_PROMPT,
+    SALES_AGENT_JOINT_STAGE_HISTORY_PROMPT,
+    SALES_AGENT_JOINT_STAGE_SYSTEM_PROMPT,
+    SALES_AGENT_SYSTEM_PROMPT,
+    STAGE_ANALYZER_INCREMENTAL_HISTORY_PROMPT,
+    STAGE_ANALYZER_SYSTEM_PROMPT,
+)
+from salesgpt.state import ConversationState
+
+STATIC_INPUTS = {
+    "salesperson_name": "Ted Lasso",
+    "salesperson_role": "Business Development Representative",
+    "company_name": "Sleep Haven",
+    "company_business": "Mattresses {and} pillows",
+    "company_values": "Better sleep",
+    "conversation_purpose": "sell a mattress",
+    "conversation_type": "call",
+    "conversation_stages": "1: Introduction\n2: Qualification",
+}
+TURN_INPUTS = {
+    "conversation_history": "User: Hi {there} <END_OF_TURN>",
+    "conversation_stage_id": "2",
+    "conversation_summary": "The prospect sleeps badly.",
+}
+
+
+@pytest.mark.parametrize(
+    "system_template, history_template",
+    [
+        (SALES_AGENT_SYSTEM_PROMPT, SALES_AGENT_HISTORY_PROMPT),
+        (SALES_AGENT_JOINT_STAGE_SYSTEM_PROMPT, SALES_AGENT_JOINT_STAGE_HISTORY_PROMPT),
+        (STAGE_ANALYZER_SYSTEM_PROMPT, STAGE_ANALYZER_INCREMENTAL_HISTORY_PROMPT),
+    ],
+)
+def test_precompiled_prompt_matches_template(system_template, history_template):
+    prompt = cacheable_prompt(system_template, history_template)
+    precompiled = PrecompiledChatPrompt.from_chat_prompt(prompt, STATIC_INPUTS)
+    inputs = {**STATIC_INPUTS, **TURN_INPUTS}
+    selected = {key: inputs[key] for key in precompiled.input_variables}
+
+    assert set(precompiled.input_variables) <= set(TURN_INPUTS)
+    assert precompiled.format_messages(**selected) == prompt.format_messages(
+        **{key: inputs[key] for key in prompt.input_variables}
+    )
+
+
+def test_builder_renders_messages():
+    builder = PromptBuilder(
+        "You are {salesperson_name}.",
+        "{conversation_history}\n{salesperson_name}:",
+        STATIC_INPUTS,
+    )
+
+    assert builder.input_variables == ["conversation_history"]
+    assert builder.messages(conversation_history="User: Hi", unused="x") == [
+        {"role": "system", "content": "You are Ted Lasso."},
+        {"role": "user", "content": "User: Hi\nTed Lasso:"},
+    ]
+
+
+def test_engine_prompts_are_precompiled():
+    engine = SalesGPT.from_llm(ChatLiteLLM(model="gpt-3.5-turbo"), use_tools=False)
+    session = engine.new_session()
+    session.human_step("Hi, who is this?")
+    uncompiled = SalesGPT.from_llm(ChatLiteLLM(model="gpt-3.5-turbo"), use_tools=False)
+    uncompiled.sales_conversation_utterance_chain.prompt = (
+        uncompiled.sales_conversation_utterance_chain.prompt.source
+    )
+
+    for chain in (engine.stage_analyzer_chain, engine.sales_conversation_utterance_chain):
+        assert isinstance(chain.prompt, PrecompiledChatPrompt)
+    assert engine.stage_analyzer_chain.prompt.input_variables == [
+        "conversation_history",
+        "conversation_stage_id",
+    ]
+    assert engine._prep_messages(state=session.state) == uncompiled._prep_messages(
+        state=session.state
+    )
+
+    engine.salesperson_name = "Roy Kent"
+    engine.compile_prompts()
+    assert "Roy Kent" in engine._prep_messages(state=session.state)[0]["content"]
+
+
+def test_custom_prompts_are_not_precompiled():
+    engine = SalesGPT.from_llm(
+        ChatLiteLLM(model="gpt-3.5-turbo"),
+        use_tools=False,
+        use_custom_prompt=True,
+        custom_prompt="You are {salesperson_name}. {conversation_history}",
+    )
+
+    assert not isinstance(
+        engine.sales_conversation_utterance_chain.prompt, PrecompiledChatPrompt
+    )
+
+
+def test_render_history_appends_new_turns():
+    turns = [f"User: turn {i} <END_OF_TURN>" for i in range(3)]
+    state = ConversationState(turns)
+    assert render_history(state) == "\n".join(turns)
+
+    # turns already rendered are not joined again
+    turns[0] = "User: edited <END_OF_TURN>"
+    turns.append("Ted Lasso: turn 3 <END_OF_TURN>")
+    rendered = render_history(state)
+    assert rendered.startswith("User: turn 0")
+    assert rendered.endswith("turn 2 <END_OF_TURN>\nTed Lasso: turn 3 <END_OF_TURN>")
+
+    assert render_history(state, 2) == "\n".join(turns[2:])
+    assert render_history(state, 5) == ""
+
+
+def test_render_history_rerenders_changed_histories():
+    turns = [f"User: turn {i} <END_OF_TURN>" for i in range(4)]
+    state = ConversationState(turns)
+    render_history(state)
+
+    del turns[2:]
+    assert render_history(state) == "\n".join(turns)
+    turns.append("User: turn 2 <END_OF_TURN>")
+    turns.append("User: other <END_OF_TURN>")
+    render_history(state)
+    turns[-1] = turns[-1].replace("other", "replaced")
+    assert render_history(state) == "\n".join(turns)
+    state.conversation_history = list(turns[:2])
+    assert render_history(state) == "\n".join(turns[:2])
+
+
+def test_rendered_history_is_not_persisted():
+    engine = SalesGPT.from_llm(ChatLiteLLM(model="gpt-3.5-turbo"), use_tools=False)
+    session = engine.new_session()
+    session.human_step("Hi, who is this?")
+    engine._prep_messages(state=session.state)
+
+    assert session.state.rendered_history is not None
+    assert "rendered_history" not in session.state.to_dict()
+    session.conversation_history = []
+    assert session.state.rendered_history is None
@@ -0,0 +1,154 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+from langchain_community.chat_models import ChatLiteLLM
+from openai.types.chat import ChatCompletion
+
+from salesgpt.agents import SalesGPT
+from salesgpt.salesgptapi import ENGINES, prompt_cache_stats
+from salesgpt.usage import PromptCacheUsage, cached_prompt_tokens
+
+
+def response(content, prompt_tokens, cached_tokens):
+    return {
+        "choices": [
+            {"message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": 5,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        },
+    }
+
+
+@pytest.mark.parametrize("joint_stage_generation", [False, True])
+def test_static_prefix_is_byte_stable(joint_stage_generation):
+    engine = SalesGPT.from_llm(
+        ChatLiteLLM(model="gpt-3.5-turbo"),
+        use_tools=False,
+        joint_stage_generation=joint_stage_generation,
+    )
+    first = engine.new_session()
+    second = engine.new_session()
+    first.human_step("Hi, who is this?")
+    before = engine._prep_messages(state=first.state)
+    first.conversation_history.append("Ted Lasso: Ted from Sleep Haven. <END_OF_TURN>")
+    first.human_step("I sleep badly.")
+    first.state.conversation_stage_id = "4"
+    after = engine._prep_messages(state=first.state)
+
+    assert [message["role"] for message in after] == ["system", "user"]
+    assert before[0] == after[0] == engine._prep_messages(state=second.state)[0]
+    assert "{" not in after[0]["content"]
+    assert "I sleep badly." in after[1]["content"]
+    assert "I sleep badly." not in after[0]["content"]
+
+
+def test_custom_prompt_is_a_single_system_message():
+    engine = SalesGPT.from_llm(
+        ChatLiteLLM(model="gpt-3.5-turbo"),
+        use_tools=False,
+        use_custom_prompt=True,
+        custom_prompt="You are {salesperson_name}. {conversation_history}",
+    )
+    session = engine.new_session()
+    session.human_step("Hello")
+
+    messages = engine._prep_messages(state=session.state)
+    with patch.object(
+        ChatLiteLLM, "completion_with_retry", return_value=response("Hi!", 20, 0)
+    ) as completion:
+        session.step()
+
+    assert messages == [
+        {"role": "system", "content": "You are Ted Lasso. User: Hello <END_OF_TURN>"}
+    ]
+    # the chain sends the same message as the streaming path
+    assert completion.call_args.kwargs["messages"] == messages
+
+
+def test_chains_record_cached_prompt_tokens():
+    ENGINES.clear()
+    llm = ChatLiteLLM(model="gpt-3.5-turbo", tags=["sales"])
+    engine = SalesGPT.from_llm(llm, use_tools=False)
+    ENGINES["test"] = engine
+    session = engine.new_session()
+    session.human_step("Do you have cooling mattresses?")
+    responses = [response("3", 600, 0), response("We do! <END_OF_TURN>", 1200, 1024)]
+
+    with patch.object(
+        ChatLiteLLM, "completion_with_retry", side_effect=responses
+    ) as completion:
+        session.determine_conversation_stage()
+        session.step()
+
+    messages = completion.call_args.kwargs["messages"]
+    assert messages[0]["role"] == "system"
+    assert "Do you have cooling mattresses?" in messages[1]["content"]
+    assert engine.prompt_cache_usage.stats() == {
+        "llm_calls": 2,
+        "prompt_tokens": 1800,
+        "cached_prompt_tokens": 1024,
+        "cached_prompt_ratio": pytest.approx(1024 / 1800),
+    }
+    assert prompt_cache_stats()["cached_prompt_tokens"] == 1024
+    assert llm.callbacks is None
+    assert engine.stage_analyzer_chain.llm.tags == ["sales"]
+    ENGINES.clear()
+
+
+def openai_completion(content, prompt_tokens, cached_tokens):
+    return ChatCompletion.model_validate(
+        {
+            "id": "chatcmpl-test",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "gpt-3.5-turbo",
+            "usage": {
+                **response(content, prompt_tokens, cached_tokens)["usage"],
+                "total_tokens": prompt_tokens + 5,
+            },
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+        }
+    )
+
+
+def test_cached_prompt_tokens_survive_litellm_response_conversion(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    engine = SalesGPT.from_llm(ChatLiteLLM(model="gpt-3.5-turbo"), use_tools=False)
+    session = engine.new_session()
+    session.human_step("Do you have cooling mattresses?")
+    responses = [
+        openai_completion("3", 600, 0),
+        openai_completion("We do! <END_OF_TURN>", 1200, 1024),
+    ]
+
+    client = MagicMock()
+    client.chat.completions.create.side_effect = responses
+    # only the OpenAI client is replaced, litellm still converts its response to a litellm response
+    with patch("litellm.llms.openai.OpenAI", return_value=client):
+        session.determine_conversation_stage()
+        session.step()
+
+    assert engine.prompt_cache_usage.stats()["llm_calls"] == 2
+    assert engine.prompt_cache_usage.stats()["prompt_tokens"] == 1800
+    assert engine.prompt_cache_usage.stats()["cached_prompt_tokens"] == 1024
+
+
+def test_cached_prompt_tokens_of_providers():
+    usage = PromptCacheUsage()
+    usage.record(SimpleNamespace(prompt_tokens=2000, cache_read_input_tokens=1500))
+    usage.record({"prompt_tokens": 100})
+    usage.record(None)
+
+    assert cached_prompt_tokens({"prompt_tokens": 100}) == 0
+    assert usage.stats()["llm_calls"] == 2
+    assert usage.stats()["cached_prompt_tokens"] == 1500
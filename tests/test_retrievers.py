@@ -0,0 +1,126 @@
+import os
+from typing import List
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from salesgpt.retrievers import (
+    BM25Retriever,
+    DirectRetrievalKnowledgeBase,
+    HybridRetriever,
+    compress_passage,
+    index_terms,
+    reciprocal_rank_fusion,
+    truncate_to_tokens,
+)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data")
+
+
+def word_count(text: str) -> int:
+    return len(text.split())
+
+
+class StaticRetriever(BaseRetriever):
+    documents: List[Document]
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        return self.documents
+
+
+@pytest.fixture
+def catalog_passages():
+    with open(os.path.join(DATA_DIR, "sample_product_catalog.txt")) as f:
+        # skip the catalog title, every other paragraph is one product
+        return [p.strip() for p in f.read().split("\n\n") if p.strip()][1:]
+
+
+def test_compress_passage_keeps_relevant_sentences(catalog_passages):
+    compressed = compress_passage(catalog_passages[0], "What is the price?")
+    lines = compressed.split("\n")
+    assert lines[0] == "Luxury Cloud-Comfort Memory Foam Mattress"
+    assert "Price: $999" in lines
+    assert len(compressed) < len(catalog_passages[0])
+
+
+def test_truncate_to_tokens():
+    assert truncate_to_tokens("one two three four", 2, word_count) == "one two"
+    assert truncate_to_tokens("one two", 5, word_count) == "one two"
+
+
+def test_direct_retrieval_respects_token_budget(catalog_passages):
+    retriever = StaticRetriever(
+        documents=[Document(page_content=p) for p in catalog_passages]
+    )
+    first_passage_tokens = word_count(catalog_passages[0])
+    knowledge_base = DirectRetrievalKnowledgeBase(
+        retriever, max_tokens=first_passage_tokens + 5, token_counter=word_count
+    )
+
+    observation = knowledge_base.run("memory foam mattress")
+
+    assert observation == catalog_passages[0]
+
+
+def test_direct_retrieval_without_results():
+    knowledge_base = DirectRetrievalKnowledgeBase(
+        StaticRetriever(documents=[]), token_counter=word_count
+    )
+    assert knowledge_base.run("anything") == "I don't know."
+
+
+@pytest.mark.asyncio
+async def test_direct_retrieval_async(catalog_passages):
+    retriever = StaticRetriever(
+        documents=[Document(page_content=p) for p in catalog_passages]
+    )
+    knowledge_base = DirectRetrievalKnowledgeBase(
+        retriever, max_tokens=10_000, compress=True, token_counter=word_count
+    )
+    observation = await knowledge_base.arun("price")
+    assert observation.count("Price:") == len(catalog_passages)
+
+
+def test_index_terms_split_compound_words():
+    terms = index_terms("The Cloud-Comfort mattress, model EC-200")
+    assert "cloud-comfort" in terms
+    assert {"cloud", "comfort", "ec-200", "ec", "200"} <= set(terms)
+    assert "the" not in terms
+
+
+def test_bm25_retriever_ranks_exact_product_names(catalog_passages):
+    retriever = BM25Retriever.from_texts(catalog_passages, k=2)
+
+    documents = retriever.get_relevant_documents("Classic Harmony Spring")
+
+    assert documents[0].page_content.startswith("Classic Harmony Spring Mattress")
+    assert len(documents) <= 2
+    assert retriever.get_relevant_documents("zebra") == []
+
+
+def test_reciprocal_rank_fusion_merges_and_caps():
+    a, b, c = (Document(page_content=text) for text in "abc")
+    fused = reciprocal_rank_fusion([[a, b], [c, b]], weights=[0.5, 0.5], k=2)
+    assert [d.page_content for d in fused] == ["b", "a"]
+
+
+@pytest.mark.asyncio
+async def test_hybrid_retriever_fuses_rankings(catalog_passages):
+    # a dense retriever that misses the product the question names
+    dense = StaticRetriever(
+        documents=[
+            Document(page_content=p) for p in catalog_passages if "Bamboo" not in p
+        ][:2]
+    )
+    lexical = BM25Retriever.from_texts(catalog_passages, k=2)
+    retriever = HybridRetriever(retrievers=[dense, lexical], weights=[0.4, 0.6], k=2)
+
+    documents = retriever.get_relevant_documents("Plush Serenity Bamboo")
+    async_documents = await retriever.aget_relevant_documents("Plush Serenity Bamboo")
+
+    assert any(
+        d.page_content.startswith("Plush Serenity Bamboo Mattress") for d in documents
+    )
+    assert len(documents) == 2
+    assert async_documents == documents
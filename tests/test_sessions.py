@@ -0,0 +1,484 @@
+import asyncio
+import os
+import time
+from unittest.mock import patch
+
+import pytest
+
+from salesgpt.salesgptapi import ENGINES, SalesGPTAPI
+from salesgpt.sessions import (
+    MemorySessionStore,
+    MessageCoalescer,
+    ResponseReplayCache,
+    SessionBusyError,
+    SessionStore,
+    SessionTurnQueue,
+    SpillingSessionStore,
+    SQLiteSessionStore,
+    StageAnalysisTracker,
+    estimate_session_bytes,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_store_evicts_least_recently_used(clock):
+    store = MemorySessionStore(max_sessions=2, ttl=None, sizeof=lambda s: 10, clock=clock)
+    store.save("a", "session a")
+    store.save("b", "session b")
+    store.get("a")
+    store.save("c", "session c")
+
+    assert store.get("b") is None
+    assert store.get("a") == "session a"
+    assert store.stats() == {
+        "live_sessions": 2,
+        "evictions": 1,
+        "expirations": 0,
+        "estimated_bytes": 20,
+    }
+
+
+def test_store_expires_idle_sessions(clock):
+    store = MemorySessionStore(ttl=60, sizeof=lambda s: 10, clock=clock)
+    store.save("a", "session a")
+    clock.now = 30
+    store.save("b", "session b")
+    clock.now = 75
+
+    assert store.get("a") is None
+    assert store.get("b") == "session b"
+    assert store.stats()["expirations"] == 1
+    assert store.stats()["estimated_bytes"] == 10
+
+
+def test_store_evicts_by_estimated_size(clock):
+    sizes = {"small": 100, "large": 250}
+    store = MemorySessionStore(max_bytes=400, sizeof=lambda s: sizes[s], clock=clock)
+    store.save("a", "small")
+    store.save("b", "small")
+    store.save("c", "small")
+    assert len(store) == 3
+
+    store.save("b", "large")
+
+    assert "a" not in store
+    assert store.stats()["estimated_bytes"] == 350
+    store.delete("b")
+    assert store.stats()["estimated_bytes"] == 100
+
+
+def test_estimate_session_bytes_grows_with_history():
+    ENGINES.clear()
+    api = SalesGPTAPI(config_path="", use_tools=False)
+    before = estimate_session_bytes(api)
+    api.sales_agent.human_step("x" * 1000)
+
+    assert estimate_session_bytes(api) >= before + 1000
+    assert before < 5000, "A session should not own the shared engine."
+    ENGINES.clear()
+
+
+@pytest.fixture
+def sqlite_path(tmp_path):
+    return str(tmp_path / "sessions" / "sessions.sqlite")
+
+
+def test_sqlite_store_shares_conversations_between_workers(sqlite_path):
+    ENGINES.clear()
+    worker_a = SQLiteSessionStore(sqlite_path, session_factory=SalesGPTAPI.from_dict)
+    worker_b = SQLiteSessionStore(sqlite_path, session_factory=SalesGPTAPI.from_dict)
+    api = SalesGPTAPI(config_path="", use_tools=False, max_num_turns=7)
+    api.sales_agent.human_step("Hello")
+    api.sales_agent.state.conversation_stage_id = "3"
+    api.current_turn = 1
+    worker_a.save("session-1", api)
+
+    restored = worker_b.get("session-1")
+
+    assert restored is not api
+    assert restored.to_dict() == api.to_dict()
+    assert restored.max_num_turns == 7
+    assert restored.sales_agent.engine is api.sales_agent.engine
+    assert restored.sales_agent.conversation_history == ["User: Hello <END_OF_TURN>"]
+    assert worker_b.get("unknown") is None
+    mode = worker_a._connection.execute("PRAGMA journal_mode").fetchone()[0]
+    assert mode == "wal"
+    worker_a.close()
+    worker_b.close()
+    ENGINES.clear()
+
+
+def test_sqlite_store_expires_idle_sessions(sqlite_path):
+    clock = FakeClock()
+    store = SQLiteSessionStore(
+        sqlite_path, session_factory=SalesGPTAPI.from_dict, ttl=60, clock=clock
+    )
+    api = SalesGPTAPI(config_path="", use_tools=False)
+    store.save("a", api)
+    clock.now = 30
+    store.save("b", api)
+    clock.now = 75
+
+    assert store.get("a") is None
+    assert store.get("b") is not None
+    stats = store.stats()
+    assert stats["live_sessions"] == 1
+    assert stats["saves"] == 2
+    assert stats["loads"] == 1
+    store.delete("b")
+    assert store.get("b") is None
+    store.close()
+    ENGINES.clear()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_store_merges_late_stage_analysis_into_newer_turns(sqlite_path):
+    ENGINES.clear()
+    store = SQLiteSessionStore(sqlite_path, session_factory=SalesGPTAPI.from_dict)
+    release = asyncio.Event()
+
+    async def astep(self, stream=False, state=None):
+        state.conversation_history.append("Ted Lasso: Sure! <END_OF_TURN>")
+        return {}
+
+    async def determine_stage(self, state=None):
+        await release.wait()
+        state.stage_analyzed_turns = len(state.conversation_history)
+        state.conversation_stage_id = str(state.stage_analyzed_turns)
+
+    with patch("salesgpt.salesgptapi.SalesGPT.astep", astep), patch(
+        "salesgpt.salesgptapi.SalesGPT.adetermine_conversation_stage", determine_stage
+    ):
+        first = SalesGPTAPI(
+            config_path="", use_tools=False, background_stage_analysis=True
+        )
+        await first.do("hi")
+        store.update("s1", first.merge_into)
+        # the next turn restores a new object before the first stage analysis is done
+        second = store.get("s1")
+        await second.do("do you have pillows?")
+        store.update("s1", second.merge_into)
+
+        release.set()
+        await first.stage_task
+        store.update("s1", first.merge_into)
+        stored = store.get("s1").sales_agent.state
+        assert len(stored.conversation_history) == 4
+        assert stored.conversation_stage_id == "2"
+
+        await second.stage_task
+        store.update("s1", second.merge_into)
+        # a stale result never replaces a newer one
+        store.update("s1", first.merge_into)
+
+    stored = store.get("s1").sales_agent.state
+    assert len(stored.conversation_history) == 4
+    assert stored.conversation_stage_id == "4"
+    assert stored.stage_analyzed_turns == 4
+    assert stored.current_turn == 2
+    store.close()
+    ENGINES.clear()
+
+
+@pytest.mark.asyncio
+async def test_restored_session_waits_for_previous_stage_analysis(sqlite_path):
+    ENGINES.clear()
+    store = SQLiteSessionStore(sqlite_path, session_factory=SalesGPTAPI.from_dict)
+    tracker = StageAnalysisTracker()
+    replied_in_stage = []
+
+    async def astep(self, stream=False, state=None):
+        replied_in_stage.append(state.conversation_stage_id)
+        state.conversation_history.append("Ted Lasso: Sure! <END_OF_TURN>")
+        return {}
+
+    async def determine_stage(self, state=None):
+        await asyncio.sleep(0.05)
+        state.stage_analyzed_turns = len(state.conversation_history)
+        state.conversation_stage_id = "3"
+
+    with patch("salesgpt.salesgptapi.SalesGPT.astep", astep), patch(
+        "salesgpt.salesgptapi.SalesGPT.adetermine_conversation_stage", determine_stage
+    ):
+        # what run_api does per turn
+        for human_say in ["hi", "do you have pillows?"]:
+            sales_api = store.get("s1") or SalesGPTAPI(
+                config_path="", use_tools=False, background_stage_analysis=True
+            )
+            await tracker.wait("s1", sales_api)
+            await sales_api.do(human_say)
+            tracker.track("s1", sales_api)
+            store.update("s1", sales_api.merge_into)
+            assert tracker.stats() == {"pending_stage_analyses": 1}
+
+        # the second turn ran on a restored object, but still replied in the analyzed stage
+        assert replied_in_stage == ["1", "3"]
+        await sales_api.stage_task
+    assert tracker.stats() == {"pending_stage_analyses": 0}
+    store.close()
+    ENGINES.clear()
+
+
+def test_spilling_store_spills_idle_sessions_and_rehydrates(tmp_path, clock):
+    ENGINES.clear()
+    store = SpillingSessionStore(
+        str(tmp_path / "snapshots"),
+        session_factory=SalesGPTAPI.from_dict,
+        spill_after=60,
+        clock=clock,
+    )
+    idle = SalesGPTAPI(config_path="", use_tools=False)
+    idle.sales_agent.human_step("I need a new mattress")
+    store.save("idle", idle)
+    clock.now = 100
+    store.save("active", SalesGPTAPI(config_path="", use_tools=False))
+
+    stats = store.stats()
+    assert stats["live_sessions"] == 1
+    assert stats["spilled_sessions"] == 1
+    assert stats["spills"] == 1
+
+    restored = store.get("idle")
+
+    assert restored is not idle
+    assert restored.to_dict() == idle.to_dict()
+    stats = store.stats()
+    assert stats["live_sessions"] == 2
+    assert stats["spilled_sessions"] == 0
+    assert stats["rehydrations"] == 1
+    assert stats["max_rehydration_ms"] > 0
+    ENGINES.clear()
+
+
+def test_spilling_store_spills_on_eviction_and_expires_snapshots(tmp_path, clock):
+    directory = tmp_path / "snapshots"
+    store = SpillingSessionStore(
+        str(directory),
+        session_factory=SalesGPTAPI.from_dict,
+        max_sessions=1,
+        ttl=3600,
+        clock=clock,
+    )
+    store.save("a", SalesGPTAPI(config_path="", use_tools=False))
+    store.save("b", SalesGPTAPI(config_path="", use_tools=False))
+    assert store.stats()["spilled_sessions"] == 1
+
+    old = time.time() - 7200
+    for snapshot in directory.iterdir():
+        os.utime(snapshot, (old, old))
+
+    assert store.get("a") is None
+    assert store.get("b") is not None
+    store.delete("b")
+    assert store.get("b") is None
+    ENGINES.clear()
+
+
+@pytest.mark.asyncio
+async def test_turn_queue_serializes_turns_of_a_session():
+    queue = SessionTurnQueue()
+    events = []
+
+    def make_turn(name):
+        async def turn():
+            events.append(f"start {name}")
+            await asyncio.sleep(0.01)
+            events.append(f"end {name}")
+            return name
+
+        return turn
+
+    results = await asyncio.gather(
+        queue.run("s1", "hi", make_turn("first")),
+        queue.run("s1", "price?", make_turn("second")),
+        queue.run("s2", "hello", make_turn("other")),
+    )
+
+    assert results == ["first", "second", "other"]
+    assert events.index("end first") < events.index("start second")
+    assert events.index("start other") < events.index("end first")
+    assert queue.stats() == {"pending_turns": 0, "coalesced_turns": 0, "rejected_turns": 0}
+    assert not queue._locks
+
+
+@pytest.mark.asyncio
+async def test_turn_queue_coalesces_duplicates_and_bounds_pending():
+    queue = SessionTurnQueue(max_pending=2)
+    calls = []
+
+    async def turn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"response": "Hi!"}
+
+    async def rejected():
+        return "never"
+
+    first = asyncio.create_task(queue.run("s1", "hi", turn))
+    second = asyncio.create_task(queue.run("s1", "price?", turn))
+    await asyncio.sleep(0)
+    with pytest.raises(SessionBusyError):
+        await queue.run("s1", "third", rejected)
+    duplicate = await queue.run("s1", "hi", turn)
+
+    assert duplicate == await first
+    await second
+    assert len(calls) == 2
+    assert queue.stats() == {"pending_turns": 0, "coalesced_turns": 1, "rejected_turns": 1}
+
+
+@pytest.mark.asyncio
+async def test_turn_queue_propagates_failures_to_duplicates():
+    queue = SessionTurnQueue()
+
+    async def failing_turn():
+        await asyncio.sleep(0.01)
+        raise ValueError("LLM error")
+
+    results = await asyncio.gather(
+        queue.run("s1", "hi", failing_turn),
+        queue.run("s1", "hi", failing_turn),
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert queue.stats()["coalesced_turns"] == 1
+
+
+@pytest.mark.asyncio
+async def test_coalescer_merges_bursts_into_one_turn():
+    coalescer = MessageCoalescer(window=0.02)
+    turns = []
+
+    async def turn(message):
+        turns.append(message)
+        return f"answer to {message!r}"
+
+    async def send(message, delay):
+        await asyncio.sleep(delay)
+        return await coalescer.submit("s1", message, turn)
+
+    results = await asyncio.gather(
+        send("hi", 0),
+        send("quick question", 0.005),
+        send("how much is the king size?", 0.01),
+        coalescer.submit("s2", "hello", turn),
+    )
+
+    assert sorted(turns) == ["hello", "hi\nquick question\nhow much is the king size?"]
+    assert results[0] == results[1] == results[2]
+    assert coalescer.stats() == {
+        "coalescer_turns": 2,
+        "merged_messages": 2,
+        "cancelled_turns": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_coalescer_cancels_superseded_turn_and_rolls_back():
+    ENGINES.clear()
+    api = SalesGPTAPI(config_path="", use_tools=False)
+    coalescer = MessageCoalescer(window=0)
+    started = asyncio.Event()
+
+    async def slow_astep(self, stream=False, state=None):
+        started.set()
+        await asyncio.sleep(0.05)
+        state.conversation_history.append("Ted Lasso: Sure! <END_OF_TURN>")
+        return {}
+
+    async def determine_stage(self, state=None):
+        state.conversation_stage_id = "2"
+
+    with patch("salesgpt.salesgptapi.SalesGPT.astep", slow_astep), patch(
+        "salesgpt.salesgptapi.SalesGPT.adetermine_conversation_stage", determine_stage
+    ):
+        first = asyncio.create_task(coalescer.submit("s1", "hi", api.do))
+        await started.wait()
+        second = await coalescer.submit("s1", "do you have pillows?", api.do)
+
+    assert await first == second
+    assert api.sales_agent.conversation_history == [
+        "User: hi\ndo you have pillows? <END_OF_TURN>",
+        "Ted Lasso: Sure! <END_OF_TURN>",
+    ]
+    assert api.current_turn == 1
+    assert coalescer.stats()["cancelled_turns"] == 1
+    ENGINES.clear()
+
+
+@pytest.mark.asyncio
+async def test_replay_cache_replays_completed_and_in_flight_responses():
+    cache = ResponseReplayCache(max_size=10)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"response": "Hi!"}
+
+    original, retry = await asyncio.gather(
+        cache.run(("s1", "r1"), compute), cache.run(("s1", "r1"), compute)
+    )
+    late_retry = await cache.run(("s1", "r1"), compute)
+    other = await cache.run(("s1", "r2"), compute)
+
+    assert original == retry == late_retry == other
+    assert len(calls) == 2
+    assert cache.stats() == {"replay_entries": 2, "replayed_requests": 2}
+
+
+@pytest.mark.asyncio
+async def test_replay_cache_does_not_cache_failures():
+    cache = ResponseReplayCache()
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("LLM timeout")
+        return "ok"
+
+    with pytest.raises(ConnectionError):
+        await cache.run(("s1", "r1"), flaky)
+
+    assert await cache.run(("s1", "r1"), flaky) == "ok"
+    assert len(attempts) == 2
+
+
+def test_session_store_requires_the_whole_interface():
+    class DictStore(SessionStore):
+        def __init__(self):
+            self.sessions = {}
+
+        def get(self, session_id):
+            return self.sessions.get(session_id)
+
+        def save(self, session_id, session):
+            self.sessions[session_id] = session
+
+        def delete(self, session_id):
+            self.sessions.pop(session_id, None)
+
+    with pytest.raises(TypeError):
+        DictStore()
+
+    class CountingDictStore(DictStore):
+        def stats(self):
+            return {"sessions": len(self.sessions)}
+
+    store = CountingDictStore()
+    store.update("a", lambda stored: stored or "session")
+    assert store.get("a") == "session"
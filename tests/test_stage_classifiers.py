@@ -0,0 +1,292 @@
+import math
+from unittest.mock import AsyncMock, Mock, patch
+
+import litellm
+import pytest
+from langchain_community.chat_models import ChatLiteLLM
+
+from salesgpt.agents import SalesGPT
+from salesgpt.stage_classifiers import (
+    ChainStageClassifier,
+    LocalStageClassifier,
+    SingleTokenStageClassifier,
+    StageClassifier,
+    StageDecision,
+    build_stage_classifier,
+    parse_stage_id,
+    record_stage_turns,
+    summarize_stage_path,
+)
+from salesgpt.stages import CONVERSATION_STAGES
+from salesgpt.tokens import encode_tokens
+from salesgpt.usage import PromptCacheUsage, with_callback
+
+
+class FixedClassifier(StageClassifier):
+    name = "fixed"
+
+    def __init__(self, stage_id):
+        super().__init__()
+        self.stage_id = stage_id
+        self.calls = 0
+
+    def classify(self, conversation_history, conversation_stage_id, conversation_summary=None):
+        self.calls += 1
+        self.last_call = (conversation_history, conversation_summary)
+        return StageDecision(self.stage_id, 1.0, self.name)
+
+
+@pytest.fixture
+def llm():
+    return ChatLiteLLM(model="gpt-3.5-turbo")
+
+
+def test_stage_classifier_requires_classify():
+    class NoClassifier(StageClassifier):
+        name = "none"
+
+    with pytest.raises(TypeError):
+        NoClassifier()
+
+
+def test_parse_stage_id():
+    assert parse_stage_id("3", CONVERSATION_STAGES) == "3"
+    assert parse_stage_id("Stage 6.", CONVERSATION_STAGES) == "6"
+    assert parse_stage_id("12, so 4", CONVERSATION_STAGES) == "4"
+    assert parse_stage_id("Objection handling", CONVERSATION_STAGES) is None
+    assert parse_stage_id(None, CONVERSATION_STAGES) is None
+
+
+def test_chain_classifier_keeps_stage_on_invalid_output():
+    chain = AsyncMock()
+    chain.invoke = lambda **kwargs: {"text": "I am not sure."}
+    classifier = ChainStageClassifier(chain)
+
+    decision = classifier.classify(["User: Hi <END_OF_TURN>"], "2")
+
+    assert decision == StageDecision("2", 0.0, "chain")
+
+
+def test_single_token_classifier_constrains_the_answer(llm):
+    requests = []
+
+    def completion(**request):
+        requests.append(request)
+        return {
+            "choices": [
+                {
+                    "message": {"content": "4"},
+                    "logprobs": {"content": [{"token": "4", "logprob": math.log(0.9)}]},
+                }
+            ]
+        }
+
+    classifier = SingleTokenStageClassifier(llm, completion=completion)
+    decision = classifier.classify(["User: My back hurts. <END_OF_TURN>"], "3")
+
+    assert decision.stage_id == "4"
+    assert decision.confidence == pytest.approx(0.9)
+    request = requests[0]
+    assert request["max_tokens"] == 1
+    assert sorted(request["logit_bias"]) == sorted(
+        encode_tokens(stage_id)[0] for stage_id in CONVERSATION_STAGES
+    )
+    assert set(request["logit_bias"].values()) == {100}
+    assert request["messages"][0]["content"] == classifier.system_prompt
+    assert "User: My back hurts." in request["messages"][1]["content"]
+
+
+@pytest.mark.asyncio
+async def test_single_token_classifier_async(llm):
+    acompletion = AsyncMock(return_value={"choices": [{"message": {"content": "7"}}]})
+    classifier = SingleTokenStageClassifier(llm, logprobs=False, acompletion=acompletion)
+
+    decision = await classifier.aclassify(["User: Let's do it. <END_OF_TURN>"], "6")
+
+    assert decision == StageDecision("7", 1.0, "single_token")
+    assert "logprobs" not in acompletion.call_args.kwargs
+
+
+@pytest.mark.asyncio
+async def test_single_token_classifier_retries_and_reports_usage_on_both_paths(llm):
+    usage = PromptCacheUsage()
+    llm = with_callback(llm, usage)
+    response = {
+        "choices": [{"message": {"content": "2"}}],
+        "usage": {"prompt_tokens": 100, "prompt_tokens_details": {"cached_tokens": 80}},
+    }
+    timeout = litellm.Timeout("timed out", model="gpt-3.5-turbo", llm_provider="openai")
+    completion = Mock(side_effect=[timeout, response])
+    acompletion = AsyncMock(side_effect=[timeout, response])
+    classifier = SingleTokenStageClassifier(
+        llm, logprobs=False, completion=completion, acompletion=acompletion
+    )
+
+    # skip the backoff between attempts
+    with patch("tenacity.wait.wait_exponential.__call__", return_value=0):
+        decision = classifier.classify(["User: Hi <END_OF_TURN>"], "1")
+        adecision = await classifier.aclassify(["User: Hi <END_OF_TURN>"], "1")
+
+    assert decision == adecision == StageDecision("2", 1.0, "single_token")
+    assert completion.call_count == acompletion.await_count == 2
+    assert usage.stats()["llm_calls"] == 2
+    assert usage.stats()["cached_prompt_tokens"] == 160
+
+
+@pytest.mark.parametrize("model", ["claude-2", "bedrock/anthropic.claude-v2"])
+def test_single_token_classifier_sends_only_supported_params(model):
+    requests = []
+
+    def completion(**request):
+        # the params litellm would reject for this provider
+        litellm.get_optional_params(
+            model=model,
+            custom_llm_provider=litellm.get_llm_provider(model)[1],
+            frequency_penalty=None,
+            **{key: request[key] for key in ("logit_bias", "logprobs") if key in request},
+        )
+        requests.append(request)
+        return {"choices": [{"message": {"content": "Stage 3"}}]}
+
+    classifier = SingleTokenStageClassifier(ChatLiteLLM(model=model), completion=completion)
+    decision = classifier.classify(["User: My back hurts. <END_OF_TURN>"], "2")
+
+    assert decision == StageDecision("3", 1.0, "single_token")
+    assert "logit_bias" not in requests[0]
+    assert "logprobs" not in requests[0]
+    assert requests[0]["max_tokens"] == 1
+
+
+def test_single_token_classifier_rejects_multi_token_stage_ids(llm):
+    with pytest.raises(ValueError):
+        SingleTokenStageClassifier(llm, conversation_stages={"1": "Intro", "10": "Later"})
+
+
+def test_local_classifier_decides_clear_turns_locally():
+    fallback = FixedClassifier("2")
+    classifier = LocalStageClassifier(fallback=fallback)
+    cases = {
+        "User: Honestly, that is way too expensive. <END_OF_TURN>": "6",
+        "User: Great, let's schedule a demo. <END_OF_TURN>": "7",
+        "User: Not interested, bye. <END_OF_TURN>": "8",
+    }
+
+    for turn, stage_id in cases.items():
+        decision = classifier.classify(["Ted Lasso: Hi! <END_OF_TURN>", turn], "3")
+        assert decision.stage_id == stage_id
+        assert decision.classifier == "local"
+
+    assert fallback.calls == 0
+    assert classifier.classify([], "5").stage_id == "1"
+
+
+@pytest.mark.asyncio
+async def test_local_classifier_escalates_ambiguous_turns():
+    fallback = FixedClassifier("2")
+    classifier = LocalStageClassifier(fallback=fallback, confidence_threshold=0.5)
+
+    decision = await classifier.aclassify(["User: hmm okay <END_OF_TURN>"], "3")
+
+    assert decision == StageDecision("2", 1.0, "fixed")
+    assert classifier.stats() == {"local_decisions": 0, "escalations": 1}
+
+
+def test_build_stage_classifier_validates_options(llm, tmp_path):
+    with pytest.raises(ValueError):
+        build_stage_classifier("regex", llm, None)
+    with pytest.raises(ValueError):
+        build_stage_classifier("local", llm, None, fallback="local")
+
+    examples = tmp_path / "examples.json"
+    examples.write_text('[["We need a quote for 40 beds", "7"]]')
+    classifier = build_stage_classifier(
+        "local", llm, None, fallback="none", examples_path=str(examples)
+    )
+    assert classifier.fallback is None
+    assert classifier.example_stages == ["7"]
+
+
+def test_engine_uses_configured_stage_classifier(llm):
+    engine = SalesGPT.from_llm(
+        llm,
+        use_tools=False,
+        stage_classifier="local",
+        stage_classifier_config={"fallback": "chain"},
+    )
+    session = engine.new_session()
+    session.human_step("Sounds good, how do I order one?")
+
+    with patch.object(
+        type(engine.stage_analyzer_chain), "invoke", return_value={"text": "3"}
+    ) as invoke:
+        session.determine_conversation_stage()
+
+    invoke.assert_not_called()
+    assert session.conversation_stage_id == "7"
+    assert session.current_conversation_stage.startswith("Close")
+
+
+def test_stage_path_is_merged_and_capped():
+    path = []
+    record_stage_turns(path, "1", 2)
+    record_stage_turns(path, "1", 2)
+    record_stage_turns(path, "2", 0)
+    assert path == [["1", 4]]
+    for stage_id in "23456787":
+        record_stage_turns(path, stage_id, 1, max_segments=4)
+
+    assert path == [["6", 1], ["7", 1], ["8", 1], ["7", 1]]
+    assert summarize_stage_path([], 0) == "The conversation has just started."
+    assert summarize_stage_path([["1", 2], ["4", 3]], 5) == (
+        "5 turns so far. Stages, most recent last: 1 Introduction (2 turns), 4 Needs analysis (3 turns)."
+    )
+
+
+def test_incremental_stage_analysis_sends_only_new_turns(llm):
+    engine = SalesGPT.from_llm(llm, use_tools=False, incremental_stage_analysis=True)
+    classifier = FixedClassifier("4")
+    engine.stage_classifier = classifier
+    session = engine.new_session()
+
+    for i in range(30):
+        session.conversation_history.append(f"Ted Lasso: Question {i} <END_OF_TURN>")
+        session.human_step(f"Answer {i}")
+        session.determine_conversation_stage()
+        turns, summary = classifier.last_call
+        assert turns == [
+            f"Ted Lasso: Question {i} <END_OF_TURN>",
+            f"User: Answer {i} <END_OF_TURN>",
+        ]
+        assert len(summary) < 200
+
+    assert session.stage_analyzed_turns == 60
+    assert session.stage_path == [["1", 2], ["4", 58]]
+    assert summary.startswith("58 turns so far.")
+
+    session.determine_conversation_stage()
+    assert classifier.last_call[0] == []
+    session.seed_agent()
+    assert session.stage_analyzed_turns == 0 and session.stage_path == []
+
+
+@pytest.mark.asyncio
+async def test_chain_classifier_uses_incremental_prompt(llm):
+    engine = SalesGPT.from_llm(llm, use_tools=False, incremental_stage_analysis=True)
+    session = engine.new_session()
+    session.human_step("My back hurts every morning.")
+
+    with patch.object(
+        type(engine.stage_analyzer_chain),
+        "ainvoke",
+        new_callable=AsyncMock,
+        return_value={"text": "4"},
+    ) as ainvoke:
+        await session.adetermine_conversation_stage()
+
+    inputs = ainvoke.call_args.kwargs["input"]
+    assert inputs["conversation_summary"] == "The conversation has just started."
+    assert inputs["conversation_history"] == "User: My back hurts every morning. <END_OF_TURN>"
+    assert "conversation_summary" in (
+        engine.get_stage_classifier()._incremental_chain.prompt.input_variables
+    )
+    assert session.conversation_stage_id == "4"
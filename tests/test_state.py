@@ -0,0 +1,77 @@
+import json
+import sys
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from langchain_community.chat_models import ChatLiteLLM
+
+from salesgpt.agents import SalesGPT
+from salesgpt.salesgptapi import ENGINES, SalesGPTAPI
+from salesgpt.state import ConversationState, SalesGPTSession
+
+
+@pytest.fixture
+def engine():
+    return SalesGPT.from_llm(ChatLiteLLM(model="gpt-3.5-turbo"), use_tools=False)
+
+
+def test_conversation_state_round_trip():
+    state = ConversationState(["User: Hi <END_OF_TURN>"], conversation_stage_id="2")
+    state.current_turn = 3
+
+    restored = ConversationState.from_dict(json.loads(json.dumps(state.to_dict())))
+
+    assert restored.to_dict() == state.to_dict()
+    assert restored.current_conversation_stage.startswith("Qualification")
+    assert not hasattr(state, "__dict__"), "States should stay small."
+    assert sys.getsizeof(state) < 110
+
+
+def test_sessions_share_engine_without_mutating_it(engine):
+    first = engine.new_session()
+    second = engine.new_session()
+
+    first.human_step("Do you sell pillows?")
+
+    assert first.conversation_history == ["User: Do you sell pillows? <END_OF_TURN>"]
+    assert second.conversation_history == []
+    assert engine.conversation_history == []
+    assert first.salesperson_name == engine.salesperson_name
+
+
+@pytest.mark.asyncio
+async def test_session_steps_update_only_their_state(engine):
+    session = engine.new_session()
+    session.human_step("Hello")
+    chain = engine.sales_conversation_utterance_chain
+    with patch.object(
+        type(chain), "ainvoke", new_callable=AsyncMock, return_value={"text": "Hi there!"}
+    ), patch.object(
+        type(engine.stage_analyzer_chain),
+        "ainvoke",
+        new_callable=AsyncMock,
+        return_value={"text": "2"},
+    ):
+        await session.astep()
+        await session.adetermine_conversation_stage()
+
+    assert session.conversation_history[-1] == "Ted Lasso: Hi there! <END_OF_TURN>"
+    assert session.conversation_stage_id == "2"
+    assert engine.conversation_stage_id == "1"
+    assert engine.conversation_history == []
+
+
+def test_api_sessions_share_one_engine():
+    ENGINES.clear()
+    first = SalesGPTAPI(config_path="", use_tools=False)
+    second = SalesGPTAPI(config_path="", use_tools=False)
+
+    assert isinstance(first.sales_agent, SalesGPTSession)
+    assert first.sales_agent.engine is second.sales_agent.engine
+    assert len(ENGINES) == 1
+
+    first.current_turn += 1
+    first.sales_agent.human_step("Hello")
+    assert second.current_turn == 0
+    assert second.sales_agent.conversation_history == []
+    ENGINES.clear()
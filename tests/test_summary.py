@@ -0,0 +1,181 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from langchain_community.chat_models import ChatLiteLLM
+
+from salesgpt.agents import SalesGPT
+from salesgpt.chains import ConversationSummaryChain
+from salesgpt.salesgptapi import ENGINES, SalesGPTAPI
+from salesgpt.sessions import SQLiteSessionStore
+
+
+@pytest.fixture
+def engine():
+    return SalesGPT.from_llm(
+        ChatLiteLLM(model="gpt-3.5-turbo"),
+        use_tools=False,
+        summarize_after_turns=8,
+        summary_keep_recent_turns=4,
+    )
+
+
+def add_turns(session, count):
+    for i in range(count):
+        session.conversation_history.append(f"User: message {i} <END_OF_TURN>")
+
+
+def test_summary_is_only_needed_past_the_threshold(engine):
+    session = engine.new_session()
+    add_turns(session, 8)
+    assert not engine.needs_summary(session.state)
+
+    add_turns(session, 1)
+    assert engine.needs_summary(session.state)
+
+    engine.summarize_after_turns = None
+    assert not engine.needs_summary(session.state)
+
+
+@pytest.mark.asyncio
+async def test_summary_replaces_older_turns_in_prompts(engine):
+    session = engine.new_session()
+    add_turns(session, 10)
+
+    with patch.object(
+        ConversationSummaryChain,
+        "ainvoke",
+        new_callable=AsyncMock,
+        return_value={"text": " Prospect sleeps badly and finds memory foam too hot. "},
+    ) as ainvoke:
+        assert await session.asummarize_conversation()
+
+    inputs = ainvoke.call_args.args[0]
+    assert inputs["new_turns"].splitlines() == session.conversation_history[:6]
+    assert session.summarized_turns == 6
+    assert len(session.conversation_history) == 10
+    history = engine.format_conversation_history(session.state).splitlines()
+    assert history == [
+        "Summary of the earlier conversation: Prospect sleeps badly and finds memory foam too hot."
+    ] + session.conversation_history[6:]
+
+    turns, _, _ = engine._stage_analysis_inputs(session.state)
+    assert turns[0].startswith("Summary of the earlier conversation")
+
+    session.seed_agent()
+    assert session.conversation_summary == "" and session.summarized_turns == 0
+
+
+@pytest.mark.asyncio
+async def test_stale_or_failed_summaries_are_discarded(engine):
+    session = engine.new_session()
+    add_turns(session, 10)
+
+    async def reset_meanwhile(inputs):
+        session.seed_agent()
+        return {"text": "Old conversation."}
+
+    with patch.object(ConversationSummaryChain, "ainvoke", side_effect=reset_meanwhile):
+        assert not await session.asummarize_conversation()
+    assert session.conversation_summary == ""
+
+    add_turns(session, 10)
+    with patch.object(
+        ConversationSummaryChain, "ainvoke", side_effect=RuntimeError("rate limited")
+    ):
+        assert not await session.asummarize_conversation()
+    assert session.summarized_turns == 0
+
+
+@pytest.mark.asyncio
+async def test_api_summarizes_off_the_response_path(tmp_path):
+    config_path = tmp_path / "agent.json"
+    config_path.write_text(
+        '{"summarize_after_turns": 4, "summary_keep_recent_turns": 2}'
+    )
+    ENGINES.clear()
+    api = SalesGPTAPI(config_path=str(config_path), use_tools=False)
+    chain = api.sales_agent.sales_conversation_utterance_chain
+    release = asyncio.Event()
+
+    async def slow_summary(inputs):
+        await release.wait()
+        return {"text": "Prospect wants a firmer mattress."}
+
+    with patch.object(
+        type(chain), "ainvoke", new_callable=AsyncMock, return_value={"text": "Sure."}
+    ), patch.object(
+        SalesGPT, "adetermine_conversation_stage", new_callable=AsyncMock
+    ), patch.object(
+        ConversationSummaryChain, "ainvoke", side_effect=slow_summary
+    ):
+        for i in range(3):
+            await api.do(f"Question {i}")
+        task = api.sales_agent.summary_task
+
+        # the reply was returned while the summary is still running
+        assert task is not None and not task.done()
+        assert api.sales_agent.schedule_summary() is None
+        await api.do("Question 3")
+
+        release.set()
+        assert await task
+    assert api.sales_agent.summarized_turns == 6
+    assert api.to_dict()["state"]["conversation_summary"] == (
+        "Prospect wants a firmer mattress."
+    )
+    ENGINES.clear()
+
+
+@pytest.mark.asyncio
+async def test_late_summary_is_merged_into_newer_stored_turns(tmp_path):
+    config_path = tmp_path / "agent.json"
+    config_path.write_text(
+        '{"summarize_after_turns": 4, "summary_keep_recent_turns": 2}'
+    )
+    ENGINES.clear()
+    store = SQLiteSessionStore(
+        str(tmp_path / "sessions.sqlite"), session_factory=SalesGPTAPI.from_dict
+    )
+    first = SalesGPTAPI(config_path=str(config_path), use_tools=False)
+    chain = first.sales_agent.sales_conversation_utterance_chain
+    release = asyncio.Event()
+
+    async def slow_summary(inputs):
+        await release.wait()
+        return {"text": f"Summary of {len(inputs['new_turns'].splitlines())} turns."}
+
+    with patch.object(
+        type(chain), "ainvoke", new_callable=AsyncMock, return_value={"text": "Sure."}
+    ), patch.object(
+        SalesGPT, "adetermine_conversation_stage", new_callable=AsyncMock
+    ), patch.object(
+        ConversationSummaryChain, "ainvoke", side_effect=slow_summary
+    ):
+        for i in range(3):
+            await first.do(f"Question {i}")
+            store.update("s1", first.merge_into)
+        # the next turn runs on a restored object while the summary is still running
+        second = store.get("s1")
+        await second.do("Question 3")
+        store.update("s1", second.merge_into)
+
+        release.set()
+        assert await first.sales_agent.summary_task
+        store.update("s1", first.merge_into)
+        stored = store.get("s1").sales_agent.state
+        assert len(stored.conversation_history) == 8
+        assert stored.summarized_turns == 4
+        assert stored.conversation_summary == "Summary of 4 turns."
+
+        assert await second.sales_agent.summary_task
+        store.update("s1", second.merge_into)
+        store.update("s1", first.merge_into)
+
+    stored = store.get("s1").sales_agent.state
+    assert len(stored.conversation_history) == 8
+    assert stored.current_turn == 4
+    assert stored.summarized_turns == 6
+    assert stored.conversation_summary == "Summary of 6 turns."
+    store.close()
+    ENGINES.clear()
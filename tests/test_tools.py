@@ -1,5 +1,7 @@
 import pytest
 from unittest.mock import patch, MagicMock
+from langchain_community.chat_models import ChatLiteLLM
+from salesgpt.agents import SalesGPT
 from salesgpt.tools import generate_stripe_payment_link, send_email_tool, generate_calendly_invitation_link
 import os
 import json
@@ -69,4 +71,19 @@ def test_generate_calendly_invitation_link(mock_requests):
     result = generate_calendly_invitation_link("query about a meeting")
 
     assert result == "url: https://mocked_calendly_link.com", "The function should return the URL from the mocked response."
-    mock_requests.assert_called_once()
\ No newline at end of file
+    mock_requests.assert_called_once()
+
+def test_agent_builds_knowledge_base_once():
+    knowledge_base = MagicMock()
+    with patch(
+        "salesgpt.agents.setup_knowledge_base", return_value=knowledge_base
+    ) as setup, patch("salesgpt.tools.setup_knowledge_base") as tools_setup:
+        agent = SalesGPT.from_llm(
+            ChatLiteLLM(model="gpt-3.5-turbo"),
+            use_tools=True,
+            product_catalog="examples/sample_product_catalog.txt",
+        )
+
+    setup.assert_called_once()
+    tools_setup.assert_not_called()
+    assert agent.knowledge_base is knowledge_base
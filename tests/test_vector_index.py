@@ -0,0 +1,57 @@
+import numpy as np
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+from salesgpt.vector_index import MemmapRetriever, MemmapVectorIndex
+
+TEXTS = [
+    "Luxury Cloud-Comfort Memory Foam Mattress. Price: $999",
+    "Classic Harmony Spring Mattress. Price: $1,299",
+    "EcoGreen Hybrid Latex Mattress. Price: $1,599",
+]
+
+
+def test_build_and_load_memory_mapped_index(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=32)
+    index_dir = str(tmp_path / "index")
+    MemmapVectorIndex.build(
+        index_dir, TEXTS, embeddings, metadatas=[{"product": i} for i in range(3)]
+    )
+
+    index = MemmapVectorIndex.load(index_dir)
+    assert len(index) == 3
+    assert isinstance(index.vectors, np.memmap), "Vectors should be memory-mapped."
+    assert not index.vectors.flags.writeable
+
+    hits = index.search(embeddings.embed_query(TEXTS[1]), k=2)
+    assert hits[0][0] == 1
+    assert hits[0][1] > hits[1][1]
+    assert index.record(1) == {"text": TEXTS[1], "metadata": {"product": 1}}
+
+
+def test_load_or_build_reuses_existing_index(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=32)
+    index_dir = str(tmp_path / "index")
+    MemmapVectorIndex.load_or_build(index_dir, TEXTS, embeddings)
+    index = MemmapVectorIndex.load_or_build(index_dir, ["ignored"], embeddings)
+    assert len(index) == 3
+
+
+def test_memmap_retriever_returns_documents(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=32)
+    index = MemmapVectorIndex.build(str(tmp_path / "index"), TEXTS, embeddings)
+    retriever = MemmapRetriever(index=index, embeddings=embeddings, k=1)
+
+    documents = retriever.get_relevant_documents(TEXTS[2])
+    assert [document.page_content for document in documents] == [TEXTS[2]]
+    assert "score" in documents[0].metadata
+
+
+def test_build_empty_index(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=32)
+    index_dir = str(tmp_path / "index")
+    index = MemmapVectorIndex.build(index_dir, [], embeddings)
+    retriever = MemmapRetriever(index=index, embeddings=embeddings)
+
+    assert len(index) == 0
+    assert len(MemmapVectorIndex.load(index_dir)) == 0
+    assert retriever.get_relevant_documents("latex mattress") == []